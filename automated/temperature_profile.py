@@ -8,18 +8,23 @@ import matplotlib.pyplot as plt
 from scipy.optimize import least_squares
 from tqdm import tqdm
 
-from read_raw import load_blue
-from error_funcs import oned_gaussian_func
+from read_raw import RawReader, prefetch
+from util import get_dtype
+from running_stats import FrameStats
+from error_funcs import oned_gaussian_func, jacobian_oned_gaussian_func
+from batch_fitting import batch_least_squares
 
 X_DIM = 1200
 Y_DIM = 1920
 FRAME_PER_SCAN = 20
-x_r = (480, 580)
+PRED_X_CENTER = 520
+INTERVAL = 100
+# Rows searched for the peak and columns fitted; only this band is read and demosaiced
+x_r = (PRED_X_CENTER - INTERVAL//2, PRED_X_CENTER + INTERVAL//2)
 y_r = (400, 1000)
 x_shape = x_r[1]-x_r[0]
 y_shape = y_r[1]-y_r[0]
-PRED_X_CENTER = 520
-INTERVAL = 100
+raw_reader = RawReader(x_r=x_r, y_r=y_r)
 
 def analyze(dir_path: str, critical_distance: float):
     # Function for each velocity?
@@ -51,11 +56,11 @@ def get_avg_background(paths: list):
     bg_dir = get_bg_dir(paths)
 
     bg_fn_ls = list(bg_dir.glob("*.raw"))
-    bg = np.zeros((len(bg_fn_ls)//FRAME_PER_SCAN, FRAME_PER_SCAN, X_DIM, Y_DIM))
+    bg = FrameStats()
     for bg_fn in tqdm(bg_fn_ls):
         run, frame = parse_raw_fn(os.path.basename(str(bg_fn)))
-        bg[run, frame, :, :] = load_blue(bg_fn)
-    return np.mean(bg, axis=0)
+        bg.update(frame, raw_reader.load_blue(bg_fn))
+    return bg.mean
 
 
 def get_live_frames(paths: list):
@@ -70,37 +75,33 @@ def get_live_frames(paths: list):
 
 def load_data(dir_path: str):
     img_paths = sorted(list(dir_path.glob("*.raw")))
-    imgs = np.zeros((len(img_paths), X_DIM, Y_DIM))
+    imgs = np.zeros((len(img_paths), x_shape, y_shape), dtype=get_dtype())
 
-    for idx, path in enumerate(img_paths):
-        imgs[idx] = load_blue(path)
+    for idx, img in enumerate(prefetch(img_paths, loader=raw_reader.load_blue)):
+        imgs[idx] = img
    
     return imgs
 
      
 
 def single_frame_fitting(data):
-    t = []
-    x = np.arange(y_shape)
+    # data is the x_r, y_r band of a frame
     x0 = [0.0, y_shape//2, y_shape//2]
     bounds = ([0., y_shape//2 - 200, 0], [0.3, y_shape//2 + 200, y_shape*3])
-    for i in range(INTERVAL):
-        err = lambda p: (np.ravel(oned_gaussian_func(*p)(x))
-                        - data[PRED_X_CENTER - INTERVAL//2 + i, y_r[0]:y_r[1]])
-        pfit = least_squares(err, x0, bounds=bounds)
-        t.append(pfit.x)
-    t = np.array(t)
+    t, _ = batch_least_squares(oned_gaussian_func, data, x0, bounds=bounds)
 
     x = np.arange(INTERVAL)
     err = lambda p: np.ravel(oned_gaussian_func(*p)(x)) - t[:,0]
-    pfit = least_squares(err, [0.0, 40., 50.], bounds=([0., 30., 0.], [0.5, 50., 150.]))
-    peak_loc = int( np.round(PRED_X_CENTER - INTERVAL//2 + pfit.x[1]))
+    pfit = least_squares(err, [0.0, 40., 50.], jac=lambda p: jacobian_oned_gaussian_func(*p)(x).T,
+                         bounds=([0., 30., 0.], [0.5, 50., 150.]))
+    peak_loc = int(np.round(pfit.x[1]))
 
     x = np.arange(y_shape)
-    plt.plot(data[peak_loc, y_r[0]:y_r[1]])
+    plt.plot(data[peak_loc])
     plt.show()
-    err = lambda p: np.ravel(oned_gaussian_func(*p)(x)) - data[peak_loc, y_r[0]:y_r[1]]
-    pfit = least_squares(err, x0, bounds=bounds)
+    err = lambda p: np.ravel(oned_gaussian_func(*p)(x)) - data[peak_loc]
+    pfit = least_squares(err, x0, jac=lambda p: jacobian_oned_gaussian_func(*p)(x).T,
+                         bounds=bounds)
     return pfit.x
 
 
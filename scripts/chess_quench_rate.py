@@ -11,6 +11,7 @@ from matplotlib.colors import ListedColormap
 from tqdm import tqdm
 
 from read_raw import load_blue
+from bg_cache import BackgroundCache
 from new_process import get_current_position_dict
 from temp_calibration import fit_xy_to_z_surface_with_func
 from error_funcs import linear, twod_surface, width_surface, two_exp, two_gaussian
@@ -41,6 +42,7 @@ kappa = {9.0: 0.0001757,
 
 PXL_SIZE = 1.04 * 10** -3 # mm
 cmap = ListedColormap(['r', 'g', 'b'])
+bg_cache = BackgroundCache()
 
 def fit_and_plot(x, y, z, surface_func, params, zlabel, verbose=False):
      x_grid = np.linspace(np.log10(9), np.log10(350), 10)
@@ -73,10 +75,7 @@ if __name__ == "__main__":
         bg_fp = home / "Desktop" / "chess_width" / f"chess_2022_{int(velo)}_bg"
         bg = list(bg_fp.glob('*'))[0]
         bgs = sorted(list(bg.glob('*.raw')))
-        bg_data = np.zeros((15, 1200, 1920))
-        for idx, bg in enumerate(bgs):
-            bg_data[idx] = load_blue(bg)
-        bg = np.mean(bg_data, axis=0)
+        bg = bg_cache.average(bgs)
     
 
         raw_fp = home / "Desktop" / "chess_width" / f"chess_2022_{int(velo)}"
@@ -11,8 +11,10 @@ from matplotlib.colors import ListedColormap
 from tqdm import tqdm
 
 from read_raw import load_blue
+from bg_cache import BackgroundCache
 from new_process import get_current_position_dict
 from temp_calibration import fit_xy_to_z_surface_with_func
+from batch_fitting import batch_least_squares
 from error_funcs import linear, twod_surface, width_surface, two_exp, two_gaussian
 from error_funcs import test_new_temp_surface, two_reciprocal,  pearson3_func, two_lorentz
 from error_funcs import two_lorentz_gradient, oned_gaussian_func
@@ -41,6 +43,7 @@ kappa = {9.0: 0.0001757,
 
 PXL_SIZE = 1.04 * 10** -3 # mm
 cmap = ListedColormap(['r', 'g', 'b'])
+bg_cache = BackgroundCache()
 
 if __name__ == "__main__":
     home = Path.home()
@@ -81,7 +84,8 @@ if __name__ == "__main__":
             frame = target[float(velo[:velo.index("mm")])]
             pos = current_position_dict[current] 
             data = load_blue(dir_path / f"{pos}_{current}_{str(frame).zfill(3)}.raw")
-            bg   = load_blue(dir_path / f"{pos}_0W_{str(frame).zfill(3)}.raw")
+            bg   = bg_cache.average([dir_path / f"{pos}_0W_{str(frame).zfill(3)}.raw"],
+                                    position=pos, frame=frame)
             r = (data-bg)/bg # delta R/R
             
             location_heat_rate = []
@@ -89,14 +93,16 @@ if __name__ == "__main__":
             if current in d:
                 if int(current[:-1]) > 30:
                     center = int(np.round(d[current][frame][1]+Y_MIN))
+                    avgs = []
                     for i in range(50):
                         avg = np.mean(r[:, center-125+5*i:center-125+5*(i+1)],
                                       axis=1)      # Average around the center to get better
                         y_center = np.argmax(avg)  # fidelity of the maximum point in y
-                        avg = avg[y_center - interval : y_center + interval]
-                        x = np.arange(2*interval)
-                        err = lambda p: fit_func(*p)(x) - avg # linearly fit the quench
-                        fit, _ = leastsq(err, [.05, float(interval), 1.,  1.])
+                        avgs.append(avg[y_center - interval : y_center + interval])
+                    x = np.arange(2*interval)
+                    window_fits, _ = batch_least_squares(fit_func, np.array(avgs),
+                                                         [.05, float(interval), 1.,  1.])
+                    for fit in window_fits:
                         grad = gradient_func(*fit)(x)/kappa[velocity]/PXL_SIZE*velocity
                         location_heat_rate.append(np.max(grad))
                         location_cool_rate.append(np.abs(np.min(grad)))
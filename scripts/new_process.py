@@ -2,7 +2,6 @@ import os
 from time import time
 from pathlib import Path
 from time import time
-from multiprocessing import Pool
 import sys
 import json
 sys.path.insert(0, '../src')
@@ -11,12 +10,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
-from read_raw import load_background_series, load_blue
+from read_raw import load_background_series, prefetch
 from preprocess import parrallel_processing_frames
 from fitting import fit_gaussian, fit_pv, fit_two_lorentz
+from batch_fitting import batch_fit_gaussian
 from error_funcs import oned_gaussian_func, two_lorentz
 from util import sort_current, parse_fn, get_current_position_dict, get_fn_fmt, get_cond_from_fn
 from util import get_bg_keys_at, is_bg, BG_CURRENT
+from catalog import Catalog
+from shared_frames import SharedFrames
 
 ### Constants ###
 Y_MIN = 800
@@ -26,32 +28,44 @@ INTERVAL = 100
 
 
 ################# Helper funcs for parrerllization ######################
-def single_frame_fitting(data):
-    t = []
-    for j in range(INTERVAL): # This define the search region for peak center
-        pfit, _ = fit_gaussian(data[PRED_X_CETNER - INTERVAL//2 + j, Y_MIN:Y_MAX])
-        t.append(pfit)
-    t = np.array(t)
+# Rows and columns of the search region for peak center
+SEARCH_ROI = ((PRED_X_CETNER - INTERVAL//2, PRED_X_CETNER + INTERVAL//2), (Y_MIN, Y_MAX))
+
+def search_region_fitting(region):
+    ''' Fit of the peak row of the search region, returns (fit + err, row in region) '''
+    # Rows of the search region, fitted all at once
+    t, _ = batch_fit_gaussian(region)
     fit, _ = fit_gaussian(t[:,0])
-    pfit, err = fit_two_lorentz(data[int(np.round(PRED_X_CETNER - INTERVAL//2 + fit[1])), Y_MIN:Y_MAX])
-    return np.append(pfit, err).tolist(), int(np.round(PRED_X_CETNER - INTERVAL//2 + fit[1]))
+    row = int(np.round(fit[1]))
+    pfit, err = fit_two_lorentz(region[row])
+    return np.append(pfit, err).tolist(), row
+
+def single_frame_fitting(data):
+    (x_min, x_max), (y_min, y_max) = SEARCH_ROI
+    pfit, row = search_region_fitting(data[x_min:x_max, y_min:y_max])
+    return pfit, x_min + row
 
 def parellel_fitting(data):
-    with Pool() as pool:
-        pfit = pool.map(single_frame_fitting, data)
-        return pfit
+    ''' single_frame_fitting of every frame, the search regions are read from shared memory '''
+    with SharedFrames(data) as frames:
+        pfit = frames.starmap(search_region_fitting, roi=SEARCH_ROI)
+    return [(fit, SEARCH_ROI[0][0] + row) for fit, row in pfit]
 
 if __name__ == "__main__":
     home = Path.home()
     raw_fp = Path("/Volumes/Samsung_T5/TR_0412/")
-    dir_paths = raw_fp.glob("*mm per sec")
+    # Kept off the data drive
+    catalog_fp = home / ".cache" / "tfc" / "TR_0412_catalog.sqlite"
+    catalog = Catalog(raw_fp, db_path=catalog_fp)
+    catalog.scan(pattern="*mm per sec")
+    dir_paths = catalog.directories()
     
     for dir_path in dir_paths:
         print(f"working on {str(dir_path)}")
         ####### getting file path and list of current #####3###
         current_ls = set() 
         current_position_dict = {}
-        fps = sorted(list(dir_path.glob("*.raw")))
+        fps = catalog.query(dir=dir_path)
         current_position_dict = get_current_position_dict(fps)
 
         current_ls = list(current_position_dict)
@@ -65,17 +79,16 @@ if __name__ == "__main__":
             position = current_position_dict[current]
             bgs = load_background_series(position, fps) 
 
-            data = []
-            for idx, _ in enumerate(bgs):
-                data.append(load_blue(str(dir_path  / 
-                         (get_fn_fmt(position, current, str(idx).zfill(3)) + ".raw"))))
+            data_fps = [str(dir_path / (get_fn_fmt(position, current, str(idx).zfill(3)) + ".raw"))
+                        for idx, _ in enumerate(bgs)]
+            data = list(prefetch(data_fps))
                
             ######### Process data #########3
             bgs = np.array(bgs)
             data = np.array(data)
             r = (data - bgs)/bgs
  
-            result = parrerllel_fitting(r)
+            result = parellel_fitting(r)
             oned_fit = [] 
             # oned_fits.append(oned_fit)
             for idx, fit in enumerate(result):
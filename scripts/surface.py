@@ -10,9 +10,6 @@ import matplotlib.pyplot as plt
 from scipy.optimize import leastsq
 from matplotlib.colors import ListedColormap
 from scipy.optimize import leastsq
-import dill
-from sympy.utilities.lambdify import lambdify
-from sympy import Symbol, solve
 
 from util import sort_current
 from error_funcs import temp_surface, twod_surface, temp_surface_sp, new_temp_surface, linear
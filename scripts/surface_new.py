@@ -10,9 +10,6 @@ import matplotlib.pyplot as plt
 from scipy.optimize import leastsq
 from matplotlib.colors import ListedColormap
 from scipy.optimize import leastsq
-import dill
-from sympy.utilities.lambdify import lambdify
-from sympy import Symbol, solve
 from tqdm import tqdm
 
 from util import sort_current
@@ -251,18 +248,8 @@ print(kappa)
 ############### Storing temperauture and power function ################
 #t_func = surface_func(*t)
 
-# with open("t_func.d", "wb") as f:
-#     dill.dump(fit_func, f)
-# print(t)
-# tpeak = Symbol('tpeak', real=True, positive=True)
-# velocity = Symbol('velocity', real=True, positive=True)
-# power = Symbol('power', real=True, positive=True)
-# print("here")
-# p_func = lambdify((tpeak, velocity),
-#                    solve(tpeak-fit_func(velocity, power), power)[1],
-#                    modules = "numpy")
-# with open("p_func.d", 'wb') as f:
-#     dill.dump(p_func, f)
+# The power function is the closed form inverse in inverse_calibration, e.g.
+# power, valid = power_given_log_velocity(t, log_velocity, tpeak)
 
 x = np.linspace(np.log10(9), np.log10(380), 20)
 y = np.linspace(30, 65, 10)
@@ -0,0 +1,188 @@
+'''
+Fitting many independent 1D curves of the same model at once.
+
+Every row of a (rows, points) array is fitted with Levenberg-Marquardt
+steps that are computed for all rows together, so a frame worth of row
+fits costs a handful of numpy calls per iteration instead of one scipy
+call per row. Rows converge independently and stop being updated once
+they do.
+'''
+import numpy as np
+
+from error_funcs import oned_gaussian_func, two_lorentz, get_jacobian
+from fitting import estimate_gaussian, estimate_two_lorentz, gaussian_bounds, TWO_LORENTZ_BOUNDS
+
+def batch_least_squares(func, data, param, jac=None, bounds=(-np.inf, np.inf),
+                        x=None, mask=None, max_iter=200, ftol=1e-8, xtol=1e-8,
+                        damping=1e-3):
+    '''
+    Least squares fit of func to every row of data.
+
+    Args:
+        func: model of error_funcs, e.g. oned_gaussian_func
+        data: (rows, points) array, one curve per row
+        param: starting parameters, (n_param,) for every row or (rows, n_param)
+
+    Keyword Args:
+        jac: Jacobian of func with the error_funcs jacobian_* signature,
+             looked up with get_jacobian when not given and replaced by
+             forward differences if func has none
+        bounds: (lower, upper) bounds of the parameters as in least_squares
+        x: coordinates of the points, np.arange(points) by default
+        mask: boolean (rows, points) array of the points to be fitted,
+              finite points of data by default
+        max_iter: maximum number of iterations
+        ftol, xtol: relative tolerance on the cost and on the parameters
+        damping: initial Levenberg-Marquardt damping
+
+    Return:
+        pfit: (rows, n_param) fitted parameters
+        infodict: 'fvec' residuals, 'fjac' Jacobian (rows, points, n_param),
+                  'nfev' iterations used and 'success' of every row
+    '''
+    data = np.asarray(data, dtype=float)
+    assert data.ndim == 2, "data should be a (rows, points) array."
+    n_rows, n_points = data.shape
+    x = np.arange(n_points) if x is None else np.asarray(x)
+    mask = np.isfinite(data) if mask is None else np.asarray(mask, dtype=bool)
+    data = np.where(mask, data, 0.)
+    if jac is None:
+        jac = get_jacobian(func)
+
+    pfit = np.array(np.broadcast_to(param, (n_rows, np.shape(param)[-1])), dtype=float)
+    n_param = pfit.shape[1]
+    lower = np.broadcast_to(np.asarray(bounds[0], dtype=float), (n_param,))
+    upper = np.broadcast_to(np.asarray(bounds[1], dtype=float), (n_param,))
+    # Parameters are kept strictly inside the bounds, e.g. widths bounded
+    # by 0 never reach 0, and are held once they are within 1e-6 of a bound
+    lower_in = inside_bound(lower, 1)
+    upper_in = inside_bound(upper, -1)
+    lower_near = inside_bound(lower, 1, 1e-6)
+    upper_near = inside_bound(upper, -1, 1e-6)
+    pfit = np.clip(pfit, lower_in, upper_in)
+
+    def residual(p, rows):
+        return np.where(mask[rows], func(*p.T[:, :, None])(x) - data[rows], 0.)
+
+    def jacobian(p, fvec, rows):
+        if jac is None:
+            return forward_difference(lambda p_step: residual(p_step, rows), p, fvec)
+        return np.where(mask[rows, :, None],
+                        np.moveaxis(jac(*p.T[:, :, None])(x), 0, -1), 0.)
+
+    all_rows = np.arange(n_rows)
+    fvec = residual(pfit, all_rows)
+    fjac = jacobian(pfit, fvec, all_rows)
+    cost = (fvec**2).sum(axis=1)
+    lam = np.full(n_rows, float(damping))
+    active = np.ones(n_rows, dtype=bool)
+    nfev = np.ones(n_rows, dtype=int)
+    diag_idx = np.arange(n_param)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        J = fjac[idx] # pylint: disable=invalid-name
+        A = np.einsum('rni,rnj->rij', J, J) # pylint: disable=invalid-name
+        g = np.einsum('rni,rn->ri', J, fvec[idx])
+        # Marquardt scaling, floored so that rows with a vanishing
+        # derivative (e.g. zero height) still get a solvable system
+        diag = A[:, diag_idx, diag_idx]
+        diag = np.maximum(diag, 1e-12*diag.max(axis=1, keepdims=True) + 1e-300)
+        A[:, diag_idx, diag_idx] += lam[idx, None]*diag
+        # Parameters on a bound that the gradient pushes outwards are held
+        frozen = ( ((pfit[idx] <= lower_near) & (g > 0))
+                 | ((pfit[idx] >= upper_near) & (g < 0)) )
+        A *= (~frozen)[:, :, None] & (~frozen)[:, None, :]
+        A[:, diag_idx, diag_idx] += frozen
+        g[frozen] = 0.
+        delta = -np.linalg.solve(A, g[:, :, None])[:, :, 0]
+        step_ok = np.isfinite(delta).all(axis=1)
+        delta[~step_ok] = 0.
+
+        p_new = step_inside(pfit[idx], delta, lower_in, upper_in)
+        f_new = residual(p_new, idx)
+        cost_new = np.where(step_ok, (f_new**2).sum(axis=1), np.inf)
+        nfev[idx] += 1
+
+        accept = cost_new < cost[idx]
+        small_cost = np.abs(cost[idx] - cost_new) <= ftol*cost[idx]
+        small_step = (np.abs(p_new - pfit[idx])
+                      <= xtol*(np.abs(pfit[idx]) + xtol)).all(axis=1)
+        acc = idx[accept]
+        pfit[acc] = p_new[accept]
+        fvec[acc] = f_new[accept]
+        cost[acc] = cost_new[accept]
+        lam[acc] /= 10
+        lam[idx[~accept]] *= 10
+        if acc.size:
+            fjac[acc] = jacobian(pfit[acc], fvec[acc], acc)
+
+        done = (accept & (small_cost | small_step)) | (lam[idx] > 1e16) | (cost[idx] == 0)
+        active[idx[done]] = False
+
+    infodict = {'fvec': fvec, 'fjac': fjac, 'nfev': nfev, 'success': ~active}
+    return pfit, infodict
+
+def inside_bound(bound, direction, rstep=1e-10):
+    ''' bound moved slightly inwards (direction 1 for lower, -1 for upper bounds) '''
+    with np.errstate(invalid='ignore'):
+        return np.where(np.isfinite(bound),
+                        bound + direction*rstep*np.maximum(1, np.abs(bound)), bound)
+
+def step_inside(p, delta, lower, upper, theta=0.995):
+    '''
+    p + delta, where components that would leave the bounds only go theta
+    of the way to the bound, as in the trust region reflective method.
+    '''
+    p_new = p + delta
+    p_new = np.where(p_new < lower, p + theta*(lower - p), p_new)
+    p_new = np.where(p_new > upper, p + theta*(upper - p), p_new)
+    return np.clip(p_new, lower, upper)
+
+def forward_difference(residual, p, fvec, rel_step=1.49e-8):
+    ''' (rows, points, n_param) forward difference Jacobian of residual '''
+    fjac = np.empty((*fvec.shape, p.shape[1]))
+    for i in range(p.shape[1]):
+        step = rel_step*np.maximum(np.abs(p[:, i]), 1.)
+        p_step = p.copy()
+        p_step[:, i] += step
+        fjac[:, :, i] = (residual(p_step) - fvec)/step[:, None]
+    return fjac
+
+def parameter_error(pfit, infodict):
+    '''
+    Parameter errors of every row, computed the same way as
+    fitting.fit_gaussian does from the Jacobian and the residuals.
+    '''
+    fvec = infodict['fvec']
+    fjac = infodict['fjac']
+    s_sq = (fvec**2).sum(axis=1)/(fvec.shape[1] - pfit.shape[1])
+    diag = np.einsum('rni,rni->ri', fjac, fjac)
+    return np.absolute(diag*s_sq[:, None])**0.5
+
+def batch_fit_gaussian(data, mask=None, param=None):
+    '''
+    fitting.fit_gaussian applied to every row of data, starting from
+    estimate_gaussian unless param is given.
+    Returns (rows, 3) parameters and errors.
+    '''
+    n = np.shape(data)[1]
+    if param is None:
+        param = estimate_gaussian(np.where(mask, data, np.nan) if mask is not None else data)
+    pfit, infodict = batch_least_squares(oned_gaussian_func, data, param,
+                                         bounds=gaussian_bounds(n), mask=mask)
+    return pfit, parameter_error(pfit, infodict)
+
+def batch_fit_two_lorentz(data, mask=None, param=None):
+    '''
+    fitting.fit_two_lorentz applied to every row of data, starting from
+    estimate_two_lorentz unless param is given.
+    Returns (rows, 4) parameters and errors.
+    '''
+    if param is None:
+        param = estimate_two_lorentz(np.where(mask, data, 0.) if mask is not None else data)
+    pfit, infodict = batch_least_squares(two_lorentz, data, param,
+                                         bounds=TWO_LORENTZ_BOUNDS, mask=mask)
+    return pfit, parameter_error(pfit, infodict)
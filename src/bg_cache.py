@@ -0,0 +1,149 @@
+'''
+Persistent on-disk cache of demosaiced and averaged background frames.
+
+Averaged backgrounds are stored as float32 .npy files named by a hash of
+(background file fingerprint, dwell, position, frame index, ROI, demosaic
+version). The least recently used files are removed once the cache grows
+over its size limit. Files are written under a temporary name and moved
+into place, and unreadable files are dropped as misses.
+'''
+from pathlib import Path
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from demosaic import DEMOSAIC_VERSION
+from read_raw import load_blue
+from running_stats import RunningStats
+from util import get_dtype
+
+CACHE_DIR = Path.home() / '.cache' / 'tfc' / 'backgrounds'
+MAX_BYTES = 8 * 2**30
+
+def fingerprint(fps):
+    '''
+    Hash of the names, sizes and modification times of the given files.
+    Any file added, removed or rewritten changes the fingerprint without
+    having to read the pixel data.
+    '''
+    sha = hashlib.sha1()
+    for fp in sorted(str(fp) for fp in fps):
+        stat = os.stat(fp)
+        sha.update(f"{fp}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()
+
+class BackgroundCache():
+    '''
+    Cache of averaged backgrounds in cache_dir, bounded to max_bytes.
+
+    Example:
+        bg_cache = BackgroundCache()
+        bg = bg_cache.average_runs(files, dwell=dwell) # (frame, x, y)
+    '''
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, fps, dwell=None, position=None, frame=None, roi=None):
+        ''' Cache key of the average of fps under the given conditions '''
+        cond = {'files': fingerprint(fps),
+                'dwell': dwell,
+                'position': position,
+                'frame': frame,
+                'roi': roi,
+                'demosaic': DEMOSAIC_VERSION}
+        return hashlib.sha1(json.dumps(cond, sort_keys=True,
+                                       default=str).encode()).hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f'{key}.npy'
+
+    def get(self, key):
+        ''' Return the cached array of key, or None if it is not cached '''
+        path = self.path(key)
+        try:
+            bg = np.load(path)
+        except FileNotFoundError:
+            return None
+        except (EOFError, OSError, ValueError):
+            # Truncated or corrupt file, e.g. of an interrupted writer
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path) # Mark as recently used
+        return bg.astype(get_dtype(), copy=False)
+
+    def put(self, key, bg):
+        '''
+        Store bg as float32 under key and evict old entries if needed.
+        Arrays larger than the whole cache are not stored.
+        '''
+        bg = np.asarray(bg, dtype=np.float32)
+        if bg.nbytes > self.max_bytes:
+            return
+        path = self.path(key)
+        # Unique name so concurrent writers never share a temporary file
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, bg)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        '''
+        Remove least recently used entries until the cache fits max_bytes,
+        never removing keep, the entry just written.
+        '''
+        entries = []
+        for path in self.cache_dir.glob('*.npy'):
+            if path == keep:
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += keep.stat().st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path in self.cache_dir.glob('*.npy'):
+            path.unlink(missing_ok=True)
+
+    def average(self, fps, dwell=None, position=None, frame=None,
+                roi=None, loader=load_blue):
+        '''
+        Average of the blue channel of fps, loaded from the cache when
+        possible. roi should describe what loader crops so that different
+        ROIs are cached separately.
+        '''
+        key = self.key(fps, dwell, position, frame, roi)
+        bg = self.get(key)
+        if bg is None:
+            bg = RunningStats().update_all(loader(fp) for fp in fps).mean
+            self.put(key, bg)
+            # Same values as a later cache hit
+            bg = bg.astype(np.float32).astype(get_dtype(), copy=False)
+        return bg
+
+    def average_runs(self, files, dwell=None, position=None,
+                     roi=None, loader=load_blue):
+        '''
+        Average over runs of every frame index of a (run, frame) array of
+        raw file paths, cached per frame index. Returns a (frame, x, y) array.
+        '''
+        files = np.asarray(files)
+        return np.array([self.average(files[:, frame], dwell, position,
+                                      frame, roi, loader)
+                         for frame in range(files.shape[1])])
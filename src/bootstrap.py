@@ -0,0 +1,182 @@
+'''
+Bootstrap and jackknife uncertainties of calibration fits.
+
+A resample is a vector of integer weights over the data points, or over
+groups of them such as all points of a velocity, and is fitted as a
+weighted least squares problem starting from the fit of the full data.
+Models with a design matrix in error_funcs (cubic_surface, twod_surface,
+...) are solved for every resample at once with one batched linear solve.
+Other models (test_new_temp_surface, exponential_fit, ...) are refitted
+with their analytic Jacobian in a process pool.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import os
+
+import numpy as np
+from scipy.optimize import leastsq
+
+from error_funcs import get_design_matrix
+from temp_calibration import jacobian_func
+
+def fit_weighted(func, coords, z, param, weights=None, uncertainty=None):
+    '''
+    Least squares fit of func(*p)(*coords) to z, each point counted weights
+    times. Returns the fitted parameters, nan if the fit failed.
+    '''
+    z = np.ravel(z)
+    sigma = np.ones_like(z, dtype=float) if uncertainty is None else np.ravel(uncertainty)
+    keep = np.ones(z.shape, dtype=bool) if weights is None else np.ravel(weights) > 0
+    if weights is not None:
+        sigma = sigma/np.sqrt(np.where(keep, np.ravel(weights), 1.))
+    coords = [np.ravel(c)[keep] for c in coords]
+    z, sigma = z[keep], sigma[keep]
+
+    design_matrix = get_design_matrix(func)
+    if design_matrix is not None:
+        A = np.reshape(design_matrix(*coords), (-1, z.size)).T/sigma[:, None] # pylint: disable=invalid-name
+        return np.linalg.lstsq(A, z/sigma, rcond=None)[0]
+
+    error_func = lambda p: (func(*p)(*coords) - z)/sigma
+    jac = jacobian_func(func, len(param), *coords, uncertainty=sigma)
+    pfit, _, _, _, success = leastsq(error_func, param, Dfun=jac, col_deriv=1,
+                                     full_output=1)
+    return pfit if success in (1, 2, 3, 4) else np.full(len(param), np.nan)
+
+def _fit_chunk(func, coords, z, param, weights, uncertainty):
+    ''' fit_weighted of every row of weights, run in the worker processes '''
+    return np.array([fit_weighted(func, coords, z, param, w, uncertainty) for w in weights])
+
+def fit_resamples(func, coords, z, param, weights, uncertainty=None, workers=None,
+                  executor=None):
+    '''
+    Fit every row of weights, (n_resamples, n_points). Linear models are
+    solved together, other models in executor or in a new process pool of
+    workers processes (workers=1 fits in this process).
+    '''
+    weights = np.asarray(weights, dtype=float)
+    design_matrix = get_design_matrix(func)
+    if design_matrix is not None:
+        return batch_linear_fit(design_matrix, coords, z, weights, uncertainty)
+    if executor is None:
+        workers = workers or os.cpu_count()
+        if workers == 1:
+            return _fit_chunk(func, coords, z, param, weights, uncertainty)
+        with ProcessPoolExecutor(workers) as pool:
+            return fit_resamples(func, coords, z, param, weights, uncertainty, workers, pool)
+    n_chunks = min(4*(workers or os.cpu_count()), len(weights))
+    tasks = [(func, coords, z, param, chunk, uncertainty)
+             for chunk in np.array_split(weights, n_chunks)]
+    return np.concatenate(list(executor.map(_fit_chunk, *zip(*tasks))))
+
+def batch_linear_fit(design_matrix, coords, z, weights, uncertainty=None):
+    ''' Weighted linear least squares of every row of weights in one batched solve '''
+    A = np.reshape(design_matrix(*[np.ravel(c) for c in coords]), (-1, np.size(z))).T # pylint: disable=invalid-name
+    z = np.ravel(z)
+    # Columns are scaled to unit norm, e.g. y**4 of powers is ~1e7 times 1
+    scale = np.linalg.norm(A, axis=0)
+    scale[scale == 0] = 1.
+    A = A/scale # pylint: disable=invalid-name
+    w = weights if uncertainty is None else weights/np.ravel(uncertainty)**2
+    normal = np.einsum('rn,ni,nj->rij', w, A, A)
+    rhs = np.einsum('rn,ni,n->ri', w, A, z)
+    pfits = np.full(rhs.shape, np.nan)
+    # Resamples that leave too few distinct points to determine the model stay nan
+    solvable = np.linalg.matrix_rank(normal, hermitian=True) == A.shape[1]
+    pfits[solvable] = np.linalg.solve(normal[solvable], rhs[solvable][:, :, None])[:, :, 0]
+    return pfits/scale
+
+def group_index(n_points, groups=None):
+    ''' Index of the resampling unit of every point and the number of units '''
+    if groups is None:
+        return np.arange(n_points), n_points
+    _, index = np.unique(np.ravel(groups), return_inverse=True)
+    return index, index.max() + 1
+
+def bootstrap(func, coords, z, param, n_resamples=1000, uncertainty=None,
+              groups=None, seed=None, workers=None, executor=None):
+    '''
+    Parameters of n_resamples bootstrap resamples of the data.
+
+    Args:
+        func: model of error_funcs, fitted as func(*p)(*coords) ~ z
+        coords: tuple of coordinate arrays, e.g. (log10 velocity, power)
+        z: data
+        param: starting parameters, the full data is fitted from them and
+               every resample from the full data fit
+    Keyword Args:
+        uncertainty: uncertainty of every point
+        groups: label of every point; whole groups (e.g. velocities) are
+                resampled instead of single points
+        seed: seed of the random resampling
+        workers: number of processes for nonlinear models
+        executor: process pool to use instead of starting one
+
+    Return:
+        pfit: fit of the full data
+        pfits: (n_resamples, n_param) fits of the resamples
+    '''
+    pfit = fit_weighted(func, coords, z, param, uncertainty=uncertainty)
+    index, n_units = group_index(np.size(z), groups)
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(n_units, np.full(n_units, 1/n_units), size=n_resamples)
+    pfits = fit_resamples(func, coords, z, pfit, counts[:, index], uncertainty,
+                          workers, executor)
+    return pfit, pfits
+
+def jackknife(func, coords, z, param, uncertainty=None, groups=None, workers=None,
+              executor=None):
+    '''
+    Leave-one-out fits, leaving out one point or one group at a time.
+    Arguments as for bootstrap.
+
+    Return:
+        pfit: fit of the full data
+        pfits: (n_units, n_param) fits without each unit
+    '''
+    pfit = fit_weighted(func, coords, z, param, uncertainty=uncertainty)
+    index, n_units = group_index(np.size(z), groups)
+    weights = (index[None, :] != np.arange(n_units)[:, None]).astype(float)
+    pfits = fit_resamples(func, coords, z, pfit, weights, uncertainty, workers, executor)
+    return pfit, pfits
+
+def jackknife_covariance(pfits):
+    ''' Jackknife estimate of the parameter covariance '''
+    pfits = pfits[np.isfinite(pfits).all(axis=1)]
+    n = len(pfits)
+    deviation = pfits - pfits.mean(axis=0)
+    return (n - 1)/n * deviation.T @ deviation
+
+def parameter_band(pfits, level=0.95):
+    ''' (lower, median, upper) percentile band of every parameter '''
+    tail = 50*(1 - level)
+    return tuple(np.nanpercentile(pfits, [tail, 50, 100 - tail], axis=0))
+
+def prediction_band(func, pfits, *coords, level=0.95):
+    '''
+    (lower, median, upper) percentile band of func(*p)(*coords) over the
+    fits of the resamples, e.g. of the temperature on a (velocity, power) grid.
+    '''
+    predictions = np.array([func(*p)(*coords) for p in pfits if np.isfinite(p).all()])
+    tail = 50*(1 - level)
+    return tuple(np.percentile(predictions, [tail, 50, 100 - tail], axis=0))
+
+def bootstrap_groups(func, coords, z, param, groups, n_resamples=1000,
+                     uncertainty=None, seed=None, workers=None):
+    '''
+    bootstrap of the points of every group separately, e.g. the
+    per-velocity exponential_fit of the projected temperature to the power.
+    Returns {group: (pfit, pfits)}.
+    '''
+    groups = np.ravel(groups)
+    rng = np.random.default_rng(seed)
+    result = {}
+    linear = get_design_matrix(func) is not None
+    with ProcessPoolExecutor(workers) if not linear and workers != 1 else nullcontext() as pool:
+        for group in np.unique(groups):
+            mask = groups == group
+            result[group] = bootstrap(func, [np.ravel(c)[mask] for c in coords],
+                                      np.ravel(z)[mask], param, n_resamples,
+                                      None if uncertainty is None else np.ravel(uncertainty)[mask],
+                                      seed=rng.integers(2**32), workers=workers, executor=pool)
+    return result
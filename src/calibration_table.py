@@ -0,0 +1,300 @@
+'''
+Lookup table of an InverseCalibration on a (log10 velocity, Tpeak) grid.
+
+Power, stripe widths and quench rate are tabulated once and then looked
+up by bilinear (or bicubic) interpolation, which costs the same for any
+calibration surface. The grid is refined until the interpolation error at
+the midpoints of every cell is below the tolerance of each quantity, and
+building fails if max_points is reached first. A table is saved to .npz
+together with the coefficients and settings it was built from, so it is
+only rebuilt when those change.
+'''
+from pathlib import Path
+import math
+
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+
+from inverse_calibration import (InverseCalibration, VELOCITY_DWELL, log_velocity,
+                                 power_given_log_velocity)
+from error_funcs import cubic_surface, twod_surface
+
+QUANTITIES = ('power', 'left_width', 'right_width', 'quench')
+TOLERANCE = {'power': 1e-2, 'left_width': 1e-1, 'right_width': 1e-1, 'quench': 1e-3}
+COEFFICIENTS = ('temp_fit', 'left_width_fit', 'right_width_fit', 'quench_fit',
+                'offset', 'power_range')
+
+def analytic_quantities(calib, log_velo, tpeak):
+    ''' Every quantity calib has surfaces for, nan where the calibration is not valid '''
+    power, valid = power_given_log_velocity(calib.temp_fit, log_velo, tpeak,
+                                            calib.offset, calib.power_range)
+    values = {'power': power}
+    with np.errstate(all='ignore'):
+        if calib.left_width_fit is not None:
+            values['left_width'] = cubic_surface(*calib.left_width_fit)(log_velo, power)
+        if calib.right_width_fit is not None:
+            values['right_width'] = twod_surface(*calib.right_width_fit)(log_velo, power)
+        if calib.quench_fit is not None:
+            values['quench'] = twod_surface(*calib.quench_fit)(log_velo, power)
+    return {key: np.where(valid, value, np.nan) for key, value in values.items()}
+
+def bilinear(x_0, y_0, step, table, x, y):
+    ''' Bilinear interpolation of table on the uniform grid x_0 + i*step[0], y_0 + j*step[1] '''
+    f_x = (x - x_0)/step[0]
+    f_y = (y - y_0)/step[1]
+    i = np.clip(np.floor(f_x).astype(int), 0, table.shape[0] - 2)
+    j = np.clip(np.floor(f_y).astype(int), 0, table.shape[1] - 2)
+    t_x = f_x - i
+    t_y = f_y - j
+    return ( (table[i, j]*(1 - t_x) + table[i + 1, j]*t_x)*(1 - t_y)
+           + (table[i, j + 1]*(1 - t_x) + table[i + 1, j + 1]*t_x)*t_y )
+
+class CalibrationTable():
+    '''
+    Tabulated InverseCalibration.
+
+    Args:
+        calib: InverseCalibration to tabulate
+    Keyword Args:
+        log_velo_range: log10 velocities of the table, calib.log_velo_range by default
+        tpeak_range: peak temperatures of the table
+        method: 'linear' or 'cubic' interpolation
+        tolerance: maximum absolute interpolation error of every quantity
+        n_points: initial number of grid points per axis
+        max_points: largest number of grid points per axis; a ValueError is
+                    raised if the tolerance is not met within it
+
+    Example:
+        table = CalibrationTable.load_or_build('calib_table.npz', calib)
+        power, valid = table.power(dwells, tpeaks)
+    '''
+
+    def __init__(self, calib, log_velo_range=None, tpeak_range=(100., 1500.),
+                 method='linear', tolerance=None, n_points=33, max_points=4097):
+        assert method in ('linear', 'cubic'), f"Unknown interpolation method {method}."
+        self.calib = calib
+        self.log_velo_range = calib.log_velo_range if log_velo_range is None else log_velo_range
+        self.tpeak_range = tpeak_range
+        self.method = method
+        self.tolerance = {**TOLERANCE, **(tolerance or {})}
+        self.tables = {}
+        self.max_error = {}
+        self.grid = None
+        self._splines = {}
+        self.build(n_points, max_points)
+
+    def build(self, n_points=33, max_points=4097):
+        '''
+        Tabulate on a grid that is refined along every axis whose midpoint
+        interpolation error is above the tolerance.
+        '''
+        n_x = n_y = n_points
+        while True:
+            self._tabulate(n_x, n_y)
+            error_x, error_y, error_xy = self._midpoint_errors()
+            refine_x = self._too_large(error_x) or self._too_large(error_xy)
+            refine_y = self._too_large(error_y) or self._too_large(error_xy)
+            refine_x &= 2*n_x - 1 <= max_points
+            refine_y &= 2*n_y - 1 <= max_points
+            if not (refine_x or refine_y):
+                break
+            n_x = 2*n_x - 1 if refine_x else n_x
+            n_y = 2*n_y - 1 if refine_y else n_y
+        self.max_error = {key: float(max(error_x[key], error_y[key], error_xy[key]))
+                          for key in self.tables}
+        if self._too_large(self.max_error):
+            raise ValueError(f"Interpolation errors {self.max_error} are above the tolerance "
+                             f"{self.tolerance} with {n_x}x{n_y} points, "
+                             f"increase max_points (now {max_points}).")
+        return self
+
+    def _tabulate(self, n_x, n_y):
+        log_velo = np.linspace(*self.log_velo_range, n_x)
+        tpeak = np.linspace(*self.tpeak_range, n_y)
+        self.grid = (log_velo, tpeak)
+        self.tables = analytic_quantities(self.calib, *np.meshgrid(log_velo, tpeak,
+                                                                   indexing='ij'))
+        self._splines = {}
+        if self.method == 'cubic':
+            for key, table in self.tables.items():
+                assert np.isfinite(table).all(), \
+                    f"Cubic interpolation needs {key} to be valid on the whole table."
+                self._splines[key] = RectBivariateSpline(log_velo, tpeak, table)
+
+    def _midpoint_errors(self):
+        ''' Largest interpolation errors at the x, y and xy midpoints of the cells '''
+        log_velo, tpeak = self.grid
+        mid_x = (log_velo[1:] + log_velo[:-1])/2
+        mid_y = (tpeak[1:] + tpeak[:-1])/2
+        errors = []
+        for x, y in ((mid_x, tpeak), (log_velo, mid_y), (mid_x, mid_y)):
+            x, y = np.meshgrid(x, y, indexing='ij')
+            exact = analytic_quantities(self.calib, x, y)
+            errors.append({key: self._error(exact[key], self._interpolate(key, x, y))
+                           for key in self.tables})
+        return errors
+
+    @staticmethod
+    def _error(exact, interpolated):
+        ''' Largest error where both are valid; nan if there is no such point '''
+        both = np.isfinite(exact) & np.isfinite(interpolated)
+        return np.abs(exact - interpolated)[both].max() if both.any() else np.nan
+
+    def _too_large(self, errors):
+        return any(errors[key] > self.tolerance[key] for key in errors)
+
+    def _interpolate(self, key, log_velo, tpeak):
+        if self.method == 'cubic':
+            return self._splines[key].ev(log_velo, tpeak)
+        x, y = self.grid
+        return bilinear(x[0], y[0], (x[1] - x[0], y[1] - y[0]), self.tables[key],
+                        log_velo, tpeak)
+
+    def lookup(self, key, dwell, tpeak):
+        '''
+        Interpolated quantity for arrays of dwell and Tpeak and whether each
+        point is inside the table and valid.
+        '''
+        assert key in self.tables, f"{key} is not tabulated."
+        if self.method == 'linear' and np.ndim(dwell) == 0 and np.ndim(tpeak) == 0:
+            return self._lookup_scalar(self.tables[key], float(dwell), float(tpeak))
+        log_velo, tpeak = np.broadcast_arrays(log_velocity(dwell),
+                                              np.asarray(tpeak, dtype=float))
+        inside = ( (log_velo >= self.grid[0][0]) & (log_velo <= self.grid[0][-1])
+                 & (tpeak >= self.grid[1][0]) & (tpeak <= self.grid[1][-1]) )
+        value = self._interpolate(key, log_velo, tpeak)
+        valid = inside & np.isfinite(value)
+        return np.where(valid, value, np.nan), valid
+
+    def _lookup_scalar(self, table, dwell, tpeak):
+        ''' lookup of a single point with float arithmetic, for calls in loops '''
+        x, y = self.grid
+        if not (dwell > 0 and y[0] <= tpeak <= y[-1]):
+            return math.nan, False
+        log_velo = math.log10(VELOCITY_DWELL/dwell)
+        if not x[0] <= log_velo <= x[-1]:
+            return math.nan, False
+        f_x = (log_velo - x[0])/(x[1] - x[0])
+        f_y = (tpeak - y[0])/(y[1] - y[0])
+        i = min(int(f_x), len(x) - 2)
+        j = min(int(f_y), len(y) - 2)
+        t_x = f_x - i
+        t_y = f_y - j
+        value = float( (table[i, j]*(1 - t_x) + table[i + 1, j]*t_x)*(1 - t_y)
+                     + (table[i, j + 1]*(1 - t_x) + table[i + 1, j + 1]*t_x)*t_y )
+        if math.isnan(value):
+            return math.nan, False
+        return value, True
+
+    def power(self, dwell, tpeak):
+        return self.lookup('power', dwell, tpeak)
+
+    def widths(self, dwell, tpeak):
+        left, left_valid = self.lookup('left_width', dwell, tpeak)
+        right, right_valid = self.lookup('right_width', dwell, tpeak)
+        return left, right, left_valid & right_valid
+
+    def quench(self, dwell, tpeak):
+        ''' log10 quench rate '''
+        return self.lookup('quench', dwell, tpeak)
+
+    def save(self, path):
+        ''' Save the table and the coefficients and settings it was built from to .npz '''
+        arrays = {f'table_{key}': table for key, table in self.tables.items()}
+        arrays.update({f'max_error_{key}': err for key, err in self.max_error.items()})
+        arrays.update({f'tolerance_{key}': tol for key, tol in self.tolerance.items()})
+        arrays.update({f'coef_{key}': np.asarray(getattr(self.calib, key), dtype=float)
+                       for key in COEFFICIENTS if getattr(self.calib, key) is not None})
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, log_velo=self.grid[0], tpeak=self.grid[1], method=self.method,
+                 log_velo_range=self.log_velo_range, tpeak_range=self.tpeak_range,
+                 calib_log_velo_range=self.calib.log_velo_range, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        ''' CalibrationTable saved with save '''
+        with np.load(path) as npz:
+            coefs = {key: npz[f'coef_{key}'] for key in COEFFICIENTS
+                     if f'coef_{key}' in npz}
+            table = cls.__new__(cls)
+            table.calib = InverseCalibration(**coefs, log_velo_range=tuple(
+                npz['calib_log_velo_range'].tolist()))
+            table.grid = (npz['log_velo'], npz['tpeak'])
+            table.log_velo_range = tuple(npz['log_velo_range'].tolist())
+            table.tpeak_range = tuple(npz['tpeak_range'].tolist())
+            table.method = str(npz['method'])
+            table.tables = {key: npz[f'table_{key}'] for key in QUANTITIES
+                            if f'table_{key}' in npz}
+            table.max_error = {key: float(npz[f'max_error_{key}']) for key in table.tables}
+            table.tolerance = {key: float(npz[f'tolerance_{key}']) for key in TOLERANCE}
+        table._splines = {}
+        if table.method == 'cubic':
+            table._splines = {key: RectBivariateSpline(*table.grid, value)
+                              for key, value in table.tables.items()}
+        return table
+
+    @classmethod
+    def load_or_build(cls, path, calib, **kwargs):
+        '''
+        Table saved at path if it was built from the coefficients of calib
+        with the same settings, else a new table of calib, which is saved to path.
+        kwargs are those of CalibrationTable.
+        '''
+        if Path(path).exists():
+            try:
+                table = cls.load(path)
+            except KeyError: # saved by an older version, without the settings
+                table = None
+            if table is not None and table.matches(calib, **kwargs):
+                return table
+        table = cls(calib, **kwargs)
+        table.save(path)
+        return table
+
+    def matches(self, calib, log_velo_range=None, tpeak_range=(100., 1500.),
+                method='linear', tolerance=None, **_):
+        '''
+        Whether the table was built from the coefficients of calib with the
+        given range, method and tolerance. The initial and largest number of
+        points do not change what the table guarantees and are ignored.
+        '''
+        log_velo_range = calib.log_velo_range if log_velo_range is None else log_velo_range
+        if ( self.method != method
+             or not np.array_equal(self.log_velo_range, log_velo_range)
+             or not np.array_equal(self.tpeak_range, tpeak_range)
+             or not np.array_equal(self.calib.log_velo_range, calib.log_velo_range)
+             or self.tolerance != {**TOLERANCE, **(tolerance or {})} ):
+            return False
+        for key in COEFFICIENTS:
+            mine, theirs = getattr(self.calib, key), getattr(calib, key)
+            if (mine is None) != (theirs is None):
+                return False
+            if mine is not None and not np.array_equal(np.asarray(mine, dtype=float),
+                                                       np.asarray(theirs, dtype=float)):
+                return False
+        return True
+
+# Tables of profile_table, by path
+_PROFILE_TABLES = {}
+
+def profile_table(profile, offset=27., **kwargs):
+    '''
+    CalibrationTable of a temperature profile module with TEMP_FIT,
+    LEFT_WIDTH_FIT and RIGHT_WIDTH_FIT (e.g. temp_profile_2024), saved next
+    to the module as <module>_table.npz and rebuilt when its fits change.
+    This is an opt-in alternative to the closed forms of the module: values
+    are interpolated to the table tolerance and points outside the table
+    are invalid. kwargs are those of CalibrationTable.
+
+    Example:
+        table = profile_table(temp_profile_2024, log_velo_range=(0.5, 3.))
+        power, valid = table.power(dwells, tpeaks)
+    '''
+    path = Path(profile.__file__).with_name(f'{Path(profile.__file__).stem}_table.npz')
+    calib = InverseCalibration(profile.TEMP_FIT, profile.LEFT_WIDTH_FIT,
+                               profile.RIGHT_WIDTH_FIT, offset=offset)
+    table = _PROFILE_TABLES.get(path)
+    if table is None or not table.matches(calib, **kwargs):
+        table = CalibrationTable.load_or_build(path, calib, **kwargs)
+        _PROFILE_TABLES[path] = table
+    return table
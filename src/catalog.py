@@ -0,0 +1,246 @@
+'''
+SQLite catalog of the files of a measurement campaign.
+
+The catalog scans a campaign root once, parses every naming scheme used
+by the scripts and stores one row per file:
+
+    {velocity}mm_per_sec / {dwell}us_{power}W / Run-XXXX_Frame-YYYY.raw
+    {velocity}mm per sec / {position}_{current}_{frame}.raw      (util.parse_fn)
+    {dwell}us_{power}W / Run-XXXX_LED-On_Power-On_Frame-YYYY.png (preprocess.parse_name)
+    {velocity}mm_{power}W_run_{run}.json                         (json_fn_parser)
+
+Rescans only list directories whose modification time changed. Files of
+unchanged directories are only stat'ed, so files rewritten in place are
+still picked up, and an unchanged external drive is rescanned without
+reading its files.
+'''
+from fnmatch import fnmatch
+from pathlib import Path
+import json
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+from util import parse_fn, parse_run_frame, is_bg
+
+CATALOG_FN = '.tfc_catalog.sqlite'
+FILE_TYPES = ('.raw', '.png', '.json')
+COLUMNS = ('path', 'kind', 'velocity', 'dwell', 'power', 'current', 'position',
+           'run', 'frame', 'led', 'laser', 'size', 'mtime')
+
+VELOCITY_DIR = re.compile(r'(\d+(?:\.\d+)?)mm[ _]per[ _]sec')
+CONDITION_DIR = re.compile(r'^(\d+)us_(\d+(?:\.\d+)?)W$', re.IGNORECASE)
+RUN_FRAME_RAW = re.compile(r'^Run-\d+_Frame-\d+\.raw$')
+PNG_FN = re.compile(r'^Run-(\d+)_LED-(On|Off)_Power-(On|Off)_Frame-(\d+)')
+JSON_FN = re.compile(r'^(\d+)mm_(\d+(?:\.\d+)?)W(?:_run_(\d+))?\.json$')
+POSITION_RAW = re.compile(r'^[^_]+_[^_]+_\d+\.raw$')
+
+def parse_dir_name(name: str):
+    '''
+    Conditions described by a single directory name, e.g.
+    '45mm_per_sec' -> {'velocity': 45.}, '01960us_049.00W' -> {'dwell': 1960, 'power': 49.}
+    '''
+    cond = {}
+    velocity = VELOCITY_DIR.search(name)
+    if velocity:
+        cond['velocity'] = float(velocity.group(1))
+    condition = CONDITION_DIR.match(name)
+    if condition:
+        cond['dwell'] = int(condition.group(1))
+        cond['power'] = float(condition.group(2))
+    return cond
+
+def parse_file_name(name: str):
+    ''' Conditions described by a file name, or None if it is not a known scheme '''
+    if RUN_FRAME_RAW.match(name):
+        run, frame = parse_run_frame(name)
+        return {'kind': 'raw', 'run': run, 'frame': frame}
+    if POSITION_RAW.match(name):
+        position, current, frame = parse_fn(name)
+        cond = {'kind': 'raw', 'position': position, 'current': current,
+                'frame': int(frame)}
+        if is_bg(current):
+            cond['power'] = 0.
+        elif current.endswith('W'):
+            cond['power'] = float(current[:-1])
+        return cond
+    png = PNG_FN.match(name)
+    if png and name.endswith('.png'):
+        return {'kind': 'png', 'run': int(png.group(1)),
+                'led': png.group(2) == 'On', 'laser': png.group(3) == 'On',
+                'frame': int(png.group(4))}
+    js = JSON_FN.match(name)
+    if js:
+        cond = {'kind': 'json', 'velocity': float(js.group(1)),
+                'power': float(js.group(2))}
+        if js.group(3) is not None:
+            cond['run'] = int(js.group(3))
+        return cond
+    return None
+
+class Catalog():
+    '''
+    Catalog of a campaign root directory, stored in <root>/.tfc_catalog.sqlite
+    unless db_path is given, e.g. to keep it off a read-only or data drive.
+
+    Example:
+        catalog = Catalog('/Volumes/Samsung_T5/1113_data')
+        catalog.scan()
+        fps = catalog.query(velocity=68, dwell=1297, power=0.)
+    '''
+
+    def __init__(self, root, db_path=None):
+        self.root = Path(root).resolve()
+        self.db_path = self.root / CATALOG_FN if db_path is None else Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, kind TEXT, velocity REAL, dwell INTEGER,
+                power REAL, current TEXT, position TEXT, run INTEGER,
+                frame INTEGER, led INTEGER, laser INTEGER, size INTEGER,
+                mtime INTEGER, dir TEXT);
+            CREATE INDEX IF NOT EXISTS files_cond ON files
+                (velocity, dwell, power, run, frame);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, mtime INTEGER, subdirs TEXT);
+            ''')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def scan(self, pattern=None):
+        '''
+        Scan the root and update the catalog. Returns the number of
+        directories that had to be listed. With a glob pattern, e.g.
+        '*mm per sec', only the top level directories matching it are
+        scanned and the rest is dropped from the catalog.
+        '''
+        seen = set()
+        n_listed = self._scan_dir(self.root, {}, seen, pattern)
+        known = [row[0] for row in self.conn.execute('SELECT path FROM dirs')]
+        for path in known:
+            if path not in seen:
+                self.conn.execute('DELETE FROM dirs WHERE path = ?', (path,))
+                self.conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+        self.conn.commit()
+        return n_listed
+
+    def _scan_dir(self, dir_path, cond, seen, pattern=None):
+        dir_str = str(dir_path)
+        seen.add(dir_str)
+        mtime = os.stat(dir_path).st_mtime_ns
+        row = self.conn.execute('SELECT mtime, subdirs FROM dirs WHERE path = ?',
+                                (dir_str,)).fetchone()
+        n_listed = 0
+        if row is not None and row[0] == mtime and self._files_unchanged(dir_str):
+            subdirs = json.loads(row[1])
+        else:
+            subdirs = self._list_dir(dir_path, dir_str, cond, mtime)
+            n_listed += 1
+        if pattern is not None:
+            subdirs = [subdir for subdir in subdirs if fnmatch(subdir, pattern)]
+        for subdir in subdirs:
+            sub_cond = {**cond, **parse_dir_name(subdir)}
+            n_listed += self._scan_dir(dir_path / subdir, sub_cond, seen)
+        return n_listed
+
+    def _files_unchanged(self, dir_str):
+        ''' Whether every catalogued file of a directory still has its size and mtime '''
+        for path, size, mtime in self.conn.execute(
+                'SELECT path, size, mtime FROM files WHERE dir = ?', (dir_str,)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime:
+                return False
+        return True
+
+    def _list_dir(self, dir_path, dir_str, cond, mtime):
+        subdirs = []
+        rows = []
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    continue
+                if not entry.name.endswith(FILE_TYPES):
+                    continue
+                file_cond = parse_file_name(entry.name)
+                if file_cond is None:
+                    continue
+                file_cond = {**cond, **file_cond}
+                stat = entry.stat()
+                rows.append((entry.path, file_cond.get('kind'),
+                             *[file_cond.get(col) for col in COLUMNS[2:-2]],
+                             stat.st_size, stat.st_mtime_ns, dir_str))
+        subdirs.sort()
+        self.conn.execute('DELETE FROM files WHERE dir = ?', (dir_str,))
+        self.conn.executemany(f'INSERT OR REPLACE INTO files VALUES '
+                              f'({", ".join("?" * (len(COLUMNS) + 1))})', rows)
+        self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                          (dir_str, mtime, json.dumps(subdirs)))
+        return subdirs
+
+    def query(self, kind='raw', **cond):
+        '''
+        Paths of the catalogued files matching every given condition, in the
+        same order as sorted(glob). Conditions are columns of the catalog,
+        e.g. velocity, dwell, power, current, position, run, frame, or dir
+        for the files directly in one directory.
+        '''
+        return [Path(row['path']) for row in self.rows(kind, **cond)]
+
+    def grid(self, n_frames, kind='raw', **cond):
+        ''' Matching paths as a (run, frame) array, like RawDirectory.files '''
+        files = np.array(self.query(kind, **cond))
+        assert len(files) % n_frames == 0, \
+            f"{len(files)} files matching {cond} do not split into runs of {n_frames} frames."
+        return files.reshape((-1, n_frames))
+
+    def velocities(self, kind='raw'):
+        ''' Distinct velocities in the catalog '''
+        return [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT velocity FROM files WHERE kind = ? AND '
+                'velocity IS NOT NULL ORDER BY velocity', (kind,))]
+
+    def directories(self, kind='raw', **cond):
+        ''' Sorted directories holding catalogued files matching the given conditions '''
+        return sorted({Path(row['path']).parent for row in self.rows(kind, **cond)})
+
+    def rows(self, kind='raw', **cond):
+        ''' Catalog rows (as dictionaries) matching the given conditions '''
+        unknown = set(cond) - set(COLUMNS) - {'dir'}
+        assert not unknown, f"Unknown catalog columns {unknown}."
+        if cond.get('dir') is not None:
+            cond['dir'] = str(Path(cond['dir']).resolve())
+        where = ['kind = ?']
+        values = [kind]
+        for col, val in cond.items():
+            if val is None:
+                where.append(f'{col} IS NULL')
+            else:
+                where.append(f'{col} = ?')
+                values.append(val)
+        cursor = self.conn.execute(f'SELECT {", ".join(COLUMNS)} FROM files '
+                                   f'WHERE {" AND ".join(where)} ORDER BY path',
+                                   values)
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def conditions(self, kind='raw'):
+        ''' Distinct (velocity, dwell, power) conditions in the catalog '''
+        return self.conn.execute('SELECT DISTINCT velocity, dwell, power FROM files '
+                                 'WHERE kind = ? ORDER BY velocity, dwell, power',
+                                 (kind,)).fetchall()
@@ -0,0 +1,145 @@
+'''
+Demosaic engine for the ZOOCAM Bayer pattern.
+
+The sensor pattern is
+
+    G R G R ...
+    B G B G ...
+
+so red sits on (even, odd), blue on (odd, even) and green on the remaining
+two sub-lattices. Every channel is built from the strided sub-lattices of
+the raw frame, which gives the same numbers as the filter-mask + np.roll
+interpolation in read_raw.get_interpolation without the full-frame
+temporaries or per-pixel border loops.
+'''
+from enum import Enum
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+class Color(Enum):
+    Red = 1
+    Blue = 2
+    Green = 3
+
+# Bump whenever the numbers produced by demosaic change, so cached
+# backgrounds (bg_cache.py) built with older versions are not reused.
+DEMOSAIC_VERSION = 1
+# cv2.cvtColor channel order of the BGR output
+CV2_CHANNEL = {Color.Blue: 0, Color.Green: 1, Color.Red: 2}
+
+def demosaic(data, color, backend='numpy', dtype=float):
+    '''
+    Interpolate one color channel of a raw Bayer frame.
+
+    Args:
+        data: 2d array of raw pixels with even dimensions
+        color: Color to be interpolated
+
+    Keyword Args:
+        backend: 'numpy' for the reference interpolation or 'cv2' for
+                 cv2.cvtColor with COLOR_BAYER_GB2BGR as used by zoocam_client
+        dtype: floating point type of the returned channel
+    '''
+    if backend == 'cv2':
+        return demosaic_cv2(data, color, dtype)
+    raw = np.asarray(data, dtype=dtype)
+    if color == Color.Blue:
+        return demosaic_blue(raw)
+    elif color == Color.Red:
+        return demosaic_red(raw)
+    elif color == Color.Green:
+        return demosaic_green(raw)
+    raise ValueError(f"Unknown color {color}")
+
+def demosaic_cv2(data, color, dtype=float):
+    ''' Single channel of the OpenCV demosaic used on the camera side '''
+    bgr = cv2.cvtColor(np.ascontiguousarray(data, dtype=np.uint16),  # pylint: disable=no-member
+                       cv2.COLOR_BAYER_GB2BGR)                       # pylint: disable=no-member
+    return bgr[:, :, CV2_CHANNEL[color]].astype(dtype)
+
+def demosaic_blue(raw):
+    '''
+    Blue channel. The interior is bilinear; the border follows the
+    get_blue_*_edge and get_*_corner rules of read_raw.
+    '''
+    new_data = np.empty(raw.shape, dtype=raw.dtype)
+    # Interior, one assignment per Bayer sub-lattice
+    new_data[1:-1:2, 2:-1:2] = raw[1:-1:2, 2:-1:2]
+    new_data[1:-1:2, 1:-1:2] = (raw[1:-1:2, 0:-2:2] + raw[1:-1:2, 2:-1:2])/2
+    new_data[2:-1:2, 2:-1:2] = (raw[1:-2:2, 2:-1:2] + raw[3::2, 2:-1:2])/2
+    new_data[2:-1:2, 1:-1:2] = ( raw[1:-2:2, 0:-2:2] + raw[3::2, 0:-2:2]
+                               + raw[1:-2:2, 2:-1:2] + raw[3::2, 2:-1:2])/4
+    # Top edge: G on even columns, R on odd columns
+    new_data[0, 2:-1:2] = raw[1, 2:-1:2]
+    new_data[0, 1:-1:2] = (raw[1, 0:-2:2] + raw[1, 2:-1:2])/2
+    # Bottom edge: B on even columns, G on odd columns
+    new_data[-1, 2:-1:2] = raw[-1, 2:-1:2]
+    new_data[-1, 1:-1:2] = (raw[-1, 0:-2:2] + raw[-1, 2:-1:2])/2
+    # Left edge: G on even rows, B on odd rows
+    new_data[1:-1:2, 0] = raw[1:-1:2, 0]
+    new_data[2:-1:2, 0] = (raw[1:-2:2, 0] + raw[3::2, 0])/2
+    # Right edge keeps the (row, column) order of get_blue_right_edge
+    rows, left, right = blue_right_edge_index(raw.shape)
+    new_data[1:-1, -1] = (raw[rows, left] + raw[rows, right])/2
+    # Corners
+    new_data[0, 0] = raw[1, 0]
+    new_data[0, -1] = raw[0, 1]
+    new_data[-1, 0] = raw[-1, 0]
+    new_data[-1, -1] = raw[-1, -2]
+    return new_data
+
+@lru_cache(maxsize=None)
+def blue_right_edge_index(shape):
+    '''
+    Index arrays read by get_blue_right_edge for every row of the right edge.
+    Columns are clipped so frames taller than they are wide (e.g. ROI windows)
+    can still be decoded.
+    '''
+    pos_x = np.arange(1, shape[0]-1)
+    rows = np.where(pos_x % 2 == 1, -2, -1)
+    left = np.clip(pos_x-1, 0, shape[1]-1)
+    right = np.clip(pos_x+1, 0, shape[1]-1)
+    for index in (rows, left, right):
+        index.flags.writeable = False
+    return rows, left, right
+
+def demosaic_red(raw):
+    '''
+    Red channel. Neighbours wrap around the frame like np.roll does and the
+    corner values are added on top, as in read_raw.get_interpolation.
+    '''
+    red = raw[0::2, 1::2]
+    left = np.roll(red, 1, axis=1)
+    down = np.roll(red, -1, axis=0)
+    new_data = np.empty(raw.shape, dtype=raw.dtype)
+    new_data[0::2, 1::2] = red
+    new_data[0::2, 0::2] = (left + red)/2
+    new_data[1::2, 1::2] = (red + down)/2
+    new_data[1::2, 0::2] = (left + np.roll(left, -1, axis=0) + red + down)/4
+    new_data[0, 0] += raw[0, 1]
+    new_data[0, -1] += raw[0, -1]
+    new_data[-1, 0] += raw[-2, -2]
+    new_data[-1, -1] += raw[-2, -1]
+    return new_data
+
+def demosaic_green(raw):
+    '''
+    Green channel. Neighbours wrap around the frame like np.roll does and the
+    corner values are added on top, as in read_raw.get_interpolation.
+    '''
+    green_even = raw[0::2, 0::2]
+    green_odd = raw[1::2, 1::2]
+    new_data = np.empty(raw.shape, dtype=raw.dtype)
+    new_data[0::2, 0::2] = green_even
+    new_data[1::2, 1::2] = green_odd
+    new_data[0::2, 1::2] = ( green_even + np.roll(green_odd, 1, axis=0)
+                           + green_odd + np.roll(green_even, -1, axis=1))/4
+    new_data[1::2, 0::2] = ( np.roll(green_odd, 1, axis=1) + green_even
+                           + np.roll(green_even, -1, axis=0) + green_odd)/4
+    new_data[0, 0] += raw[0, 0]
+    new_data[0, -1] += (raw[0, 0] + raw[1, 1])/2
+    new_data[-1, 0] += (raw[1, -1] + raw[0, -2])/2
+    new_data[-1, -1] += raw[-1, -1]
+    return new_data
@@ -2,7 +2,6 @@
 import math
 
 import numpy as np
-import sympy as sp
 from scipy.stats import pearson3
 
 yth = 0 
@@ -27,6 +26,10 @@ def linear(a,b):
     ''' Linear function ax+b'''
     return lambda x: a*x+b
 
+def exponential_fit(e, a):
+    ''' Power law a*x^e of the projected temperature at power x '''
+    return lambda x: a*(x-yth)**e
+
 def twod_plane(base, a, b):
     ''' 2d plane function'''
     return lambda x, y: base + a*x + b*y
@@ -83,10 +86,6 @@ def temp_surface_sp(base, a, b,  d, e, f, g):
     return lambda x, y: base + a*x + b*y  + d*y**2 + e*x*y + f*np.sqrt(x) + g*np.sqrt(y)
 
 
-def jacobian_twod_surface():
-    ''' Jacobian of a quadratic function at position (x, y)'''
-    return lambda x, y: [1, x, y, x**2, y**2, x*y]
-
 def power_fit_func(base, a, b, c, d, e):
     ''' Function for fitting inverted quadratic surface.
         a*x + b*y + c*sqrt(x) + d*y^2 + e*x*y '''
@@ -170,3 +169,190 @@ def twod_edgeworth(height, x_0, y_0, s_x, s_y, sk_x, sk_y, ku_x, ku_y):
     ''' 2d Edgeworth function '''
     return lambda x, y: height * edgeworth(x, x_0, s_x, sk_x, ku_x)\
                         * edgeworth(y, y_0, s_y, sk_y, ku_y)
+
+################# Analytic Jacobians #################
+# jacobian_<func>(*param) mirrors <func>(*param) and returns a function of
+# the same coordinates giving the derivative with respect to every
+# parameter, stacked as an array of shape (n_param, *coordinates.shape).
+# Piecewise models use the derivative of the active piece.
+
+def stack_columns(*columns):
+    ''' Broadcast the derivative of every parameter to a common shape and stack '''
+    return np.array(np.broadcast_arrays(*columns))
+
+def jacobian_twod_surface(*_):
+    ''' Jacobian of a quadratic function at position (x, y)'''
+    return lambda x, y: stack_columns(1., x, y, x**2, y**2, x*y)
+
+def jacobian_cubic_surface(*_):
+    return lambda x, y: stack_columns(1., x, y, x**2, y**2, x*y, x**4, y**4)
+
+def jacobian_test_new_temp_surface(b, c, d, e, f):
+    def jac(x, y):
+        power = (y-yth)**(d*x**2+e*x+f)
+        dexp = (b*x+c)*power*np.log(y-yth)
+        return stack_columns(x*power, power, dexp*x**2, dexp*x, dexp)
+    return jac
+
+def jacobian_exponential_fit(e, a):
+    def jac(x):
+        power = (x-yth)**e
+        return stack_columns(a*power*np.log(x-yth), power)
+    return jac
+
+def gaussian_columns(x, height, x_0, width_x):
+    ''' d/d(height, x_0, width_x) of oned_gaussian '''
+    r = (x-x_0)/width_x
+    unit = np.exp(-r**2/2)
+    return unit, height*unit*r/width_x, height*unit*r**2/width_x
+
+def lorentz_columns(x, height, x_0, width_x):
+    ''' d/d(height, x_0, width_x) of lorentz '''
+    r = (x-x_0)/width_x
+    unit = 1/(1+r**2)
+    return unit, 2*height*unit**2*r/width_x, 2*height*unit**2*r**2/width_x
+
+def jacobian_oned_gaussian_func(height, x_0, width_x):
+    return lambda x: stack_columns(*gaussian_columns(x, height, x_0, width_x))
+
+def two_sided_jacobian(columns, height, x_0, sigma_1, sigma_2):
+    def jac(x):
+        left = (x<=x_0).astype(int)
+        right = (x>x_0).astype(int)
+        d_h_1, d_x0_1, d_s_1 = columns(x, height, x_0, sigma_1)
+        d_h_2, d_x0_2, d_s_2 = columns(x, height, x_0, sigma_2)
+        return stack_columns(d_h_1*left + d_h_2*right,
+                             d_x0_1*left + d_x0_2*right,
+                             d_s_1*left, d_s_2*right)
+    return jac
+
+def jacobian_two_gaussian(height, x_0, sigma_1, sigma_2):
+    return two_sided_jacobian(gaussian_columns, height, x_0, sigma_1, sigma_2)
+
+def jacobian_two_lorentz(height, x_0, sigma_1, sigma_2):
+    return two_sided_jacobian(lorentz_columns, height, x_0, sigma_1, sigma_2)
+
+def jacobian_pseudovoigt(height, x_0, width_x, a):
+    s = sigmoid(a)
+    def jac(x):
+        l_h, l_x0, l_w = lorentz_columns(x, height, x_0, width_x)
+        g_h, g_x0, g_w = gaussian_columns(x, height, x_0, width_x)
+        return stack_columns(s*l_h + (1-s)*g_h,
+                             s*l_x0 + (1-s)*g_x0,
+                             s*l_w + (1-s)*g_w,
+                             s*(1-s)*height*(l_h - g_h))
+    return jac
+
+def jacobian_gaussian_shift(height, center_x, center_y, width_x, width_y, rho, shift):
+    ''' Written in place since it is evaluated on the whole image by fit_center '''
+    width_x = float(width_x)
+    width_y = float(width_y)
+    k = 1/(2*(1-rho**2))
+    def jac(x, y):
+        u = (x-center_x)/width_x
+        v = (y-center_y)/width_y
+        uv = u*v
+        q = u*u
+        q += v*v
+        q -= 2*rho*uv
+        out = np.empty((7, *q.shape), dtype=q.dtype)
+        np.multiply(q, -k, out=out[0])
+        np.exp(out[0], out=out[0])
+        g = height*out[0]
+        # Centers
+        np.multiply(v, -rho, out=out[1])
+        out[1] += u
+        out[1] *= g
+        out[1] *= 2*k/width_x
+        np.multiply(u, -rho, out=out[2])
+        out[2] += v
+        out[2] *= g
+        out[2] *= 2*k/width_y
+        # Widths
+        np.multiply(out[1], u, out=out[3])
+        np.multiply(out[2], v, out=out[4])
+        # Correlation
+        np.multiply(q, -rho/(1-rho**2)**2, out=out[5])
+        out[5] += 2*k*uv
+        out[5] *= g
+        out[6] = 1.
+        return out
+    return jac
+
+def edgeworth_columns(x, x_0, s, sk, ku):
+    ''' edgeworth and its derivatives with respect to (x_0, s, sk, ku) '''
+    r = (x-x_0)/s
+    base = np.exp(-r**2/2)/(2*np.pi*s)
+    expansion = edge_expansion(r, sk, ku)
+    d_expansion = ( sk*(3*r**2 - 3)/6 + ku/12*(4*r**3 - 12*r)
+                  + sk**2*(6*r**5 - 60*r**3 + 90*r)/72 )
+    d_r = base*(d_expansion - r*expansion)
+    value = base*expansion
+    return (value, -d_r/s, -value/s - d_r*r/s,
+            base*((r**3 - 3*r)/6 + sk*(r**6 - 15*r**4 + 45*r**2 - 15)/36),
+            base*(r**4 - 6*r**2 + 3)/12)
+
+def jacobian_twod_edgeworth(height, x_0, y_0, s_x, s_y, sk_x, sk_y, ku_x, ku_y):
+    def jac(x, y):
+        e_x, d_x0, d_sx, d_skx, d_kux = edgeworth_columns(x, x_0, s_x, sk_x, ku_x)
+        e_y, d_y0, d_sy, d_sky, d_kuy = edgeworth_columns(y, y_0, s_y, sk_y, ku_y)
+        return stack_columns(e_x*e_y, height*d_x0*e_y, height*e_x*d_y0,
+                             height*d_sx*e_y, height*e_x*d_sy,
+                             height*d_skx*e_y, height*e_x*d_sky,
+                             height*d_kux*e_y, height*e_x*d_kuy)
+    return jac
+
+JACOBIANS = {
+    gaussian_shift: jacobian_gaussian_shift,
+    oned_gaussian_func: jacobian_oned_gaussian_func,
+    two_lorentz: jacobian_two_lorentz,
+    two_gaussian: jacobian_two_gaussian,
+    pseudovoigt: jacobian_pseudovoigt,
+    twod_edgeworth: jacobian_twod_edgeworth,
+    test_new_temp_surface: jacobian_test_new_temp_surface,
+    twod_surface: jacobian_twod_surface,
+    cubic_surface: jacobian_cubic_surface,
+    exponential_fit: jacobian_exponential_fit,
+}
+
+def get_jacobian(func):
+    ''' Analytic Jacobian of a model of this module, or None if it has none '''
+    return JACOBIANS.get(func)
+
+################# Design matrices #################
+# Models that are linear in their parameters, f(*p)(x, y) = sum_i p_i * column_i,
+# declare their columns so they can be fitted with a single linear solve.
+
+def design_twod_plane(x, y):
+    return stack_columns(1., x, y)
+
+def design_twod_surface(x, y):
+    return stack_columns(1., x, y, x**2, y**2, x*y)
+
+def design_cubic_surface(x, y):
+    return stack_columns(1., x, y, x**2, y**2, x*y, x**4, y**4)
+
+def design_width_surface(x, y):
+    return stack_columns(1., x, y, y**2)
+
+def design_temp_surface(x, y):
+    return stack_columns(1., x, y, x**2, y**2, x*y, x*y**2, x**2*y)
+
+def design_new_temp_surface(x, y):
+    y_2 = (y-yth)**2
+    y_1 = y-yth
+    return stack_columns(x**2*y_2, x*y_2, y_2, np.sqrt(x)*y_2,
+                         x**2*y_1, x*y_1, y_1, np.sqrt(x)*y_1)
+
+DESIGN_MATRICES = {
+    twod_plane: design_twod_plane,
+    twod_surface: design_twod_surface,
+    cubic_surface: design_cubic_surface,
+    width_surface: design_width_surface,
+    temp_surface: design_temp_surface,
+    new_temp_surface: design_new_temp_surface,
+}
+
+def get_design_matrix(func):
+    ''' (n_param, *x.shape) columns of a linear model of this module, or None '''
+    return DESIGN_MATRICES.get(func)
@@ -5,17 +5,85 @@ Could use partialfunc but got lazy..
 
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.ndimage import uniform_filter1d
 from scipy.optimize import leastsq, least_squares
 from scipy.stats import pearson3
 
 from error_funcs import oned_gaussian_func, pseudovoigt, pearson3_func, two_gaussian, two_lorentz
+from error_funcs import jacobian_oned_gaussian_func, jacobian_pseudovoigt
+from error_funcs import jacobian_two_gaussian, jacobian_two_lorentz
 
-def fit_gaussian(data):
+def gaussian_bounds(n):
+    return ([0., n//2 - 300, 0], [0.5, n//2 + 300, n*3])
+
+def gaussian_start(n):
+    return [0.1, n//2, n/2]
+
+TWO_LORENTZ_BOUNDS = ([0.,  50,  50.,  50.], [0.4, 250, 300., 300.])
+TWO_LORENTZ_START = [0.1, 150, 250, 250]
+
+def estimate_gaussian(data, threshold=0.2):
+    '''
+    Closed-form starting point (height, x_0, width) of oned_gaussian_func for
+    every row of data, from a least squares parabola through the log of the
+    points above threshold * maximum (Caruana's algorithm). Rows where this
+    fails or leaves the bounds of fit_gaussian get the old constant start.
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    n = data.shape[1]
+    x = np.arange(n, dtype=float)
+    peak = np.nanmax(data, axis=1, keepdims=True)
+    w = (data > threshold*peak) & (data > 0)
+    # Weighting by y**2 makes the log-fit errors uniform
+    y = np.where(w, data, 1.)
+    weights = np.where(w, y**2, 0.)
+    log_y = np.log(y)
+    power = np.stack([x**0, x, x**2])
+    A = np.einsum('in,jn,rn->rij', power, power, weights) # pylint: disable=invalid-name
+    b = np.einsum('in,rn->ri', power, weights*log_y)
+    valid = (w.sum(axis=1) >= 3) & (np.abs(np.linalg.det(A)) > 0)
+    A[~valid] = np.eye(3) # pylint: disable=invalid-name
+    a_0, a_1, a_2 = np.linalg.solve(A, b[:, :, None])[:, :, 0].T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        width = np.sqrt(-1/(2*a_2))
+        x_0 = -a_1/(2*a_2)
+        height = np.exp(a_0 - a_1**2/(4*a_2))
+    param = np.stack([height, x_0, width], axis=1)
+    return fallback(param, valid & (a_2 < 0), gaussian_start(n), gaussian_bounds(n))
+
+def estimate_two_lorentz(data, smooth=5):
+    '''
+    Closed-form starting point (height, x_0, sigma_1, sigma_2) of two_lorentz
+    for every row of data. The center is the argmax of the smoothed row and
+    the widths are the distances to the half maximum crossings on either
+    side. Rows where this leaves the bounds of fit_two_lorentz get the old
+    constant start.
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    smoothed = uniform_filter1d(data, size=smooth, axis=1)
+    x_0 = np.argmax(smoothed, axis=1)
+    height = smoothed[np.arange(data.shape[0]), x_0]
+    above = smoothed >= height[:, None]/2
+    left = np.argmax(above, axis=1)
+    right = data.shape[1] - 1 - np.argmax(above[:, ::-1], axis=1)
+    param = np.stack([height, x_0, x_0 - left, right - x_0], axis=1).astype(float)
+    return fallback(param, np.ones(data.shape[0], dtype=bool),
+                    TWO_LORENTZ_START, TWO_LORENTZ_BOUNDS)
+
+def fallback(param, valid, start, bounds):
+    ''' Replace rows that are not valid or not strictly within bounds with start '''
+    lower, upper = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    valid = valid & np.all(np.isfinite(param) & (param > lower) & (param < upper), axis=1)
+    return np.where(valid[:, None], param, np.asarray(start, dtype=float))
+
+def fit_gaussian(data, param=None):
+    ''' Fit oned_gaussian_func to data, starting from estimate_gaussian unless param is given '''
     x = np.arange(data.shape[0])
     err = lambda p: np.ravel(oned_gaussian_func(*p)(x)) - data
-    pfit = least_squares(err, [0.1, x.shape[0]//2, x.shape[0]/2],
-                      bounds = ([0., x.shape[0]//2 - 300, 0],
-                                [0.5, x.shape[0]//2 + 300, x.shape[0]*3]))
+    jac = lambda p: jacobian_oned_gaussian_func(*p)(x).T
+    if param is None:
+        param = estimate_gaussian(data)[0]
+    pfit = least_squares(err, param, jac=jac, bounds=gaussian_bounds(x.shape[0]))
     s_sq = ((oned_gaussian_func(*pfit.x)(x)-data)**2).sum()/(x.shape[0]-len(pfit.x))
     pcov = pfit.jac.T @ pfit.jac
     pcov = pcov * s_sq
@@ -30,8 +98,9 @@ def fit_gaussian(data):
 def fit_pv(data):
     x = np.arange(data.shape[0])
     err = lambda p: np.ravel(pseudovoigt(*p)(x)) - data
+    jac = lambda p: jacobian_pseudovoigt(*p)(x)
     pfit, _, _, _, _ = leastsq(err, [0.1, x.shape[0]//2, 200, 0.5],
-            full_output=1)
+            Dfun=jac, col_deriv=1, full_output=1)
     return pfit
 
 
@@ -58,19 +127,22 @@ def fit_pearson3(data):
 def fit_two_gaussian(data):
     x = np.arange(data.shape[0])    
     err = lambda p: np.ravel(two_gaussian(*p)(x)) - data
+    jac = lambda p: jacobian_two_gaussian(*p)(x)
     pfit, _, _, _, _ = leastsq(err, [0.1, x.shape[0]//2, 200, 200],
-             full_output=1)
+             Dfun=jac, col_deriv=1, full_output=1)
     print(pfit)
     return pfit, 123
 
-def fit_two_lorentz(data):
+def fit_two_lorentz(data, param=None):
+    ''' Fit two_lorentz to data, starting from estimate_two_lorentz unless param is given '''
     x = np.arange(data.shape[0])
     err = lambda p: np.ravel(two_lorentz(*p)(x)) - data
+    jac = lambda p: jacobian_two_lorentz(*p)(x).T
+    if param is None:
+        param = estimate_two_lorentz(data)[0]
     #pfit, _, _, _, _ = leastsq(err, [0.1, x.shape[0]//2, 200, 200],
     #         full_output=1)
-    pfit = least_squares(err, [0.1, 150, 250, 250],
-                      bounds = ([0.,  50,  50.,  50.],
-                                [0.4, 250, 300., 300.]))
+    pfit = least_squares(err, param, jac=jac, bounds=TWO_LORENTZ_BOUNDS)
     s_sq = ((two_lorentz(*pfit.x)(x)-data)**2).sum()/(x.shape[0]-len(pfit.x))
     pcov = pfit.jac.T @ pfit.jac
     pcov = pcov * s_sq
@@ -0,0 +1,163 @@
+'''
+Vectorized inverses of the calibration surfaces.
+
+The temperature surface Tpeak = (b*x + c)*P**(d*x**2 + e*x + f) + offset of
+x = log10(velocity) and power P has a closed form inverse for P, which is
+evaluated for whole arrays of (dwell, Tpeak). Surfaces of (x, P), e.g. the
+stripe widths, are then evaluated at the inverted power. Targets without a
+closed form inverse, e.g. a quench rate, are solved for x with a safeguarded
+Newton iteration on every point at once. Every result comes with a validity
+mask, False for points outside the range of the calibration.
+'''
+import numpy as np
+
+from error_funcs import cubic_surface, twod_surface
+
+VELOCITY_DWELL = 88200. # velocity [mm/s] * dwell [us]
+
+def log_velocity(dwell):
+    ''' log10 of the velocity of a dwell '''
+    return np.log10(VELOCITY_DWELL/np.asarray(dwell, dtype=float))
+
+def dwell_of_log_velocity(log_velo):
+    return VELOCITY_DWELL/10**np.asarray(log_velo, dtype=float)
+
+def power_given_log_velocity(temp_fit, log_velo, tpeak, offset=0., power_range=(0., np.inf)):
+    '''
+    Closed form inverse of the temperature surface, error_funcs.inverse_temp_surface
+    for arrays. Returns the powers and whether each is finite and in power_range.
+    '''
+    b, c, d, e, f = temp_fit
+    log_velo, tpeak = np.broadcast_arrays(np.asarray(log_velo, dtype=float),
+                                          np.asarray(tpeak, dtype=float))
+    with np.errstate(all='ignore'):
+        base = (tpeak - offset)/(b*log_velo + c)
+        power = base**(1/(d*log_velo**2 + e*log_velo + f))
+        valid = (np.isfinite(power) & (base > 0)
+                 & (power >= power_range[0]) & (power <= power_range[1]))
+    return power, valid
+
+def power_given_temp(temp_fit, dwell, tpeak, offset=0., power_range=(0., np.inf)):
+    ''' Powers for arrays of dwell [us] and Tpeak, with their validity mask '''
+    return power_given_log_velocity(temp_fit, log_velocity(dwell), tpeak,
+                                    offset, power_range)
+
+def surface_given_temp(surface, temp_fit, dwell, tpeak, offset=0.,
+                       power_range=(0., np.inf)):
+    '''
+    A calibration surface of (log10 velocity, power), e.g. a width surface,
+    evaluated at the power of every (dwell, Tpeak). Returns values and validity.
+    '''
+    log_velo = log_velocity(dwell)
+    power, valid = power_given_log_velocity(temp_fit, log_velo, tpeak, offset, power_range)
+    with np.errstate(all='ignore'):
+        value = surface(log_velo, power)
+    return value, valid & np.isfinite(value)
+
+def solve_log_velocity(residual, log_velo_range=(1., 3.), tol=1e-10, max_iter=50, step=1e-6):
+    '''
+    Roots x of residual(x) = 0 in log_velo_range, for a residual that acts
+    elementwise on an array of points. Newton steps use central differences
+    and fall back to bisection when they leave the bracket, so every point
+    whose residual changes sign over the range converges.
+
+    Return:
+        x: roots, nan where there is no root
+        valid: whether a root was found
+    '''
+    lower = np.asarray(residual(np.asarray(log_velo_range[0], dtype=float)), dtype=float)
+    shape = lower.shape
+    x_lo = np.full(shape, float(log_velo_range[0]))
+    x_hi = np.full(shape, float(log_velo_range[1]))
+    with np.errstate(all='ignore'):
+        f_lo = lower
+        f_hi = np.broadcast_to(residual(x_hi), shape)
+        valid = np.isfinite(f_lo) & np.isfinite(f_hi) & (np.sign(f_lo) != np.sign(f_hi))
+        valid |= (f_lo == 0) | (f_hi == 0)
+        x = np.where(f_lo == 0, x_lo, np.where(f_hi == 0, x_hi, (x_lo + x_hi)/2))
+        done = ~valid | (f_lo == 0) | (f_hi == 0)
+        for _ in range(max_iter):
+            if done.all():
+                break
+            f_x = residual(x)
+            slope = (residual(x + step) - residual(x - step))/(2*step)
+            newton = x - f_x/slope
+            # Keep the bracket [x_lo, x_hi] around the sign change
+            low_side = np.sign(f_x) == np.sign(f_lo)
+            x_lo = np.where(low_side & ~done, x, x_lo)
+            f_lo = np.where(low_side & ~done, f_x, f_lo)
+            x_hi = np.where(~low_side & ~done, x, x_hi)
+            inside = np.isfinite(newton) & (newton > x_lo) & (newton < x_hi)
+            x_new = np.where(inside, newton, (x_lo + x_hi)/2)
+            # An exact root is also a bracket end, keep it rather than bisect
+            x_new = np.where(f_x == 0, x, x_new)
+            converged = (np.abs(x_new - x) <= tol*np.maximum(1., np.abs(x))) | (f_x == 0)
+            x = np.where(done, x, x_new)
+            done |= converged
+    valid &= done
+    return np.where(valid, x, np.nan), valid
+
+class InverseCalibration():
+    '''
+    Batch predictions of a calibration for the active learning loop.
+
+    Args:
+        temp_fit: (b, c, d, e, f) of the temperature surface
+    Keyword Args:
+        left_width_fit, right_width_fit: cubic_surface and twod_surface
+                                         parameters of the stripe widths
+        quench_fit: twod_surface parameters of the log10 quench rate
+        offset: temperature at zero power, 27 for the 2024 calibrations
+        power_range: powers the calibration is valid for
+        log_velo_range: log10 velocities searched for quench targets
+
+    Example:
+        calib = InverseCalibration(TEMP_FIT, LEFT_WIDTH_FIT, RIGHT_WIDTH_FIT, offset=27.)
+        power, valid = calib.power(dwells, tpeaks)
+    '''
+
+    def __init__(self, temp_fit, left_width_fit=None, right_width_fit=None,
+                 quench_fit=None, offset=0., power_range=(0., np.inf),
+                 log_velo_range=(1., 3.)):
+        self.temp_fit = temp_fit
+        self.left_width_fit = left_width_fit
+        self.right_width_fit = right_width_fit
+        self.quench_fit = quench_fit
+        self.offset = offset
+        self.power_range = power_range
+        self.log_velo_range = log_velo_range
+
+    def power(self, dwell, tpeak):
+        ''' Powers and validity of arrays of dwell and Tpeak '''
+        return power_given_temp(self.temp_fit, dwell, tpeak, self.offset, self.power_range)
+
+    def widths(self, dwell, tpeak):
+        ''' Left and right widths of arrays of dwell and Tpeak, and their validity '''
+        assert self.left_width_fit is not None and self.right_width_fit is not None, \
+            "Width surfaces are not given."
+        left, left_valid = surface_given_temp(cubic_surface(*self.left_width_fit),
+                                              self.temp_fit, dwell, tpeak,
+                                              self.offset, self.power_range)
+        right, right_valid = surface_given_temp(twod_surface(*self.right_width_fit),
+                                                self.temp_fit, dwell, tpeak,
+                                                self.offset, self.power_range)
+        return left, right, left_valid & right_valid
+
+    def velocity_power(self, tpeak, quench):
+        '''
+        Velocities and powers reaching arrays of Tpeak and log10 quench rate,
+        solved for log10 velocity, with their validity.
+        '''
+        assert self.quench_fit is not None, "Quench surface is not given."
+        quench_surface = twod_surface(*self.quench_fit)
+        tpeak, quench = np.broadcast_arrays(np.asarray(tpeak, dtype=float),
+                                            np.asarray(quench, dtype=float))
+
+        def residual(log_velo):
+            power, _ = power_given_log_velocity(self.temp_fit, log_velo, tpeak, self.offset)
+            return quench_surface(log_velo, power) - quench
+
+        log_velo, valid = solve_log_velocity(residual, self.log_velo_range)
+        power, power_valid = power_given_log_velocity(self.temp_fit, log_velo, tpeak,
+                                                      self.offset, self.power_range)
+        return 10**log_velo, power, valid & power_valid
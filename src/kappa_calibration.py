@@ -0,0 +1,112 @@
+'''
+Thermoreflectance (kappa) calibration of every velocity at once.
+
+The ΔR/R of each velocity is described by the power law a*P**e of the
+laser power P (error_funcs.exponential_fit). All power laws are fitted
+together as straight lines in log space, log(ΔR/R) = log(a) + e*log(P),
+from per-velocity sums, and kappa follows in closed form from the melt
+powers: a*P_melt**e/kappa = T_melt. Calibrating again with other melt
+powers only repeats the closed form step.
+'''
+import numpy as np
+
+from error_funcs import exponential_fit
+
+T_MELT_SI = 1390. # Si melt above room temperature (24 C)
+T_MELT_GOLD = 1037.
+
+KAPPA_DTYPE = np.dtype([('velocity', float), ('e', float), ('a', float),
+                        ('kappa', float), ('n_points', int)])
+
+def fit_power_laws(velocity, power, dr, weights=None):
+    '''
+    Power law a*P**e of dr for every velocity, fitted in log space.
+
+    Args:
+        velocity, power, dr: 1d arrays of the data points
+        weights: weights of the points in the log space fit. dr**2 by
+                 default, which approximates the least squares fit of dr
+                 itself that leastsq of exponential_fit does.
+
+    Return:
+        velocities: sorted distinct velocities
+        e, a: power law of every velocity, nan with fewer than two usable points
+        n_points: number of usable points (dr > 0, power > 0) of every velocity
+    '''
+    velocity, power, dr = (np.ravel(np.asarray(v, dtype=float)) for v in (velocity, power, dr))
+    velocities, index = np.unique(velocity, return_inverse=True)
+    usable = (dr > 0) & (power > 0)
+    w = dr**2 if weights is None else np.ravel(np.asarray(weights, dtype=float))
+    w = np.where(usable, w, 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(usable, np.log(power), 0.)
+        y = np.where(usable, np.log(dr), 0.)
+        n_velo = len(velocities)
+        s_w, s_x, s_y, s_xx, s_xy = (np.bincount(index, weights=w*v, minlength=n_velo)
+                                     for v in (np.ones_like(x), x, y, x*x, x*y))
+        e = (s_w*s_xy - s_x*s_y)/(s_w*s_xx - s_x**2)
+        a = np.exp((s_y - e*s_x)/s_w)
+    n_points = np.bincount(index, weights=usable, minlength=n_velo).astype(int)
+    e[n_points < 2] = np.nan
+    a[n_points < 2] = np.nan
+    return velocities, e, a, n_points
+
+def closed_form_kappa(e, a, melt_power, t_melt=T_MELT_SI, melt_power_gold=None,
+                      t_melt_gold=T_MELT_GOLD):
+    '''
+    kappa of arrays of power laws, such that a*P_melt**e/kappa = t_melt.
+    With gold melt powers as well, kappa is the least squares solution of
+    both conditions, sum(f**2)/sum(f*T) with f = a*P**e; nan gold melt
+    powers are ignored.
+    '''
+    f_si = a*np.asarray(melt_power, dtype=float)**e
+    if melt_power_gold is None:
+        return f_si/t_melt
+    f_gold = a*np.asarray(melt_power_gold, dtype=float)**e
+    has_gold = np.isfinite(f_gold)
+    f_gold = np.where(has_gold, f_gold, 0.)
+    return (f_si**2 + f_gold**2)/(f_si*t_melt + f_gold*t_melt_gold*has_gold)
+
+def melt_array(velocities, melt):
+    ''' Melt powers of velocities from a Configs.MELT like dict (string keys), nan if missing '''
+    melt = {float(v): p for v, p in (melt or {}).items()}
+    return np.array([melt.get(v, np.nan) for v in velocities], dtype=float)
+
+def calibrate_kappa(velocity, power, dr, melt, melt_gold=None, t_melt=T_MELT_SI,
+                    t_melt_gold=T_MELT_GOLD, weights=None):
+    '''
+    kappa of every velocity and the data converted to temperature.
+
+    Args:
+        velocity, power, dr: (velocity, power, ΔR/R) table as 1d arrays
+        melt: Configs.MELT, Si melt power of each velocity
+        melt_gold: optional Configs.MELT_GOLD
+        t_melt, t_melt_gold: temperature rise at the melts
+
+    Return:
+        table: structured array of velocity, e, a, kappa and n_points; kappa
+               is nan for velocities without a melt power
+        temperature: dr/kappa of every point, nan where kappa is unknown
+
+    Example:
+        table, full_data[:, 2] = calibrate_kappa(*full_data[:, :3].T, config.MELT)
+    '''
+    velocities, e, a, n_points = fit_power_laws(velocity, power, dr, weights)
+    gold = None if melt_gold is None else melt_array(velocities, melt_gold)
+    kappa = closed_form_kappa(e, a, melt_array(velocities, melt), t_melt, gold, t_melt_gold)
+    table = np.zeros(len(velocities), dtype=KAPPA_DTYPE)
+    table['velocity'] = velocities
+    table['e'] = e
+    table['a'] = a
+    table['kappa'] = kappa
+    table['n_points'] = n_points
+    index = np.searchsorted(velocities, np.ravel(np.asarray(velocity, dtype=float)))
+    return table, np.ravel(dr)/kappa[index]
+
+def temperature_func(row):
+    ''' Calibrated temperature rise of a row of the kappa table as a function of power '''
+    return lambda p: exponential_fit(row['e'], row['a'])(p)/row['kappa']
+
+def power_at(table, temperature):
+    ''' Power reaching a temperature rise for every velocity of a kappa table '''
+    return (temperature*table['kappa']/table['a'])**(1/table['e'])
@@ -12,9 +12,7 @@ from matplotlib.colors import ListedColormap
 from util import sort_current
 from temp_calibration import fit_xy_to_z_surface_with_func
 from error_funcs import test_new_temp_surface, linear
-
-def exponential_fit(e, a):
-    return lambda x: a*(x-y_th)**e #+ b*(x-y_th)
+from kappa_calibration import calibrate_kappa, temperature_func
 
 ######################## Constant Definition ############################
 FPS = 40.
@@ -79,37 +77,21 @@ for j in path.glob("*.json"):
 
 result = np.array(full_d)
 print(result)
-pfits = {}
+melt = {velo: melt_func(np.log10(velo)) for velo in target}
+kappa_table, temperature = calibrate_kappa(result[:,0], result[:,1], result[:,2],
+                                           melt, t_melt=1414)
+pfits = {row['velocity']: np.array([row['e'], row['a']]) for row in kappa_table}
 kappa_ls = []
-for velo in list(target):
-    t =[]
-    for row in result:
-        if row[0] == velo:
-            t.append([row[1:]])
-    t = np.array(t)
-    x = t[:,0,0]
-    err_func = lambda p: np.ravel(exponential_fit(*p)(x))-t[:, 0, 1]
-    pfit, _ = leastsq(err_func, [2., 1.], maxfev=2000)
-    pfits[velo] = pfit
-    fit_func = exponential_fit(*pfit)
-#    xx = np.linspace(np.min(x)-5, np.max(x)+5, 50)
-#    plt.plot(xx, exponential_fit(*pfit)(xx), label=str(int(i))+"mm per sec")
-#    plt.scatter(x, t[:,0,1])
-#plt.legend()
-#plt.xlabel("Power (W)")
-#plt.ylabel("Projected temperature")
-#plt.show()
-    
-    ########### kappa fit for each velocity ############
-    kappa_err = lambda kappa: fit_func(melt_func(np.log10(velo)))/kappa - 1414 
-    #kappa_err = lambda kappa: fit_func(pp[dd.tolist().index(velo)])/kappa - 817 
-    kappa_fit, _ = leastsq(kappa_err, [0.00014])
-    print(velo, kappa_fit)
-    kappa_ls.append(kappa_fit[0])
+for row in kappa_table:
+    velo = row['velocity']
+    mask = result[:,0] == velo
+    print(velo, row['kappa'])
+    kappa_ls.append(row['kappa'])
+    x = result[mask,1]
     xx = np.linspace(np.min(x)-5, np.max(x)+5, 50)
-    plt.plot(xx, exponential_fit(*pfit)(xx)/kappa_fit, label=str(int(velo))+"mm per sec")
-    plt.scatter(x, t[:,0,1]/kappa_fit)
-    result[result[:,0]==velo,2] /= kappa_fit
+    plt.plot(xx, temperature_func(row)(xx), label=str(int(velo))+"mm per sec")
+    plt.scatter(x, temperature[mask])
+    result[mask,2] = temperature[mask]
 plt.legend()
 plt.xlabel("Power (W)")
 plt.ylabel("Projected temperature")
@@ -5,7 +5,6 @@ each other and averages.
 '''
 from functools import partial
 from pathlib import Path
-from multiprocessing import Pool
 import os
 
 from tqdm import tqdm
@@ -13,17 +12,28 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from temp_calibration import fit_center
+from registration import RegisteredAverage, fourier_shift
+from util import get_dtype
+from running_stats import RunningStats
+from shared_frames import SharedFrames
 
 KAPPA = 1.2*10**-4
 
 def preprocess(live_img_path, wanted_frames, blank_img_input, x_r=(0, 1024), y_r=(0, 1280),
                blank_bypass=False, center_estimate=False,
-               power=False, dwell=False, plot=False, savefig=False):
+               power=None, dwell=None, plot=False, savefig=False, warm_start=None,
+               register=False):
     '''
     Take a directory of live images, a directory of blank images
     and a yaml file as input then output the image that is ready
     to be put into the calibration module. Probably don't want
     to include kappa.
+
+    Passing the same WarmStart as warm_start to every condition seeds the
+    center fits from the previous frame of the run or the closest power of
+    the dwell.
+    With register=True frames are aligned by phase correlation and averaged
+    in the Fourier domain, see register_imgs.
     '''
     if blank_bypass:
         blank_im = blank_img_input[x_r[0]:x_r[1], y_r[0]:y_r[1]]
@@ -32,33 +42,46 @@ def preprocess(live_img_path, wanted_frames, blank_img_input, x_r=(0, 1024), y_r
     png_ls = generate_png_names_from_dict(wanted_frames)
     png_ls = [live_img_path + '/' + png for png in png_ls]
     live_imgs = read_img_array(png_ls)[:, x_r[0]:x_r[1], y_r[0]:y_r[1]]
+    # Run of every frame, in the order of generate_png_names_from_dict
+    runs = [run for run in wanted_frames for _ in wanted_frames[run]]
+    if register:
+        registered, x_s, y_s, pfits = register_imgs(live_imgs, blank_im,
+                                                    center_estimate, power, dwell,
+                                                    plot, savefig, warm_start)
+        return registered.mean, x_s, y_s, pfits
     if center_estimate:
         live_imgs, x_s, y_s, pfits = shift_calibration_to_imgs(live_imgs, blank_im,
                                                       center_estimate,
-                                                      power, dwell, plot, savefig)
+                                                      power, dwell, plot, savefig,
+                                                      warm_start=warm_start, runs=runs)
     else:
         live_imgs, x_s, y_s, pfits = shift_calibration_to_imgs(live_imgs, blank_im,
-                                  power=power, dwell=dwell, plot=plot, savefig=savefig)
+                                  power=power, dwell=dwell, plot=plot, savefig=savefig,
+                                  warm_start=warm_start, runs=runs)
     live_img = np.mean(live_imgs, axis=0)
     return live_img, x_s, y_s, pfits
 
-def preprocess_by_frame(live_img, blank_img, x_r, y_r):
+def preprocess_by_frame(live_img, blank_img, x_r, y_r, pyramid=None, window=None):
     '''
     Take single images of live and blank and fit the laser
     Needs to be modified.
+    pyramid and window select the coarse-to-fine fit of fit_center.
     '''
     live = live_img - blank_img
     reflectance = np.mean(blank_img[300:,:])
     live = (live/reflectance)[x_r[0]:x_r[1], y_r[0]:y_r[1]]
-    _, _, pfit = fit_center(live)
+    _, _, pfit = fit_center(live, pyramid=pyramid, window=window)
     return pfit
 
-def parrallel_processing_frames(live_imgs, blank_imgs, x_r, y_r):
-    ''' Multiprocessing version of preprocess_by_frame '''
-    preprocess_in_range = partial(preprocess_by_frame, x_r=x_r, y_r=y_r)
-    with Pool() as pool:
-        pfit = pool.starmap(preprocess_in_range, zip(live_imgs, blank_imgs))
-        return pfit
+def parrallel_processing_frames(live_imgs, blank_imgs, x_r, y_r, pyramid=None, window=None):
+    '''
+    Multiprocessing version of preprocess_by_frame. The frames are placed in
+    shared memory once instead of being pickled to the workers.
+    '''
+    preprocess_in_range = partial(preprocess_by_frame, x_r=x_r, y_r=y_r,
+                                  pyramid=pyramid, window=window)
+    with SharedFrames(live_imgs, blank_imgs) as frames:
+        return frames.starmap(preprocess_in_range)
 
 def generate_png_name(run, led, laser, num):
     '''
@@ -87,19 +110,28 @@ def read_img_array(img_ls, channel_num=2):
     a np array with corresponding shape.
     '''
     width, height = get_dimension(img_ls[0])
-    read_img_arr = np.zeros((len(img_ls), width, height))
+    read_img_arr = np.zeros((len(img_ls), width, height), dtype=get_dtype())
     for idx, img in tqdm(enumerate(img_ls), desc='Reading Image Array...'):
-        read_img_arr[idx] = plt.imread(img).astype(float)[:,:,channel_num]
+        read_img_arr[idx] = plt.imread(img)[:,:,channel_num]
     return read_img_arr
 
 def get_dimension(img):
     ''' give the dimension of the 3rd channel of the image (nominally blue channel)'''
-    return plt.imread(img).astype(float)[:,:,2].shape
+    return plt.imread(img)[:,:,2].shape
 
 def get_average_blue_img(img_ls):
     ''' Return the average of the third channel fo the given array of image path'''
-    imgs = read_img_array(img_ls)
-    return np.mean(imgs, axis=0)
+    return average_blue_img(img_ls).mean
+
+def average_blue_img(img_ls, channel_num=2):
+    '''
+    Streaming per-pixel mean and variance of the given channel of a list of
+    image paths, without reading all the images into memory.
+    '''
+    stats = RunningStats()
+    for img in tqdm(img_ls, desc='Averaging Images...'):
+        stats.update(plt.imread(img)[:,:,channel_num])
+    return stats
 
 def parse_laser_condition(dir_name):
     ''' Pasrse directory name to get dwell and power as a dictionary '''
@@ -182,12 +214,13 @@ def average_images(png_ls):
     '''
     im_ls = []
     for png in tqdm(png_ls, desc='Reading imgs...'):
-        im_ls.append(plt.imread(png).astype(float)[:,:,2])
+        im_ls.append(plt.imread(png)[:,:,2].astype(get_dtype()))
     im_arr = np.array(im_ls)
     return np.mean(im_arr, axis=0)
 
 def shift_calibration_to_imgs(imgs, blank_im, center_estimate=False,
-                   power=False, dwell=False, plot=False, savefig=False):
+                   power=None, dwell=None, plot=False, savefig=False,
+                   warm_start=None, register=False, runs=None):
     '''
     Take an array of images (which are np arrays) and blank image for
     subtracting the background. The image is then fitted with a double
@@ -203,17 +236,34 @@ def shift_calibration_to_imgs(imgs, blank_im, center_estimate=False,
     dwell: as is
     num: number of frames
     plot: boolean for whether to plot the fitted beam profile
-    '''
+    warm_start: optional WarmStart, each frame is then seeded from the
+                previous one of its run and power, or the closest power
+                fitted, instead of from moments()
+    runs: run of every frame, keys the warm start together with power
+    register: align frames by sub-pixel phase correlation instead of
+              fitting every frame, see register_imgs
+    '''
+    if register:
+        registered, x_arr, y_arr, pfits = register_imgs(imgs, blank_im, center_estimate,
+                                                        power, dwell, plot, savefig,
+                                                        warm_start)
+        offsets = registered.shifts.mean(axis=0) - registered.shifts
+        for idx, _ in enumerate(imgs):
+            imgs[idx] = fourier_shift(imgs[idx], offsets[idx])
+        return imgs, x_arr, y_arr, pfits
     x_ls = []
     y_ls = []
     pfits = []
     for idx, _ in tqdm(enumerate(imgs), desc='Read and find center...'):
         imgs[idx] = (imgs[idx]-blank_im)/blank_im/KAPPA
+        run = None if runs is None else runs[idx]
         if center_estimate:
-            x, y, pfit = fit_center(imgs[idx], center_estimate, power, dwell, idx, plot, savefig)
+            x, y, pfit = fit_center(imgs[idx], center_estimate, power, dwell, idx, plot, savefig,
+                                    warm_start=warm_start, run=run)
         else:
             x, y, pfit = fit_center(imgs[idx], power=power, dwell=dwell,
-                                    num=idx, plot=plot, savefig=savefig)
+                                    num=idx, plot=plot, savefig=savefig,
+                                    warm_start=warm_start, run=run)
         x_ls.append(x)
         y_ls.append(y)
         pfits.append(pfit)
@@ -222,11 +272,45 @@ def shift_calibration_to_imgs(imgs, blank_im, center_estimate=False,
     pfits = np.array(pfits)
     m_x = np.mean(x_arr)
     m_y = np.mean(y_arr)
+    # Centers are sub-pixel, shift by the closest whole number of pixels
     for idx, _ in enumerate(imgs):
-        imgs[idx] = np.roll(imgs[idx], int(m_x-x_arr[idx]), axis=0)
-        imgs[idx] = np.roll(imgs[idx], int(m_y-y_arr[idx]), axis=1)
+        imgs[idx] = np.roll(imgs[idx], int(np.round(m_x-x_arr[idx])), axis=0)
+        imgs[idx] = np.roll(imgs[idx], int(np.round(m_y-y_arr[idx])), axis=1)
     return imgs, x_arr, y_arr, pfits
 
+def register_imgs(imgs, blank_im, center_estimate=False, power=None, dwell=None,
+                  plot=False, savefig=False, warm_start=None, whiten=1.):
+    '''
+    Normalize imgs in place as shift_calibration_to_imgs does and register
+    them to the first frame by phase correlation, see
+    registration.cross_power for whiten. Only the registered
+    average is fitted with fit_center, the center of every frame is that
+    center moved by the frame's shift.
+
+    Return:
+        registered: RegisteredAverage of the frames, registered.mean is the
+                    aligned average
+        x_arr, y_arr: sub-pixel centers of every frame
+        pfits: fitted parameters of the average, moved to every center
+    '''
+    registered = RegisteredAverage(whiten=whiten)
+    for idx, _ in tqdm(enumerate(imgs), desc='Read and register...'):
+        imgs[idx] = (imgs[idx]-blank_im)/blank_im/KAPPA
+        registered.update(imgs[idx])
+    if center_estimate:
+        x, y, pfit = fit_center(registered.mean, center_estimate, power, dwell,
+                                plot=plot, savefig=savefig, warm_start=warm_start)
+    else:
+        x, y, pfit = fit_center(registered.mean, power=power, dwell=dwell,
+                                plot=plot, savefig=savefig, warm_start=warm_start)
+    offsets = registered.shifts - registered.shifts.mean(axis=0)
+    x_arr = x + offsets[:, 0]
+    y_arr = y + offsets[:, 1]
+    pfits = np.tile(pfit, (len(offsets), 1))
+    pfits[:, 1] = x_arr
+    pfits[:, 2] = y_arr
+    return registered, x_arr, y_arr, pfits
+
 def im_to_temp(img, blank_img, kappa):
     '''
     Turn reflectance data and turn into temperature
@@ -1,77 +1,82 @@
 """ Function for dealing with Mike's raw files """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from enum import Enum
+import struct
 
 from cv2 import imwrite
 from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
 
-from util import parse_fn, is_bg
+from util import parse_fn, parse_run_frame, is_bg, get_dtype
+from demosaic import Color, demosaic
+from running_stats import RunningStats, FrameStats
 
 HEADER_LEN = 152 
-# TODO: Make this into a class so filter can be constructed once the dimensions
-#       are specified.
-# FIXME: Need to modify this depend on what image size you are capturing
-X_DIM = 772#1024 # 1200 1024# 772   #1200 
-Y_DIM = 1024# 1280 # 1920 #1280# 1024 #1920 
-BLUE_FILTER = np.tile(np.vstack((np.zeros(Y_DIM), np.tile([1,0], Y_DIM//2))),
-                     (X_DIM//2, 1))
-RED_FILTER = np.tile(np.vstack((np.tile([0, 1], Y_DIM//2), np.zeros(Y_DIM))),
-                     (X_DIM//2, 1))
-GREEN_FILTER = np.tile(np.vstack((np.tile([1,0], Y_DIM//2), np.tile([0, 1], Y_DIM//2))), (X_DIM//2, 1))
+RAW_MAGIC = 1249612495 # 0x4A7B92CF
+# Same layout as ClientZOOCAMProtocol.HEAD_ZOOCAM_RAW_IMAGE_DATA_structure_format
+RAW_HEADER_FORMAT = "<I I I I d d Q d I I I I I I I 16s 16s I I I I I I I d d"
+RAW_HEADER_FIELDS = ('magic', 'header_size', 'major_version', 'minor_version',
+                     'exposure', 'master_gain', 'image_time', 'camera_time',
+                     'year', 'month', 'day', 'hour', 'min', 'sec', 'msec',
+                     'model', 'serial', 'type', 'color_correction',
+                     'width', 'height', 'bit_depth', 'pixel_bytes',
+                     'image_bytes', 'pixel_width', 'pixel_height')
+RAW_HEADER_STRUCT = struct.Struct(RAW_HEADER_FORMAT)
+PREFETCH_DEPTH = 4
+PREFETCH_MAX_BYTES = 2**30
 
 class RawReader():
-
-    def __init__(self, x_dim, y_dim, header_len = 152):
-        self._x_dim = x_dim
-        self._y_dim = y_dim
-
-        self.set_filters()
+    '''
+    Reader for raw files. Dimensions and header length are read from the
+    header of every file unless they are given here.
+
+    If a region of interest x_r=(x_min, x_max), y_r=(y_min, y_max) is given,
+    only those rows and columns plus a one pixel Bayer margin are read from
+    disk and demosaiced, and the returned image is the cropped region. The
+    values match a full-frame decode followed by the crop, except on the
+    outermost rows and columns of the sensor.
+    '''
+
+    def __init__(self, x_dim = None, y_dim = None, header_len = None,
+                 x_r = None, y_r = None):
+        self.x_dim = x_dim
+        self.y_dim = y_dim
+        self.header_len = header_len
+        self.x_r = x_r
+        self.y_r = y_r
 
     @property
-    def x_dim(self):
-        return self._x_dim
-
-    @x_dim.setter
-    def x_dim(self, value):
-        self._x_dim = value
-        self.set_filters()
+    def blue_filter(self):
+        return self.get_blue_filter()
 
     @property
-    def y_dim(self):
-        return self._y_dim
+    def red_filter(self):
+        return self.get_red_filter()
 
-    @y_dim.setter
-    def y_dim(self, value):
-        self._y_dim = value
-        self.set_filters()
-
-    def set_filters(self):
-        self.blue_filter = self.get_blue_filter()
-        self.red_filter = self.get_red_filter()
-        self.green_filter = self.get_green_filter()
+    @property
+    def green_filter(self):
+        return self.get_green_filter()
 
     def get_blue_filter(self):
-        return np.tile(np.vstack((np.zeros(self.y_dim), np.tile([1,0], self.y_dim//2))),
-                         (self.x_dim//2, 1))
+        return bayer_filters(self.x_dim, self.y_dim)[Color.Blue]
 
     def get_red_filter(self):
-        return np.tile(np.vstack((np.tile([0, 1], self.y_dim//2), np.zeros(self.y_dim))),
-                     (self.x_dim//2, 1))
+        return bayer_filters(self.x_dim, self.y_dim)[Color.Red]
 
     def get_green_filter(self):
-        return np.tile(np.vstack((np.tile([1,0], self.y_dim//2),
-                                      np.tile([0, 1], self.y_dim//2))),
-                           (self.x_dim//2, 1))
+        return bayer_filters(self.x_dim, self.y_dim)[Color.Green]
 
     def load_blue(self, fp):
-        with open(fp, 'br') as f:
-            data = f.read()
+        return self.load(fp, Color.Blue)
 
-        val = read_uint12(data[HEADER_LEN:])
-        val = val.reshape(self.x_dim, self.y_dim)
-        return get_interpolation(val, Color.Blue, self.blue_filter)
+    def load(self, fp, color):
+        val = memmap_raw(fp, self.x_dim, self.y_dim, self.header_len)
+        if self.x_r is None and self.y_r is None:
+            return get_interpolation(val, color)
+        return load_roi(val, color, self.x_r, self.y_r)
 
 
     def read_uint12(self, data_chunk):
@@ -81,14 +86,239 @@ class RawReader():
         uint12 = fst_uint8 + (snd_uint8 << 8)
         return uint12 
 
-def load_blue(fp, ):
+@lru_cache(maxsize=None)
+def bayer_filters(x_dim, y_dim):
+    '''
+    0/1 masks of every color on a x_dim by y_dim sensor, built once per
+    dimension. Returned arrays are read-only since they are shared.
+    '''
+    filters = {
+        Color.Blue: np.tile(np.vstack((np.zeros(y_dim), np.tile([1,0], y_dim//2))),
+                            (x_dim//2, 1)),
+        Color.Red: np.tile(np.vstack((np.tile([0, 1], y_dim//2), np.zeros(y_dim))),
+                           (x_dim//2, 1)),
+        Color.Green: np.tile(np.vstack((np.tile([1,0], y_dim//2),
+                                        np.tile([0, 1], y_dim//2))),
+                             (x_dim//2, 1)),
+        }
+    for fil in filters.values():
+        fil.flags.writeable = False
+    return filters
+
+def read_header(fp):
+    '''
+    Decode the header written by ClientZOOCAMProtocol.write_raw_image into
+    a dictionary with the keys of HEAD_ZOOCAM_RAW_IMAGE_DATA_todict.
+    '''
     with open(fp, 'br') as f:
-        data = f.read()
+        data_list = RAW_HEADER_STRUCT.unpack(f.read(RAW_HEADER_STRUCT.size))
+    header = dict(zip(RAW_HEADER_FIELDS, data_list))
+    assert header['magic'] == RAW_MAGIC, f"{fp} is not a ZOOCAM raw file."
+    for key in ('model', 'serial'):
+        header[key] = header[key].decode('utf-8', errors = "ignore").split('\x00', 1)[0]
+    return header
+
+def get_dimension(fp):
+    ''' (x_dim, y_dim) of the image in a raw file, i.e. (height, width) '''
+    header = read_header(fp)
+    return header['height'], header['width']
+
+def memmap_raw(fp, x_dim=None, y_dim=None, header_len=None):
+    '''
+    Memory-map the pixels of a raw file without reading or copying them.
+    The 12 bit pixels are stored as little endian uint16, so the mapped
+    view gives the same values as read_uint12 on the file content.
+    Dimensions and header length not given are taken from the file header.
+    '''
+    if x_dim is None or y_dim is None or header_len is None:
+        header = read_header(fp)
+        x_dim = header['height'] if x_dim is None else x_dim
+        y_dim = header['width'] if y_dim is None else y_dim
+        header_len = header['header_size'] if header_len is None else header_len
+    return np.memmap(fp, dtype='<u2', mode='r', offset=header_len,
+                     shape=(x_dim, y_dim))
 
-    val = read_uint12(data[HEADER_LEN:])
-    val = val.reshape(X_DIM, Y_DIM)
+def load_blue(fp, ):
+    val = memmap_raw(fp)
     return get_interpolation(val, Color.Blue)
 
+def prefetch(fps, loader=load_blue, depth=PREFETCH_DEPTH,
+             max_bytes=PREFETCH_MAX_BYTES, workers=None):
+    '''
+    Yield loader(fp) for every fp in fps, in the order of fps, while the next
+    files are read and decoded on a thread pool. At most depth frames, and
+    no more than max_bytes of decoded frames, are loaded ahead of the
+    consumer.
+
+    Example:
+        for idx, img in enumerate(prefetch(sorted(dir_path.glob("*.raw")))):
+            imgs[idx] = img
+    '''
+    fps = list(fps)
+    assert depth >= 1, "depth should be at least 1."
+    pending = deque()
+    next_idx = 0
+    limit = 1 # Until the size of a decoded frame is known
+    with ThreadPoolExecutor(max_workers=workers or depth) as pool:
+        try:
+            while pending or next_idx < len(fps):
+                while next_idx < len(fps) and len(pending) < limit:
+                    pending.append(pool.submit(loader, fps[next_idx]))
+                    next_idx += 1
+                data = pending.popleft().result()
+                frame_bytes = max(getattr(data, 'nbytes', 0), 1)
+                limit = max(1, min(depth, max_bytes // frame_bytes))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+
+def load_roi(val, color, x_r=None, y_r=None):
+    '''
+    Demosaic the region x_r, y_r of a (memory-mapped) raw frame. Only the
+    region and a one pixel margin, widened to keep the Bayer phase, is read.
+    '''
+    x_r = (0, val.shape[0]) if x_r is None else x_r
+    y_r = (0, val.shape[1]) if y_r is None else y_r
+    x_min, x_max = get_roi_window(x_r, val.shape[0])
+    y_min, y_max = get_roi_window(y_r, val.shape[1])
+    window = np.array(val[x_min:x_max, y_min:y_max])
+    new_data = get_interpolation(window, color)
+    return new_data[x_r[0]-x_min:x_r[1]-x_min, y_r[0]-y_min:y_r[1]-y_min]
+
+def get_roi_window(rng, dim):
+    ''' Even-aligned bounds of rng with a one pixel margin, clipped to dim '''
+    low = max(rng[0] - 1, 0)
+    high = min(rng[1] + 1, dim)
+    return low - low % 2, min(high + high % 2, dim)
+
+class RawDirectory():
+    '''
+    A directory of Run-XXXX_Frame-YYYY.raw files seen as one (run, frame, x, y)
+    array of raw pixels. Files are only memory-mapped when indexed, e.g.
+    RawDirectory(path)[2, 5, 480:580] touches 100 rows of a single file.
+    '''
+
+    def __init__(self, dir_path, x_dim=None, y_dim=None, header_len=None):
+        self.dir_path = Path(dir_path)
+        fps = sorted(self.dir_path.glob("Run-*_Frame-*.raw"))
+        assert fps, f"No Run-XXXX_Frame-YYYY.raw files in {self.dir_path}."
+        header = read_header(fps[0])
+        self.x_dim = header['height'] if x_dim is None else x_dim
+        self.y_dim = header['width'] if y_dim is None else y_dim
+        self.header_len = header['header_size'] if header_len is None else header_len
+
+        run_frames = [parse_run_frame(fp) for fp in fps]
+        self.runs = sorted({run for run, _ in run_frames})
+        self.frames = sorted({frame for _, frame in run_frames})
+        assert len(fps) == len(self.runs) * len(self.frames), \
+               f"{self.dir_path} does not contain every frame of every run."
+        self.files = np.empty((len(self.runs), len(self.frames)), dtype=object)
+        for fp, (run, frame) in zip(fps, run_frames):
+            self.files[self.runs.index(run), self.frames.index(frame)] = fp
+
+    @property
+    def shape(self):
+        return (*self.files.shape, self.x_dim, self.y_dim)
+
+    def __len__(self):
+        return self.files.shape[0]
+
+    def memmap(self, run_idx, frame_idx):
+        ''' Memory-mapped raw pixels of a single (run, frame) '''
+        return memmap_raw(self.files[run_idx, frame_idx], self.x_dim,
+                          self.y_dim, self.header_len)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        files = self.files[key[:2]]
+        pixel_key = key[2:]
+        if not isinstance(files, np.ndarray):
+            return memmap_raw(files, self.x_dim, self.y_dim, self.header_len)[pixel_key]
+        pixels = [memmap_raw(fp, self.x_dim, self.y_dim, self.header_len)[pixel_key]
+                  for fp in files.ravel()]
+        return np.stack(pixels).reshape(*files.shape, *pixels[0].shape)
+
+class FrameStack():
+    '''
+    A (run, frame) array of raw file paths seen as a (run, frame, x, y) array
+    of demosaiced frames. A frame is only decoded the first time it is
+    indexed and is kept afterwards, so raw[i, frame] only ever loads the
+    frames that are used. np.asarray(stack) decodes every frame.
+    '''
+
+    def __init__(self, files, x_dim, y_dim, loader=load_blue):
+        self.files = np.asarray(files)
+        assert self.files.ndim == 2, "files should be a (run, frame) array."
+        self.x_dim = x_dim
+        self.y_dim = y_dim
+        self.loader = loader
+        self.cache = {}
+
+    @property
+    def shape(self):
+        return (*self.files.shape, self.x_dim, self.y_dim)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def dtype(self):
+        return np.dtype(get_dtype())
+
+    def __len__(self):
+        return self.files.shape[0]
+
+    def frame(self, run_idx, frame_idx):
+        ''' Demosaiced frame of a single (run, frame), decoded on first use '''
+        key = []
+        for name, idx, size in zip(('run', 'frame'), (int(run_idx), int(frame_idx)),
+                                   self.files.shape):
+            if not -size <= idx < size:
+                raise IndexError(f"{name} index {idx} is out of range for size {size}.")
+            key.append(idx % size)
+        key = tuple(key)
+        if key not in self.cache:
+            self.cache[key] = np.asarray(self.loader(self.files[key]),
+                                         dtype=get_dtype())
+        return self.cache[key]
+
+    def load(self, indices):
+        ''' Decode the (run, frame) indices that are not cached yet with prefetch '''
+        missing = [(int(i), int(j)) for i, j in indices if (i, j) not in self.cache]
+        frames = prefetch([self.files[key] for key in missing], self.loader)
+        for key, data in zip(missing, frames):
+            self.cache[key] = np.asarray(data, dtype=get_dtype())
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        runs = np.arange(self.files.shape[0])[key[0]]
+        frames = np.arange(self.files.shape[1])[key[1]]
+        pixel_key = key[2:]
+        if runs.ndim == 0 and frames.ndim == 0:
+            return self.frame(runs, frames)[pixel_key]
+        run_grid, frame_grid = np.meshgrid(np.atleast_1d(runs), np.atleast_1d(frames),
+                                           indexing='ij')
+        self.load(zip(run_grid.ravel(), frame_grid.ravel()))
+        pixels = [self.frame(i, j)[pixel_key]
+                  for i, j in zip(run_grid.ravel(), frame_grid.ravel())]
+        data = np.stack(pixels).reshape(*run_grid.shape, *pixels[0].shape)
+        # Drop the axes indexed by integers
+        if runs.ndim == 0:
+            data = data[0]
+        elif frames.ndim == 0:
+            data = data[:, 0]
+        return data
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype)
+
 def load_background_series(position: str, fps: list):
     bg_ls = []
     bg_data = []
@@ -97,15 +327,29 @@ def load_background_series(position: str, fps: list):
         if is_bg(current) and position == _position:
             bg_ls.append(fp)
 
-    for bg in sorted(bg_ls):#, desc = f"Loading background at {position}"):
-        bg_data.append(load_blue(bg))
+    for bg in prefetch(sorted(bg_ls)):#, desc = f"Loading background at {position}"):
+        bg_data.append(bg)
 
     return bg_data
 
-class Color(Enum):
-    Red = 1
-    Blue = 2
-    Green = 3
+def average_blue(fps, loader=load_blue):
+    ''' Streaming per-pixel mean and variance of the blue channel of raw files '''
+    stats = RunningStats()
+    for frame in prefetch(fps, loader):
+        stats.update(frame)
+    return stats
+
+def average_runs(files, loader=load_blue):
+    '''
+    Streaming per-pixel mean and variance over runs of every frame index.
+    files is a (run, frame) array of raw file paths.
+    '''
+    files = np.asarray(files)
+    stats = FrameStats()
+    frame_indices = np.indices(files.shape)[1].ravel()
+    for frame_idx, frame in zip(frame_indices, prefetch(files.ravel(), loader)):
+        stats.update(int(frame_idx), frame)
+    return stats
 
 def read_uint12(data_chunk):
     """ For little endien"""
@@ -205,58 +449,15 @@ def get_blue_left_edge(data: np.array, pos_x: int):
     elif this_color == Color.Green:
         return (data[pos_x-1, 0] + data[pos_x+1, 0])/2
 
-def get_interpolation(data: np.array, color: Color, _filter = None) -> float:
-    # Corners
-    new_data = np.zeros(data.shape)
-    new_data[0, 0] = get_top_left_corner(data, color)
-    new_data[0, -1] = get_top_right_corner(data, color)
-    new_data[-1, 0] = get_bottom_left_corner(data, color)
-    new_data[-1, -1] = get_bottom_right_corner(data, color) 
-    # Edges
-
-    if color == Color.Blue: # TODO: Use matrix operation instead for center pixels
-        fil = BLUE_FILTER if _filter is None else _filter
-        blue = data * fil #BLUE_FILTER
-        for i in range(1, data.shape[1]-1):
-            new_data[0, i] = get_blue_top_edge(data, i)
-            new_data[-1, i] = get_blue_bottom_edge(data, i)
-        for i in range(1, data.shape[0]-1):
-            new_data[i, 0] = get_blue_left_edge(data, i)
-            new_data[i, -1] = get_blue_right_edge(data, i) 
-        new_data[1:-1, 1:-1] += blue[1:-1, 1:-1]
-        new_data[1:-1, 1:-1] += ( (np.roll(blue, 1, axis=1) 
-                                  + np.roll(blue, -1, axis=1)
-                                  + np.roll(blue, 1, axis=0) 
-                                  + np.roll(blue, -1, axis=0))/2
-                                + ( np.roll(blue, (1,1), axis=(0,1))
-                                  + np.roll(blue, (-1,1), axis=(0,1))
-                                  + np.roll(blue, (1,-1), axis=(0,1))
-                                  + np.roll(blue, (-1,-1), axis=(0,1))) /4 
-                               )[1:-1, 1:-1]
-        #for pos_x in range(1, data.shape[0]-1):
-        #    for pos_y in range(1, data.shape[1]-1):
-        #        new_data[pos_x, pos_y] = get_b_interpolation(data, pos_x, pos_y)
-    elif color == Color.Red:
-        fil = RED_FILTER if _filter is None else _filter
-        red = data * fil #RED_FILTER
-        new_data += red 
-        new_data += ( (np.roll(red, 1, axis=1)
-                        + np.roll(red, -1, axis=1)
-                        + np.roll(red, 1, axis=0)
-                        + np.roll(red, -1, axis=0))/2
-                      + ( np.roll(red, (1,1), axis=(0,1))
-                        + np.roll(red, (-1,1), axis=(0,1))
-                        + np.roll(red, (1,-1), axis=(0,1))
-                        + np.roll(red, (-1,-1), axis=(0,1))) /4)
-    elif color == Color.Green:
-        fil = RED_FILTER if _filter is None else _filter
-        green = data * fil #GREEN_FILTER
-        new_data += green 
-        new_data += (   np.roll(green, (0,1), axis=(0,1))
-                      + np.roll(green, (1,0), axis=(0,1))
-                      + np.roll(green, (-1,0), axis=(0,1))
-                      + np.roll(green, (0,-1), axis=(0,1))) /4
-    return new_data
+def get_interpolation(data: np.array, color: Color, _filter = None,
+                      backend = 'numpy') -> float:
+    '''
+    Interpolate the given color channel of a raw frame in the precision set
+    by util.set_precision. The work is done by demosaic.demosaic; _filter is
+    no longer needed since the Bayer sub-lattices are sliced directly, and is
+    kept so existing callers do not break.
+    '''
+    return demosaic(data, color, backend=backend, dtype=get_dtype())
 #    color = get_color(pos_x, pos_y)
 #    if color == Color.Green:
 #        return (data[pos_x-1, pos_y] + data[pos_x+1, pos_y])/2
@@ -0,0 +1,154 @@
+'''
+Sub-pixel frame registration by FFT (phase) correlation.
+
+Frames are aligned to a reference by the position of the peak of their
+phase correlation, refined to sub-pixel precision on a correlation
+upsampled around the peak by a matrix-multiply DFT and a 2D quadratic
+through the 3x3 neighbourhood of its maximum. Shifts are applied in the Fourier domain and
+the aligned spectra are summed there, so averaging n frames costs one
+forward and one inverse transform per frame and a single inverse
+transform for the average.
+'''
+import numpy as np
+from scipy import fft
+
+from util import get_dtype
+
+def shift_phase(shape, shift):
+    '''
+    rfft2 phase factor that moves an image of the given shape by
+    shift = (dx, dy) pixels, i.e. np.roll(img, (dx, dy)) for whole pixels.
+    '''
+    k_x = fft.fftfreq(shape[0])[:, None]
+    k_y = fft.rfftfreq(shape[1])[None, :]
+    return np.exp(-2j*np.pi*(k_x*shift[0] + k_y*shift[1]))
+
+def fourier_shift(img, shift):
+    ''' img moved by a sub-pixel shift = (dx, dy), wrapping around like np.roll '''
+    spectrum = fft.rfft2(img)*shift_phase(np.shape(img), shift)
+    return fft.irfft2(spectrum, s=np.shape(img)).astype(img.dtype)
+
+def cross_power(ref_spectrum, spectrum, whiten=1.):
+    '''
+    Cross-power spectrum of two rfft2 spectra, divided by its magnitude to
+    the power whiten. whiten=1 is classic phase correlation, whiten=0
+    plain cross-correlation, which is much more robust to noise for
+    smooth beam profiles.
+    '''
+    power = np.conj(ref_spectrum)*spectrum
+    if whiten:
+        power /= np.abs(power)**whiten + np.finfo(power.real.dtype).tiny
+    return power
+
+def phase_correlation(ref_spectrum, spectrum, shape, whiten=1., upsample=10):
+    '''
+    Sub-pixel shift (dx, dy) of a frame relative to the reference, given
+    both rfft2 spectra and the frame shape. Shifts are within half a frame.
+    '''
+    power = cross_power(ref_spectrum, spectrum, whiten)
+    corr = fft.irfft2(power, s=shape)
+    peak = np.array(np.unravel_index(np.argmax(corr), shape), dtype=float)
+    peak = np.where(peak > np.array(shape)/2, peak - shape, peak)
+    return subpixel_peak(power, shape, peak, upsample)
+
+def upsampled_correlation(power, shape, center, upsample, size):
+    '''
+    size x size inverse DFT of the rfft2 cross-power spectrum on a grid of
+    spacing 1/upsample pixels centered on center, by matrix multiplies.
+    '''
+    k_x = fft.fftfreq(shape[0])
+    k_y = fft.rfftfreq(shape[1])
+    # Weights of the half spectrum, the DC and Nyquist columns count once
+    weight = np.full(k_y.size, 2.)
+    weight[0] = 1.
+    if shape[1] % 2 == 0:
+        weight[-1] = 1.
+    offset = (np.arange(size) - size//2)/upsample
+    e_x = np.exp(2j*np.pi*np.outer(center[0] + offset, k_x))
+    e_y = np.exp(2j*np.pi*np.outer(k_y, center[1] + offset))
+    return (e_x @ (power*weight) @ e_y).real
+
+def subpixel_peak(power, shape, peak, upsample=10):
+    '''
+    Refine a whole pixel peak of the correlation: find the maximum of the
+    correlation upsampled within a pixel of it, then fit a 2D quadratic,
+    with the xy term so correlated beams are not biased, through the 3x3
+    neighbourhood of that maximum.
+    '''
+    size = int(1.5*upsample) | 1
+    corr = upsampled_correlation(power, shape, peak, upsample, size)
+    idx = np.clip(np.unravel_index(np.argmax(corr), corr.shape), 1, size-2)
+    values = corr[idx[0]-1:idx[0]+2, idx[1]-1:idx[1]+2].ravel()
+    x, y = [grid.ravel() for grid in np.indices((3, 3)) - 1]
+    design = np.column_stack([np.ones(9), x, y, x**2, y**2, x*y])
+    a = np.linalg.lstsq(design, values, rcond=None)[0]
+    hessian = np.array([[2*a[3], a[5]], [a[5], 2*a[4]]])
+    # Only a maximum is a valid peak, otherwise keep the grid point
+    offset = -np.linalg.solve(hessian, a[1:3]) if np.all(np.linalg.eigvalsh(hessian) < 0) \
+             else np.zeros(2)
+    return peak + (idx - size//2 + np.clip(offset, -1, 1))/upsample
+
+class RegisteredAverage():
+    '''
+    Running average of frames registered to a reference frame, the first
+    frame added unless reference is given. The average is placed at the
+    mean position of the frames, as the np.roll alignment of
+    preprocess.shift_calibration_to_imgs does, but without rounding the
+    shifts to whole pixels.
+
+    Example:
+        avg = RegisteredAverage().update_all(frames)
+        avg.mean, avg.shifts
+    '''
+
+    def __init__(self, reference=None, whiten=1.):
+        self.whiten = whiten
+        self.count = 0
+        self._shape = None
+        self._ref = None
+        self._sum = None
+        self._shifts = []
+        if reference is not None:
+            self.set_reference(reference)
+
+    def set_reference(self, reference):
+        reference = np.asarray(reference, dtype=get_dtype())
+        self._shape = reference.shape
+        self._ref = fft.rfft2(reference)
+
+    def update(self, frame):
+        ''' Register a single frame and add it to the average '''
+        frame = np.asarray(frame, dtype=get_dtype())
+        spectrum = fft.rfft2(frame)
+        if self._ref is None:
+            self._shape = frame.shape
+            self._ref = spectrum
+        assert frame.shape == self._shape, \
+            f"Frame of shape {frame.shape} does not match the reference {self._shape}."
+        shift = phase_correlation(self._ref, spectrum, self._shape, self.whiten)
+        spectrum *= shift_phase(self._shape, -shift)
+        if self._sum is None:
+            self._sum = spectrum
+        else:
+            self._sum += spectrum
+        self._shifts.append(shift)
+        self.count += 1
+        return self
+
+    def update_all(self, frames):
+        ''' Register and add every frame of an iterable of frames '''
+        for frame in frames:
+            self.update(frame)
+        return self
+
+    @property
+    def shifts(self):
+        ''' (count, 2) shifts of every frame relative to the reference '''
+        return np.array(self._shifts).reshape(-1, 2)
+
+    @property
+    def mean(self):
+        ''' Average of the aligned frames, at the mean position of the frames '''
+        phase = shift_phase(self._shape, self.shifts.mean(axis=0))
+        avg = fft.irfft2(self._sum*phase/self.count, s=self._shape)
+        return avg.astype(get_dtype())
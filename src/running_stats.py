@@ -0,0 +1,104 @@
+'''
+One-pass (Welford) per-pixel statistics for averaging background frames
+without holding every frame in memory.
+'''
+import numpy as np
+
+from util import get_dtype
+
+class RunningStats():
+    '''
+    Per-pixel running mean and variance of a series of equally shaped frames.
+    Memory use is three frames regardless of how many frames are added.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+        self._delta = None
+
+    def update(self, frame):
+        ''' Add a single frame to the statistics '''
+        frame = np.asarray(frame)
+        if self._mean is None:
+            self._mean = np.zeros(frame.shape, dtype=get_dtype())
+            self._m2 = np.zeros(frame.shape, dtype=get_dtype())
+            self._delta = np.empty(frame.shape, dtype=get_dtype())
+        self.count += 1
+        np.subtract(frame, self._mean, out=self._delta)
+        self._mean += self._delta / self.count
+        self._delta *= frame - self._mean
+        self._m2 += self._delta
+        return self
+
+    def update_all(self, frames):
+        ''' Add every frame of an iterable of frames '''
+        for frame in frames:
+            self.update(frame)
+        return self
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def variance(self):
+        ''' Sample variance of every pixel '''
+        if self.count < 2:
+            return np.zeros_like(self._mean)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def uncertainty(self):
+        '''
+        Standard error of the mean of every pixel, usable as the uncertainty
+        of fit_xy_to_z_surface_with_func.
+        '''
+        return np.sqrt(self.variance / self.count)
+
+class FrameStats():
+    '''
+    RunningStats for every frame index of a set of runs, e.g. the average
+    over runs of frame 0, frame 1, ... of a background directory.
+    '''
+
+    def __init__(self):
+        self.stats = {}
+
+    def update(self, frame_idx, frame):
+        if frame_idx not in self.stats:
+            self.stats[frame_idx] = RunningStats()
+        self.stats[frame_idx].update(frame)
+        return self
+
+    def __getitem__(self, frame_idx):
+        return self.stats[frame_idx]
+
+    def __len__(self):
+        return len(self.stats)
+
+    @property
+    def frame_indices(self):
+        return sorted(self.stats)
+
+    @property
+    def count(self):
+        return np.array([self.stats[i].count for i in self.frame_indices])
+
+    @property
+    def mean(self):
+        ''' (frame, x, y) array of the mean of every frame index '''
+        return np.array([self.stats[i].mean for i in self.frame_indices])
+
+    @property
+    def variance(self):
+        return np.array([self.stats[i].variance for i in self.frame_indices])
+
+    @property
+    def uncertainty(self):
+        return np.array([self.stats[i].uncertainty for i in self.frame_indices])
@@ -0,0 +1,104 @@
+'''
+Shared memory transport of frame stacks to multiprocessing pools.
+
+The stacks are copied once into a single multiprocessing.shared_memory
+block. Tasks only carry FrameRef descriptors (block name, byte offset,
+shape, dtype, ROI) and the workers map the frames from the block
+without copying, instead of every frame being pickled to the worker.
+'''
+from collections import namedtuple
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+FrameRef = namedtuple('FrameRef', ['name', 'offset', 'shape', 'dtype', 'roi'])
+FrameRef.__doc__ = '''
+A frame in a shared block: byte offset, shape and dtype of the frame and
+an optional ROI ((x_min, x_max), (y_min, y_max)) of it.
+'''
+
+# Blocks attached by this (worker) process, by name
+_ATTACHED = {}
+
+class SharedFrames():
+    '''
+    Stacks of frames, e.g. live and blank images, in one shared block.
+    The block is removed when the context exits.
+
+    Example:
+        with SharedFrames(live_imgs, blank_imgs) as frames:
+            pfits = frames.starmap(preprocess_by_frame)
+    '''
+
+    def __init__(self, *stacks):
+        stacks = [np.asarray(stack) for stack in stacks]
+        assert stacks, "No frame stack given."
+        assert all(len(stack) == len(stacks[0]) for stack in stacks), \
+            "Frame stacks should have the same number of frames."
+        self.offsets = []
+        size = 0
+        for stack in stacks:
+            size = -(-size // 64) * 64 # align every stack to 64 bytes
+            self.offsets.append(size)
+            size += stack.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.stacks = []
+        for stack, offset in zip(stacks, self.offsets):
+            shared = np.ndarray(stack.shape, stack.dtype, buffer=self.shm.buf, offset=offset)
+            shared[...] = stack
+            self.stacks.append(shared)
+
+    def __len__(self):
+        return len(self.stacks[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        ''' Release the views and remove the shared block '''
+        self.stacks = []
+        self.shm.close()
+        self.shm.unlink()
+
+    def refs(self, stack_idx, roi=None):
+        ''' FrameRef of every frame of a stack '''
+        stack = self.stacks[stack_idx]
+        frame_bytes = stack[0].nbytes if len(stack) else 0
+        return [FrameRef(self.shm.name, self.offsets[stack_idx] + idx*frame_bytes,
+                         stack.shape[1:], stack.dtype.str, roi)
+                for idx in range(len(stack))]
+
+    def starmap(self, func, roi=None, processes=None):
+        '''
+        [func(frame_0[i], frame_1[i], ...) for every frame i] of the stacks,
+        evaluated in a process pool with the frames read from shared memory.
+        func must be picklable, e.g. a module level function or a partial.
+        '''
+        refs = zip(*[self.refs(idx, roi) for idx in range(len(self.stacks))])
+        with Pool(processes) as pool:
+            return pool.starmap(call_with_frames, [(func, ref) for ref in refs])
+
+def attach(name):
+    ''' Shared block of the given name, attached once per process '''
+    if name not in _ATTACHED:
+        # Workers share the resource tracker of the pool's parent, so the
+        # block stays registered once and SharedFrames.close removes it.
+        _ATTACHED[name] = shared_memory.SharedMemory(name=name)
+    return _ATTACHED[name]
+
+def frame(ref):
+    ''' Read-only view of the frame (or its ROI) a FrameRef points to '''
+    shm = _ATTACHED.get(ref.name) or attach(ref.name)
+    img = np.ndarray(ref.shape, np.dtype(ref.dtype), buffer=shm.buf, offset=ref.offset)
+    img.flags.writeable = False
+    if ref.roi is not None:
+        (x_min, x_max), (y_min, y_max) = ref.roi
+        img = img[x_min:x_max, y_min:y_max]
+    return img
+
+def call_with_frames(func, refs):
+    ''' func applied to the frames of refs, run in the worker processes '''
+    return func(*[frame(ref) for ref in refs])
@@ -2,17 +2,21 @@
 Functions for fitting thermal reflectance data and temperature profiles
 '''
 
+from functools import lru_cache
+
 from scipy.optimize import leastsq
 
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
-from error_funcs import gaussian_shift
+from error_funcs import gaussian_shift, get_jacobian, get_design_matrix
+from util import get_dtype
 
-def fit_center(data, center_estimate=False, power=False,
-               dwell=False, num=False, plot=False,
-               savefig=False, verbose=False):
+def fit_center(data, center_estimate=False, power=None,
+               dwell=None, num=False, plot=False,
+               savefig=False, verbose=False, warm_start=None,
+               velocity=None, run=None, pyramid=None, window=None):
     '''
     Find the center of the gaussian with given array of data.
 
@@ -24,41 +28,52 @@ def fit_center(data, center_estimate=False, power=False,
         t, dwell, num: numbers for naming
         plot: whether to plot a figure for the fit
         savefig: whether to save the plotted figure
+        warm_start: a WarmStart that seeds the fit from previous fits of the
+                    same (velocity, run, power) or a neighbouring power
+        velocity, run: keys of the fit for warm_start, velocity defaults to dwell
+        pyramid: block size (e.g. 4 or 8) of a coarse fit on the block-averaged
+                 image that is then refined at full resolution
+        window: with pyramid, refine only within window widths of the beam
 
     Return:
-        xs, ys: array of center positions
+        xs, ys: sub-pixel center position, i.e. pfit[1], pfit[2]
         pfit: an array of fitted parameters of the gaussian
     '''
 
-    if center_estimate:
+    def estimate():
         params = list(moments(data))
-        params[1] = center_estimate[0]
-        params[2] = center_estimate[1]
-        pfit, _ = fit_with(gaussian_shift, data,
-                           param=params, verbose=verbose)
+        if center_estimate:
+            params[1] = center_estimate[0]
+            params[2] = center_estimate[1]
+        return params
+
+    def fit_from(params):
+        if pyramid:
+            return fit_gaussian_pyramid(data, params, pyramid, window, verbose=verbose)
+        return fit_with(gaussian_shift, data, param=params, verbose=verbose)
+
+    if warm_start is not None:
+        velocity = dwell if velocity is None else velocity
+        pfit = warm_start.fit(fit_from, estimate, velocity, run, power)
     else:
-        pfit, _ = fit_with(gaussian_shift, data,
-                           param_estimator=moments, verbose=verbose)
-    fit = gaussian_shift(*pfit)
-    x_s, y_s = np.indices(data.shape)
-    fitted = fit(*(x_s, y_s))
-    tpeak = np.max(fitted)
-    center = np.where(fitted==tpeak)
+        pfit, _ = fit_from(estimate())
+    x_center, y_center = pfit[1], pfit[2]
 
     if verbose:
-        print(center)
-    x_center = center[0][0]
-    y_center = center[1][0]
+        print(x_center, y_center)
 
     if plot:
+        fitted = gaussian_shift(*pfit)(*coordinate_grid(np.shape(data)))
+        x_row = int(np.clip(np.round(x_center), 0, data.shape[0] - 1))
+        y_col = int(np.clip(np.round(y_center), 0, data.shape[1] - 1))
         _, axs = plt.subplots(4)
         axs[0].imshow(data)
         axs[1].imshow(fitted)
-        axs[2].plot(fitted[x_center])
-        axs[2].plot(data[x_center])
+        axs[2].plot(fitted[x_row])
+        axs[2].plot(data[x_row])
         axs[2].set_title('x fit')
-        axs[3].plot(fitted[:, y_center])
-        axs[3].plot(data[:, y_center])
+        axs[3].plot(fitted[:, y_col])
+        axs[3].plot(data[:, y_col])
         axs[3].set_title('y_fit')
 
         if savefig:
@@ -70,8 +85,60 @@ def fit_center(data, center_estimate=False, power=False,
     return x_center, y_center, pfit
 
 
+def block_average(data, factor):
+    ''' Mean of factor x factor blocks of data, dropping incomplete blocks at the edges '''
+    n_x, n_y = data.shape[0]//factor, data.shape[1]//factor
+    return data[:n_x*factor, :n_y*factor].reshape(n_x, factor, n_y, factor).mean(axis=(1, 3))
+
+def rescale_gaussian_shift(params, factor, offset=(0., 0.)):
+    '''
+    gaussian_shift parameters on a grid whose pixel (i, j) lies at
+    (factor*i + offset[0], factor*j + offset[1]) of the original grid,
+    converted to the original grid.
+    '''
+    params = np.array(params, dtype=float)
+    params[1] = params[1]*factor + offset[0]
+    params[2] = params[2]*factor + offset[1]
+    params[3:5] *= factor
+    return params
+
+def fit_gaussian_pyramid(data, param, factor=4, window=None, verbose=False):
+    '''
+    Coarse-to-fine fit of gaussian_shift. The image is first fitted after
+    averaging factor x factor blocks, then refined at full resolution
+    starting from the coarse solution, within window widths of the beam
+    if window is given. Returns (pfit, square root of mean squared error)
+    like fit_with.
+    '''
+    data = np.asarray(data, dtype=get_dtype())
+    # Block (i, j) averages pixels factor*i ... factor*i + factor - 1
+    offset = ((factor-1)/2, (factor-1)/2)
+    coarse_param = rescale_gaussian_shift(param, 1/factor, (-offset[0]/factor,
+                                                            -offset[1]/factor))
+    coarse_pfit, _ = fit_with(gaussian_shift, block_average(data, factor),
+                              param=coarse_param, verbose=verbose)
+    pfit = rescale_gaussian_shift(coarse_pfit, factor, offset)
+    if window is None:
+        return fit_with(gaussian_shift, data, param=pfit, verbose=verbose)
+
+    x_min, x_max = window_bounds(pfit[1], pfit[3], window, data.shape[0])
+    y_min, y_max = window_bounds(pfit[2], pfit[4], window, data.shape[1])
+    pfit[1] -= x_min
+    pfit[2] -= y_min
+    pfit, error = fit_with(gaussian_shift, data[x_min:x_max, y_min:y_max],
+                           param=pfit, verbose=verbose)
+    return rescale_gaussian_shift(pfit, 1, (x_min, y_min)), error
+
+def window_bounds(center, width, window, dim):
+    ''' Pixel range of center +- window*width, clipped to [0, dim) '''
+    half = max(abs(window*width), 1)
+    low = int(np.clip(np.floor(center - half), 0, dim - 1))
+    high = int(np.clip(np.ceil(center + half) + 1, low + 1, dim))
+    return low, high
+
 def fit_xy_to_z_surface_with_func(x, y, z, func, param,
-                                 uncertainty=None, verbose=False):
+                                 uncertainty=None, verbose=False,
+                                 design_matrix=None):
     '''
     fit_xy_to_z_surface_with_func(x, y, z, func, param, uncertainty, verbose)
 
@@ -83,6 +150,11 @@ def fit_xy_to_z_surface_with_func(x, y, z, func, param,
         uncertainty: optional - a ndarray of the same size that describes
                                 the uncertainty at each point
         verbose: optinal bool - whether to print fitting information
+        design_matrix: optional function of (x, y) returning the
+                       (n_param, ...) columns of a model that is linear in
+                       its parameters. Looked up in error_funcs for the
+                       polynomial surfaces. Linear models are solved
+                       directly and param is then only a placeholder.
 
     Return:
         pfit: fitted parameters
@@ -90,34 +162,62 @@ def fit_xy_to_z_surface_with_func(x, y, z, func, param,
         infodict: Information dictionary from scipy.optimize.leastsq
 
     '''
+    if design_matrix is None:
+        design_matrix = get_design_matrix(func)
+    if design_matrix is not None:
+        return fit_linear_surface(x, y, z, design_matrix, uncertainty, verbose)
+
     if uncertainty is None:
         error_func = lambda p: np.ravel(func(*p)(x, y) - z)
     else:
         error_func = lambda p: np.ravel((func(*p)(x, y) - z)/uncertainty)
+    jac_func = jacobian_func(func, len(param), x, y, uncertainty=uncertainty)
 
     pfit, pcov, infodict, errmsg, success = leastsq(error_func, param,
+                                          Dfun=jac_func, col_deriv=1,
                                           full_output=1)
     if verbose:
         print_state(success, errmsg)
 
     return pfit, pcov, infodict
 
+def fit_linear_surface(x, y, z, design_matrix, uncertainty=None, verbose=False):
+    '''
+    Weighted linear least squares fit of a model that is linear in its
+    parameters. Returns the same (pfit, pcov, infodict) as
+    fit_xy_to_z_surface_with_func, with pcov the unscaled covariance
+    (J^T J)^-1 that leastsq returns.
+    '''
+    A = np.reshape(design_matrix(x, y), (-1, np.size(z))).T # pylint: disable=invalid-name
+    b = np.ravel(z)
+    if uncertainty is not None:
+        A = A/np.ravel(uncertainty)[:, None] # pylint: disable=invalid-name
+        b = b/np.ravel(uncertainty)
+    pfit, _, rank, _ = np.linalg.lstsq(A, b, rcond=None)
+    pcov = np.linalg.pinv(A.T @ A)
+    fvec = A @ pfit - b
+    if verbose:
+        print(f'Linear fit of rank {rank}/{A.shape[1]}, residual {np.sum(fvec**2)}.')
+    infodict = {'fvec': fvec, 'fjac': A.T, 'nfev': 1, 'rank': rank}
+    return pfit, pcov, infodict
+
 def self_blank(live, blank, mask):
     '''
     Fit blank using live image and a blank prototype * (linear plane)
     Mask has to be applied so that laser and residual heat is blocked
     '''
+    blank_masked = blank[mask]
     def f(a, b, c):
-        return lambda x, y: blank[mask] * (a*x + b*y + c)
+        return lambda x, y: blank_masked * (a*x + b*y + c)
 
     pfit, _ = fit_with(f, live, mask, param=[0, 0, 1])
     a, b, c = pfit
-    x, y = np.indices(live.shape)
+    x, y = coordinate_grid(live.shape)
     return blank * (a*x + b*y + c)
 
 def fit_mask(data, fit, thresh):
     ''' Given a fitted function fit, create a mask using the thresh value. '''
-    fit_data = fit(*np.indices(data.shape))
+    fit_data = fit(*coordinate_grid(data.shape))
     mask = fit_data < thresh
     #ay = np.where(np.any(~mask, axis=1))
     ax = np.where(np.any(~mask, axis=0))
@@ -130,7 +230,7 @@ def fit_mask(data, fit, thresh):
 
 def trail(data, u = 100., v = 100., b = 100, direction='Down'):
     ''' Create a rectangular mask with intended direction. hj'''
-    X, Y = np.indices(data.shape)
+    X, Y = coordinate_grid(data.shape)
     if direction == 'Down':
         mask = np.logical_or((Y - v)**2 > b**2,  X < u)
     else:
@@ -139,7 +239,7 @@ def trail(data, u = 100., v = 100., b = 100, direction='Down'):
 
 def ellipse(data, u = 100., v = 100., a = 100, b = 50):
     ''' Create a ellipse shape mask. '''
-    X, Y = np.indices(data.shape)
+    X, Y = coordinate_grid(data.shape)
     mask = (X - u)**2/a**2 + (Y - v)**2/b**2 > 1.
     return mask
 
@@ -171,7 +271,7 @@ def moments(data):
     moments.
     """
 
-    X, Y = np.indices(data.shape)
+    X, Y = coordinate_grid(data.shape, data.dtype)
     x = (X*data).sum()/data.sum()
     y = (Y*data).sum()/data.sum()
 
@@ -257,22 +357,19 @@ def fit_with(func, data, mask=None, param_estimator=None,
         pfit_leastsq: fitted parameters
         MSE: square root of sum of errors
     '''
+    problem = FitProblem(data, mask)
     if param is None:
-        param = param_estimator(data)
-    if mask is None:
-        err_func = lambda p: np.ravel(func(*p)(*np.indices(data.shape)) - data)
-    else:
-        X, Y = np.indices(data.shape)
-        A = np.c_[X[mask], Y[mask]].T # pylint: disable=invalid-name
-        err_func = lambda p: np.ravel(func(*p)(*A) - data[mask])
+        param = param_estimator(problem.data)
+    err_func = lambda p: problem.residual(func, p)
+    jac_func = jacobian_func(func, len(param), *problem.coords)
 
-    pfit, pcov, _, errmsg, success = leastsq(err_func, param,
-                                       full_output=1, maxfev=maxfev)
+    pfit, pcov, _, errmsg, success = leastsq(err_func, param, Dfun=jac_func,
+                                       col_deriv=1, full_output=1, maxfev=maxfev)
 
     if verbose:
         print_state(success, errmsg)
 
-    s_sq = (err_func(pfit)**2).sum()/(len(data.flatten()))
+    s_sq = (err_func(pfit)**2).sum()/(problem.data.size)
     error = []
     #for i in range(len(pfit)):
     #    pcov = pcov * s_sq
@@ -281,6 +378,61 @@ def fit_with(func, data, mask=None, param_estimator=None,
     #perr_leastsq = np.array(error)
     return pfit_leastsq, np.sqrt(s_sq)
 
+def coordinate_grid(shape, dtype=None):
+    '''
+    np.indices(shape) as arrays of dtype (the current precision by default),
+    built once per shape and dtype. The arrays are shared and read-only.
+    '''
+    return cached_coordinate_grid(tuple(shape),
+                                  np.dtype(get_dtype() if dtype is None else dtype))
+
+# A full 1200x1920 float64 frame takes 37 MB per entry, so only the few
+# shapes of the current fits are kept
+@lru_cache(maxsize=4)
+def cached_coordinate_grid(shape, dtype):
+    grid = np.indices(shape, dtype=dtype)
+    grid.flags.writeable = False
+    return grid[0], grid[1]
+
+class FitProblem():
+    '''
+    Data of a 2d fit together with its coordinates, masked once instead of
+    on every evaluation of the residuals.
+    '''
+
+    def __init__(self, data, mask=None):
+        self.data = np.asarray(data, dtype=get_dtype())
+        x_s, y_s = coordinate_grid(self.data.shape, self.data.dtype)
+        if mask is None:
+            self.coords = (x_s, y_s)
+            self.target = self.data
+        else:
+            mask = np.asarray(mask, dtype=bool)
+            self.coords = (x_s[mask], y_s[mask])
+            self.target = self.data[mask]
+
+    def residual(self, func, p):
+        '''
+        func(*p) - data at every (unmasked) point, flattened. A new array is
+        returned every time since leastsq keeps previous residuals around for
+        its finite differences.
+        '''
+        return np.ravel(func(*p)(*self.coords) - self.target)
+
+def jacobian_func(func, n_param, *coords, uncertainty=None):
+    '''
+    Dfun for leastsq with col_deriv=1, i.e. a function of the parameters
+    returning the (n_param, n_points) derivative of the residuals, if func
+    has an analytic Jacobian in error_funcs. None otherwise, in which case
+    leastsq falls back to finite differences.
+    '''
+    jac = get_jacobian(func)
+    if jac is None:
+        return None
+    if uncertainty is None:
+        return lambda p: np.reshape(jac(*p)(*coords), (n_param, -1))
+    return lambda p: np.reshape(jac(*p)(*coords)/uncertainty, (n_param, -1))
+
 def print_state(state, errmsg):
     '''Check if the state is success, if not print errmsg'''
     success_states = (1,2,3,4)
@@ -2,8 +2,24 @@
 import os
 
 from tqdm import tqdm
+import numpy as np
 
 BG_CURRENT = "0W"
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+_DTYPE = np.float64
+
+def set_precision(precision: str):
+    '''
+    Set the floating point precision ('float64' or 'float32') that read_raw,
+    preprocess and temp_calibration allocate their images in.
+    '''
+    global _DTYPE # pylint: disable=global-statement
+    assert precision in PRECISIONS, f"{precision} is not one of {list(PRECISIONS)}."
+    _DTYPE = PRECISIONS[precision]
+
+def get_dtype():
+    ''' Floating point type of the current precision setting '''
+    return _DTYPE
 
 def is_bg(current: str):
     return current == BG_CURRENT
@@ -20,6 +36,14 @@ def parse_fn(fn: str):
     position, current, frame_num = fn[:-4].split('_')
     return position, current, frame_num
 
+def parse_run_frame(fn: str):
+    """ Run-0004_Frame-0021.raw -> 4, 21 """
+    if '/' in str(fn):
+        fn = os.path.basename(fn)
+    assert fn[-4:] == ".raw", f"{os.path.basename(fn)} is not a raw file."
+    run, frame = fn[:-4].split('_')
+    return int(run.split('-')[1]), int(frame.split('-')[1])
+
 def get_current_position_dict(file_paths):
     current_position_dict = {}
     for file_path in list(file_paths):
@@ -0,0 +1,86 @@
+'''
+Warm-start policy for repeated fits of similar data, e.g. consecutive
+frames of a run or adjacent powers of a velocity.
+'''
+import numpy as np
+
+class WarmStart():
+    '''
+    Seeds every fit from the last converged result of the same
+    (velocity, run, power), or else of the closest power fitted at the
+    same velocity.
+    If a warm-started fit ends with a residual more than threshold times
+    the residual of the result it was seeded from (or above max_residual),
+    the fit is redone from the estimator and the better result is kept.
+
+    Example:
+        warm_start = WarmStart()
+        for power in powers:
+            preprocess(..., power=power, dwell=dwell, warm_start=warm_start)
+        print(warm_start.report())
+    '''
+
+    def __init__(self, threshold=2., max_residual=None):
+        self.threshold = threshold
+        self.max_residual = max_residual
+        self.by_run = {}
+        self.by_power = {}
+        self.counts = {'warm': 0, 'cold': 0, 'fallback': 0}
+
+    def start(self, velocity=None, run=None, power=None):
+        '''
+        Starting parameters and the residual they were fitted with,
+        or (None, None) if nothing close has been fitted yet.
+        '''
+        if (velocity, run, power) in self.by_run:
+            return self.by_run[(velocity, run, power)]
+        powers = [p for v, p in self.by_power if v == velocity]
+        if power is not None and powers:
+            nearest = min(powers, key=lambda p: abs(p - power))
+            return self.by_power[(velocity, nearest)]
+        return None, None
+
+    def update(self, pfit, residual, velocity=None, run=None, power=None):
+        ''' Record a converged fit '''
+        self.by_run[(velocity, run, power)] = (np.array(pfit), residual)
+        if power is not None:
+            self.by_power[(velocity, power)] = (np.array(pfit), residual)
+
+    def fit(self, fit_func, estimator, velocity=None, run=None, power=None):
+        '''
+        Run fit_func(param) -> (pfit, residual) from a warm start if there is
+        one, else from estimator(). Returns pfit.
+        '''
+        param, seed_residual = self.start(velocity, run, power)
+        if param is None:
+            self.counts['cold'] += 1
+            pfit, residual = fit_func(estimator())
+        else:
+            pfit, residual = fit_func(param)
+            if self.is_worse(residual, seed_residual):
+                self.counts['fallback'] += 1
+                cold_pfit, cold_residual = fit_func(estimator())
+                if not cold_residual > residual:
+                    pfit, residual = cold_pfit, cold_residual
+            else:
+                self.counts['warm'] += 1
+        self.update(pfit, residual, velocity, run, power)
+        return pfit
+
+    def is_worse(self, residual, seed_residual):
+        if not np.isfinite(residual):
+            return True
+        if self.max_residual is not None and residual > self.max_residual:
+            return True
+        return residual > self.threshold * seed_residual
+
+    def reset(self):
+        self.by_run = {}
+        self.by_power = {}
+        self.counts = {key: 0 for key in self.counts}
+
+    def report(self):
+        total = sum(self.counts.values())
+        return (f"{self.counts['warm']}/{total} fits warm-started, "
+                f"{self.counts['fallback']} fell back to the estimator, "
+                f"{self.counts['cold']} started cold.")
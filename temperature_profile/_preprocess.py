@@ -10,10 +10,12 @@ from tqdm import tqdm
 
 from TR_analyzer import Stripe_TR_analyzer, Single_TR_analyzer
 from configure_1113 import Configs
-from read_raw import load_blue
+from read_raw import load_blue, FrameStack
+from bg_cache import BackgroundCache
 
 
 config = Configs() # global lol
+bg_cache = BackgroundCache()
 
 def main():
 
@@ -26,8 +28,7 @@ def main():
         path = path /  "temperature_profile" / f"{velo}mm_per_sec"
 
         bg_path = path / f"{str(dwell).zfill(5)}us_000.00W"
-        bg = load_raws_in_dir(bg_path)
-        bg = np.mean(bg, axis=0) 
+        bg = bg_cache.average_runs(raw_files_in_dir(bg_path), dwell=dwell)
         frame = config.FRAME[velo]
         
         for power in tqdm(sorted(config.POWER[velo]), desc=f'{dwell}us'):
@@ -71,17 +72,14 @@ def main():
             
             
         
-def load_raws_in_dir(dir_path):
-
+def raw_files_in_dir(dir_path):
     files = np.array(sorted(dir_path.glob("*.raw")))
-    files = files.reshape((-1, config.NFRAMES))
-    data = np.zeros((*files.shape, config.X_DIM, config.Y_DIM))
+    return files.reshape((-1, config.NFRAMES))
 
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            data[i, j] = load_blue(files[i, j])
-
-    return data
+def load_raws_in_dir(dir_path):
+    ''' Frames are decoded lazily, only when indexed '''
+    return FrameStack(raw_files_in_dir(dir_path), config.X_DIM, config.Y_DIM,
+                      loader=load_blue)
 
 
 
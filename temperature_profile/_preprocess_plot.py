@@ -12,7 +12,8 @@ from matplotlib import colors as mcolors
 
 from TR_analyzer import Stripe_TR_analyzer, Single_TR_analyzer
 from configure_1113 import Configs
-from read_raw import load_blue, RawReader
+from read_raw import load_blue, RawReader, FrameStack
+from bg_cache import BackgroundCache
 from error_funcs import two_lorentz, oned_gaussian_func
 
 plt.rcParams.update({
@@ -69,6 +70,11 @@ plt.rcParams.update({
 })
 
 config = Configs() # global lol
+bg_cache = BackgroundCache()
+# Only this band of the frames is read and demosaiced; the analyzer works in
+# band coordinates, the plots in frame coordinates
+band_x = (config.X_MIN, config.X_MAX)
+band_y = (config.Y_MIN, config.Y_MAX)
 x_min = config.X_MIN + 25
 x_max = config.X_MAX - 35
 y_min = config.Y_MIN
@@ -87,7 +93,7 @@ def main():
     x = 0.
     y = 0.
 
-    raw_reader = RawReader(config.X_DIM, config.Y_DIM)
+    raw_reader = RawReader(config.X_DIM, config.Y_DIM, x_r=band_x, y_r=band_y)
 
     # for velo, dwell in zip(config.VELOCITY, config.DWELL):
     for velo, dwell in zip([68], [1297]):
@@ -96,8 +102,9 @@ def main():
         path = path / f"{velo}mm_per_sec"
 
         bg_path = path / f"{str(dwell).zfill(5)}us_000.00W"
-        bg = load_raws_in_dir(raw_reader, bg_path)
-        bg = np.mean(bg, axis=0) 
+        bg = bg_cache.average_runs(raw_files_in_dir(bg_path), dwell=dwell,
+                                   roi=(raw_reader.x_r, raw_reader.y_r),
+                                   loader=raw_reader.load_blue)
         frame = config.FRAME[velo]
         
         for power in tqdm(sorted(config.POWER[velo], reverse=True), desc=f'{dwell}us'):
@@ -105,8 +112,8 @@ def main():
             raw = load_raws_in_dir(raw_reader, dir_path)[2, frame, :, :]
 
             analyzer = Single_TR_analyzer(x, y, velo, power, raw, bg[frame])
-            analyzer.analyze_single_frame(x_min = x_min, x_max = x_max,
-                                          y_min = y_min, y_max = y_max)
+            analyzer.analyze_single_frame(x_min = x_min - band_x[0], x_max = x_max - band_x[0],
+                                          y_min = y_min - band_y[0], y_max = y_max - band_y[0])
             print(analyzer.fit_results.shape)
 
             fig = plt.figure()
@@ -116,7 +123,8 @@ def main():
                 y = np.arange(y_min, y_max, interval)
                 x = np.repeat(i, len(y))
                 ind = int(i-x_min)
-                r = analyzer.reflectance[int(i), y_min:y_max:interval]
+                r = analyzer.reflectance[int(i) - band_x[0],
+                                         y_min - band_y[0]:y_max - band_y[0]:interval]
                 r_mask = r > z_min
                 x = x[r_mask]
                 y = y[r_mask]
@@ -204,17 +212,16 @@ def main():
             
             
         
-def load_raws_in_dir(raw_reader, dir_path):
-
+def raw_files_in_dir(dir_path):
     files = np.array(sorted(dir_path.glob("Run*.raw")))
-    files = files.reshape((-1, config.NFRAMES))
-    data = np.zeros((*files.shape, config.X_DIM, config.Y_DIM))
+    return files.reshape((-1, config.NFRAMES))
 
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            data[i, j] = raw_reader.load_blue(files[i, j])
-
-    return data
+def load_raws_in_dir(raw_reader, dir_path):
+    ''' Frames (the ROI of raw_reader) are decoded lazily, only when indexed '''
+    x_r = raw_reader.x_r or (0, config.X_DIM)
+    y_r = raw_reader.y_r or (0, config.Y_DIM)
+    return FrameStack(raw_files_in_dir(dir_path), x_r[1] - x_r[0], y_r[1] - y_r[0],
+                      loader=raw_reader.load_blue)
 
 
 
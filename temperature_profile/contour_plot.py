@@ -65,7 +65,7 @@ xdim = 772
 ydim = 1024
 kappa = 0.00016339
 
-raw_reader = RawReader(xdim, ydim)
+raw_reader = RawReader(xdim, ydim, x_r=(200, 600), y_r=(0, 900))
 path = "/Volumes/Samsung_T5/1113_data/68mm_per_sec/01297us_057.00w"
 bg_path = "/Volumes/Samsung_T5/1113_data/68mm_per_sec/01297us_000.00w"
 
@@ -75,7 +75,7 @@ print(d)
 data = raw_reader.load_blue(d[5])
 bg_data = raw_reader.load_blue(bg_path[5])
 
-drr = gaussian_filter(((data - bg_data) / bg_data)[200:600, :900] / kappa, 12)
+drr = gaussian_filter(((data - bg_data) / bg_data) / kappa, 12)
 plt.imshow(drr)
 x = np.arange(data.shape[1])
 y = np.arange(data.shape[0])
@@ -1,7 +1,6 @@
 import sys
 sys.path.insert(1, '../')
 sys.path.insert(1, '/Users/ming/Desktop/Code/tfc/src')
-from pathlib import Path
 import json
 
 import numpy as np
@@ -10,26 +9,29 @@ from tqdm import tqdm
 
 from TR_analyzer import Single_TR_analyzer
 from configure_0802 import Configs
-from read_raw import load_blue
+from read_raw import load_blue, FrameStack
+from bg_cache import BackgroundCache
+from catalog import Catalog
 
 
 config = Configs() # global lol
+bg_cache = BackgroundCache()
 
 def main():
+    catalog = Catalog('.')
+    catalog.scan()
 
     for velo, dwell in zip(config.VELOCITY, config.DWELL):
         # path = Path(f"/Users/ming/Desktop/CHESS_2023_spring/{velo}mm_per_sec")
-        path = Path(f'{velo}mm_per_sec')
 
         frame = config.FRAME[velo]
 
-        bg_path = path / f"{str(dwell).zfill(5)}us_000.00W"
-        bg = load_raws_in_dir(bg_path, config.N_FRAMES[velo])
-        bg = np.mean(bg, axis=0) 
+        bg_files = catalog.grid(config.N_FRAMES[velo], velocity=velo, dwell=dwell, power=0.)
+        bg = bg_cache.average_runs(bg_files, dwell=dwell)
         
         for power in tqdm(config.POWER[velo], desc=f"velo={velo}"):
-            dir_path = path / f"{str(dwell).zfill(5)}us_{power:06.2f}W" 
-            raw = load_raws_in_dir(dir_path, config.N_FRAMES[velo])
+            files = catalog.grid(config.N_FRAMES[velo], velocity=velo, dwell=dwell, power=power)
+            raw = load_raws(files)
 
             for i in range(raw.shape[0]):
                 # print(velo, power, i, frame)
@@ -83,17 +85,19 @@ def main():
             
             
         
-def load_raws_in_dir(dir_path, n_frames = 30):
-
+def raw_files_in_dir(dir_path, n_frames = 30):
     files = np.array(sorted(dir_path.glob("*.raw")))
-    files = files.reshape((-1, n_frames))
-    data = np.zeros((*files.shape, config.X_DIM, config.Y_DIM))
+    return files.reshape((-1, n_frames))
 
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            data[i, j] = load_blue(files[i, j])
-
-    return data
+def load_raws_in_dir(dir_path, n_frames = 30):
+    return load_raws(raw_files_in_dir(dir_path, n_frames))
+
+def load_raws(files):
+    '''
+    Blue channel of a (run, frame) array of raw file paths. Frames are
+    decoded lazily, only when indexed.
+    '''
+    return FrameStack(files, config.X_DIM, config.Y_DIM, loader=load_blue)
 
 
 
@@ -4,6 +4,24 @@ from scipy.optimize import leastsq
 
 #Version 1.2, used since Feb 7 2024 at 21:24
 
+# Calibration surfaces of log10 velocity and power. For many lookups,
+# calibration_table.profile_table(<this module>) tabulates them (opt-in).
+TEMP_FIT = [-0.00627787, 0.02098353, -0.0380434, 0.09973811, 3.04350629]
+LEFT_WIDTH_FIT = [6.88147388e+02,
+                  -3.04477538e+02,
+                  7.46639925e+00,
+                  7.85029376e+01,
+                  -5.37563384e-01,
+                  6.13558613e+00,
+                  -4.73732102e+00,
+                  4.54535809e-05]
+RIGHT_WIDTH_FIT = [4.29641635e+02,
+                   -9.27919402e+01,
+                   -6.35843978e+00,
+                   4.68378039e+01,
+                   1.10886045e-01,
+                   -2.37801825e+00]
+
 def temp_surface_func(b, c, d, e, f):
     return lambda x, y: (b*x+c)*(y)**(d*x**2+e*x+f) + 27
 
@@ -17,33 +35,16 @@ def cubic_surface(base, a, b, c, d, e, f, g):
     return lambda x, y: base + a*x + b*y + c*x**2 + d*y**2 + e*x*y + f*x**4 + g*y**4
 
 def left_right_width(tau, Temp):
-    left_width_fit = [ 6.88147388e+02,
-                      -3.04477538e+02,
-                      7.46639925e+00, 
-                      7.85029376e+01,
-                      -5.37563384e-01,
-                      6.13558613e+00,
-                      -4.73732102e+00,
-                      4.54535809e-05]
-    right_width_fit = [ 4.29641635e+02,
-                       -9.27919402e+01,
-                       -6.35843978e+00,
-                       4.68378039e+01,
-                       1.10886045e-01,
-                       -2.37801825e+00]
-
-
-    left_width = cubic_surface(*left_width_fit) 
-    right_width = twod_surface(*right_width_fit)
+    left_width = cubic_surface(*LEFT_WIDTH_FIT)
+    right_width = twod_surface(*RIGHT_WIDTH_FIT)
     log10_velocity = np.log10(88200./tau)
     power = LaserPowerMing_Fall2024(tau, Temp, temp_fit = None)
     return left_width(log10_velocity, power), right_width(log10_velocity, power)
 
 
 def LaserPowerMing_Fall2024(dwell, Tpeak, temp_fit = None):
-    print("USING POWER PROFILE MING SPRING 2024")
     if temp_fit is None:
-        temp_fit = [-0.00627787, 0.02098353, -0.0380434, 0.09973811, 3.04350629]
+        temp_fit = TEMP_FIT
 
     velo = 88200/dwell
     log10vel = np.log10(velo)
@@ -12,11 +12,11 @@ import os
 
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import leastsq
 
 from configure_1113 import Configs
 from error_funcs import test_new_temp_surface, twod_surface, cubic_surface
 from temp_calibration import fit_xy_to_z_surface_with_func
+from kappa_calibration import calibrate_kappa, power_at, T_MELT_SI
 
 
 plt.rcParams.update({
@@ -116,60 +116,22 @@ def main():
     # plt.savefig("ΔR_R.svg")
     plt.show()
 
+    # RT = 24 C, pass melt_gold=config.MELT_GOLD to calibrate to both melts
+    kappa_table, temperature = calibrate_kappa(full_data[:,0], full_data[:,1],
+                                               full_data[:,2], config.MELT,
+                                               t_melt=T_MELT_SI)
+    gold_power = power_at(kappa_table, 1040)
+    si_power = power_at(kappa_table, T_MELT_SI)
     for i, velo in enumerate(sorted(config.MELT, key=int)):
-        print(velo)
-        velo_data_arr = full_data[np.where(full_data[:,0]==float(velo))]
-        print(full_data)
-        #plt.plot(velo_data_arr[:,1], velo_data_arr[:,2])
-        err = lambda p: exponential_fit(*p)(velo_data_arr[:,1]) - velo_data_arr[:,2]
-        pfit, _ = leastsq(err, [1., 1.])
-        fit_func = exponential_fit(*pfit)
-        # plt.plot(velo_data_arr[:,1], fit_func(velo_data_arr[:,1]))
-        # plt.title(str(velo))
-        # plt.show()
-
-        # RT = 24 C
-        # err = lambda p: ( fit_func(config.MELT[velo])/p - 1390 
-        #                 + fit_func(config.MELT_GOLD[velo])/p - 1037 )
-        err = lambda p: fit_func(config.MELT[velo])/p - 1390 
-        # err = lambda p: fit_func(config.MELT_GOLD[velo])/p - 1037
-
-        kappa, _ = leastsq(err, [0.00017])
-        fit_func = lambda x: exponential_fit(*pfit)(x)/kappa
-        print(kappa)
-        # kappa = 0.00016429
-        # fit_func = lambda x: exponential_fit(*pfit)(x)/kappa
-
-        x = np.arange(30, 60)
-        # plt.plot(x, fit_func(x))
-
-        # plt.scatter(velo_data_arr[:,1], velo_data_arr[:,2]/kappa + t0, marker='o', color=colors[i])
-        # plt.plot([0], [0], label=f"{velo}mm/s", marker='o', color=colors[i])
-        # x = np.linspace(21, config.MELT[velo], 10)
-        # plt.plot(x, fit_func(x) + t0)
-        # plt.scatter([config.MELT[velo]], 1390 + t0, marker='*', c=colors[i], s=50)
-
-
-        plt.scatter(velo_data_arr[:,1] / config.MELT[velo], velo_data_arr[:,2]/kappa + t0, marker='o', color=colors[i], label=f"{velo} mm/s")
-        # plt.plot([0], [0], label=f"{velo}mm/s", marker='o', color=colors[i])
-        x = np.linspace(21, config.MELT[velo], 10)
-        # plt.plot(x/ config.MELT[velo], fit_func(x) + t0, linestyle=":")
-        # plt.scatter([config.MELT[velo]], 1390 + t0, marker='*', c=colors[i], s=50)
-        # plt.title(str(velo) + " mm/s")
-        # plt.legend()
-        # plt.xlabel("Laser Power (W)")
-        # plt.ylabel("Temperature (C)")
-        # plt.show()
-        full_data[np.where(full_data[:,0]==float(velo)), 2] /= kappa
-
-        velo_data_arr = full_data[np.where(full_data[:,0]==float(velo))]
-        fit_func = lambda x: exponential_fit(*pfit)(x)/kappa - 1040
-        x_gold, _ = leastsq(fit_func, [40.])
-        print("Predicted gold power:", x_gold)
-
-        fit_func = lambda x: exponential_fit(*pfit)(x)/kappa - 1390
-        x_gold, _ = leastsq(fit_func, [40.])
-        print("Predicted si power:", x_gold)
+        mask = full_data[:,0] == float(velo)
+        row = np.searchsorted(kappa_table['velocity'], float(velo))
+        print(velo, kappa_table['kappa'][row])
+
+        plt.scatter(full_data[mask,1] / config.MELT[velo], temperature[mask] + t0, marker='o', color=colors[i], label=f"{velo} mm/s")
+        full_data[mask, 2] = temperature[mask]
+
+        print("Predicted gold power:", gold_power[row])
+        print("Predicted si power:", si_power[row])
 
     velo = list(config.MELT)
     si_melt = [config.MELT[v] for v in velo]
@@ -309,9 +271,6 @@ def main():
     print("STD: ", std)
     print("RMSE/STD: ", rmse/std)
 
-def exponential_fit(e, a):
-    return lambda x: a*(x)**e #+ b*(x-y_th)
-
 def json_fn_parser(json_fn):
     ''' 103mm_34W_run_0.json '''
     split_fn = json_fn.split('.')[0].split('_')
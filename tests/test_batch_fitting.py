@@ -0,0 +1,51 @@
+'''
+batch_least_squares against scipy.optimize.least_squares fitting every row on its own.
+'''
+import numpy as np
+from scipy.optimize import least_squares
+
+from batch_fitting import batch_least_squares
+from error_funcs import oned_gaussian_func, jacobian_oned_gaussian_func
+
+X = np.arange(120)
+
+def gaussian_rows(n_rows=6, seed=0):
+    rng = np.random.default_rng(seed)
+    truth = np.column_stack([rng.uniform(0.05, 0.2, n_rows), rng.uniform(40, 80, n_rows),
+                             rng.uniform(8, 20, n_rows)])
+    data = np.array([oned_gaussian_func(*p)(X) for p in truth])
+    return data + rng.normal(0, 2e-3, data.shape), truth
+
+def scipy_fit(row, param, bounds=(-np.inf, np.inf)):
+    err = lambda p: oned_gaussian_func(*p)(X) - row
+    jac = lambda p: jacobian_oned_gaussian_func(*p)(X).T
+    return least_squares(err, param, jac=jac, bounds=bounds, xtol=1e-12, ftol=1e-12).x
+
+def test_matches_scipy():
+    data, _ = gaussian_rows()
+    param = [0.1, 60., 12.]
+    pfit, infodict = batch_least_squares(oned_gaussian_func, data, param)
+    assert infodict['success'].all()
+    expected = np.array([scipy_fit(row, param) for row in data])
+    np.testing.assert_allclose(pfit, expected, rtol=1e-5)
+
+def test_matches_scipy_with_bounds():
+    data, _ = gaussian_rows(seed=1)
+    param = [0.1, 60., 12.]
+    bounds = ([0., 30., 0.], [0.3, 90., 15.])
+    pfit, _ = batch_least_squares(oned_gaussian_func, data, param, bounds=bounds)
+    expected = np.array([scipy_fit(row, param, bounds) for row in data])
+    assert np.all((pfit >= bounds[0]) & (pfit <= bounds[1]))
+    np.testing.assert_allclose(pfit, expected, rtol=1e-4, atol=1e-6)
+
+def test_masked_points_are_ignored():
+    data, _ = gaussian_rows(seed=2)
+    param = [0.1, 60., 12.]
+    clean, _ = batch_least_squares(oned_gaussian_func, data, param)
+    masked = data.copy()
+    masked[:, :10] = np.nan
+    pfit, _ = batch_least_squares(oned_gaussian_func, masked, param)
+    expected = np.array([least_squares(lambda p, r=row: oned_gaussian_func(*p)(X[10:]) - r[10:],
+                                       param, xtol=1e-12, ftol=1e-12).x for row in data])
+    np.testing.assert_allclose(pfit, expected, rtol=1e-5)
+    assert not np.allclose(pfit, clean, rtol=1e-12, atol=0)
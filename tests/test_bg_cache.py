@@ -0,0 +1,61 @@
+'''
+BackgroundCache keys, hits, eviction and recovery from broken files.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from bg_cache import BackgroundCache, fingerprint
+
+@pytest.fixture
+def cache(tmp_path):
+    return BackgroundCache(tmp_path / 'cache', max_bytes=2**20)
+
+def test_average_is_cached(cache, tmp_path):
+    fps = [tmp_path / f'bg_{idx}.raw' for idx in range(3)]
+    for idx, fp in enumerate(fps):
+        fp.write_bytes(bytes([idx]))
+    frames = {fp: np.full((4, 5), idx, dtype=float) for idx, fp in enumerate(fps)}
+    calls = []
+    def loader(fp):
+        calls.append(fp)
+        return frames[fp]
+    first = cache.average(fps, dwell=500, loader=loader)
+    second = cache.average(fps, dwell=500, loader=loader)
+    np.testing.assert_array_equal(first, np.ones((4, 5)))
+    np.testing.assert_array_equal(first, second)
+    assert len(calls) == 3
+    cache.average(fps, dwell=1000, loader=loader)
+    assert len(calls) == 6
+
+def test_fingerprint_changes_with_files(tmp_path):
+    fp = tmp_path / 'bg.raw'
+    fp.write_bytes(b'\0')
+    before = fingerprint([fp])
+    fp.write_bytes(b'\0\0')
+    assert fingerprint([fp]) != before
+
+def test_evicts_least_recently_used(cache):
+    bg = np.zeros((256, 256), dtype=np.float32) # 256 kB
+    for idx in range(3):
+        cache.put(f'k{idx}', bg)
+        os.utime(cache.path(f'k{idx}'), ns=(idx*10**9, idx*10**9))
+    assert cache.get('k0') is not None # Now the most recently used
+    cache.put('k3', bg)
+    assert not cache.path('k1').exists()
+    assert all(cache.path(key).exists() for key in ('k0', 'k2', 'k3'))
+
+def test_oversized_entry_is_skipped(cache):
+    cache.put('small', np.zeros(10))
+    cache.put('large', np.zeros(2**19))
+    assert cache.get('large') is None
+    assert cache.get('small') is not None
+
+def test_truncated_file_is_a_miss(cache):
+    cache.put('key', np.arange(100.))
+    path = cache.path('key')
+    path.write_bytes(path.read_bytes()[:100])
+    assert cache.get('key') is None
+    assert not path.exists()
+    assert not list(cache.cache_dir.glob('*.tmp'))
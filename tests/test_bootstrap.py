@@ -0,0 +1,55 @@
+'''
+Bootstrap and jackknife fits against direct weighted least squares.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bootstrap import batch_linear_fit, bootstrap, fit_weighted, jackknife
+from error_funcs import exponential_fit, get_design_matrix, twod_surface
+
+def surface_data(seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(1, 3, 60)
+    y = rng.uniform(10, 60, 60)
+    z = twod_surface(100., 20., 5., -3., 0.02, 0.5)(x, y) + rng.normal(0, 1., 60)
+    return (x, y), z
+
+def lstsq_weighted(coords, z, weights):
+    A = np.reshape(get_design_matrix(twod_surface)(*coords), (-1, z.size)).T # pylint: disable=invalid-name
+    w = np.sqrt(weights)
+    return np.linalg.lstsq(A*w[:, None], z*w, rcond=None)[0]
+
+def test_batch_linear_fit_matches_lstsq():
+    coords, z = surface_data()
+    weights = np.random.default_rng(1).multinomial(60, np.full(60, 1/60), size=5).astype(float)
+    pfits = batch_linear_fit(get_design_matrix(twod_surface), coords, z, weights)
+    expected = np.array([lstsq_weighted(coords, z, w) for w in weights])
+    np.testing.assert_allclose(pfits, expected, rtol=1e-7, atol=1e-9)
+
+def test_rank_deficient_resample_is_nan():
+    coords, z = surface_data()
+    weights = np.zeros((1, 60))
+    weights[0, :3] = 1.
+    pfits = batch_linear_fit(get_design_matrix(twod_surface), coords, z, weights)
+    assert np.isnan(pfits).all()
+
+def test_jackknife_leaves_one_out():
+    coords, z = surface_data(2)
+    pfit, pfits = jackknife(twod_surface, coords, z, np.zeros(6))
+    np.testing.assert_allclose(pfit, lstsq_weighted(coords, z, np.ones(60)), rtol=1e-8)
+    keep = np.arange(60) != 7
+    np.testing.assert_allclose(pfits[7], lstsq_weighted(coords, z, keep.astype(float)),
+                               rtol=1e-7, atol=1e-9)
+
+def test_pool_matches_serial():
+    rng = np.random.default_rng(3)
+    power = rng.uniform(20, 60, 40)
+    z = exponential_fit(1.5, 0.2)(power) * (1 + rng.normal(0, 0.02, 40))
+    serial = bootstrap(exponential_fit, (power,), z, [1.4, 0.3], n_resamples=8,
+                       seed=4, workers=1)
+    with ProcessPoolExecutor(2) as pool:
+        pooled = bootstrap(exponential_fit, (power,), z, [1.4, 0.3], n_resamples=8,
+                           seed=4, workers=2, executor=pool)
+    np.testing.assert_array_equal(serial[1], pooled[1])
+    np.testing.assert_allclose(serial[0], fit_weighted(exponential_fit, (power,), z, [1.4, 0.3]))
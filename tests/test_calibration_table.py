@@ -0,0 +1,65 @@
+'''
+CalibrationTable against the closed form inverse calibration it tabulates.
+'''
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from calibration_table import CalibrationTable, TOLERANCE, analytic_quantities, profile_table
+from inverse_calibration import InverseCalibration, log_velocity
+
+# Fits of temperature_profile/temp_profile_2024.py
+TEMP_FIT = [-1.71420431e-04, 6.37694255e-04, -8.72721878e-02, 2.21288491e-01, 3.64085959e+00]
+LEFT_WIDTH_FIT = [9.23610385e+02, 2.31591101e+02, -2.33724136e+01, -6.63593631e+01,
+                  2.38094452e-01, -2.37653526e+00, 5.05393010e+00, -4.32250685e-06]
+RIGHT_WIDTH_FIT = [7.38857381e+02, -2.47679319e+02, -4.12579362e+00, -2.64455714e+01,
+                   -1.55386703e-01, 7.51253690e+00]
+
+@pytest.fixture(scope='module')
+def calib():
+    return InverseCalibration(TEMP_FIT, LEFT_WIDTH_FIT, RIGHT_WIDTH_FIT, offset=27.)
+
+@pytest.fixture(scope='module')
+def table(calib):
+    return CalibrationTable(calib)
+
+def test_error_within_tolerance(calib, table):
+    rng = np.random.default_rng(0)
+    dwell = 88200./10**rng.uniform(1, 3, 2000)
+    tpeak = rng.uniform(100, 1500, 2000)
+    exact = analytic_quantities(calib, log_velocity(dwell), tpeak)
+    for key in ('power', 'left_width', 'right_width'):
+        value, valid = table.lookup(key, dwell, tpeak)
+        both = valid & np.isfinite(exact[key])
+        assert both.mean() > 0.9
+        assert np.abs(value - exact[key])[both].max() <= TOLERANCE[key]
+
+def test_scalar_lookup_matches_array(table):
+    value, valid = table.power(300., 1000.)
+    values, valids = table.power(np.array([300.]), np.array([1000.]))
+    assert valid and valids[0]
+    assert value == pytest.approx(values[0], rel=1e-12)
+    assert table.power(300., 5000.) == (pytest.approx(np.nan, nan_ok=True), False)
+
+def test_unreachable_tolerance_raises(calib):
+    with pytest.raises(ValueError):
+        CalibrationTable(calib, tolerance={'power': 1e-7}, max_points=129)
+
+def test_load_or_build_keys_on_settings(calib, tmp_path):
+    path = tmp_path / 'table.npz'
+    linear = CalibrationTable.load_or_build(path, calib)
+    loaded = CalibrationTable.load(path)
+    assert loaded.matches(calib) and loaded.tolerance == linear.tolerance
+    np.testing.assert_array_equal(loaded.tables['power'], linear.tables['power'])
+    cubic = CalibrationTable.load_or_build(path, calib, method='cubic',
+                                           log_velo_range=(1.5, 2.5))
+    assert cubic.method == 'cubic'
+    assert not CalibrationTable.load(path).matches(calib)
+
+def test_profile_table_is_saved_next_to_module(calib, tmp_path):
+    profile = SimpleNamespace(__file__=str(tmp_path / 'profile.py'), TEMP_FIT=TEMP_FIT,
+                              LEFT_WIDTH_FIT=LEFT_WIDTH_FIT, RIGHT_WIDTH_FIT=RIGHT_WIDTH_FIT)
+    table = profile_table(profile)
+    assert (tmp_path / 'profile_table.npz').exists()
+    assert table.matches(calib) and profile_table(profile) is table
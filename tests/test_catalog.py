@@ -0,0 +1,68 @@
+'''
+Catalog scans of a small campaign tree.
+'''
+import os
+
+import pytest
+
+from catalog import Catalog, parse_dir_name, parse_file_name
+
+@pytest.fixture
+def root(tmp_path):
+    for velocity in (45, 68):
+        cond = tmp_path / f'{velocity}mm_per_sec' / '01960us_049.00W'
+        cond.mkdir(parents=True)
+        for frame in range(3):
+            (cond / f'Run-0000_Frame-{frame:04d}.raw').write_bytes(b'\0'*8)
+    position = tmp_path / '45mm per sec'
+    position.mkdir()
+    for current in ('0W', '49W'):
+        (position / f'p0_{current}_0.raw').write_bytes(b'\0'*8)
+    (tmp_path / 'notes.txt').write_text('not catalogued')
+    return tmp_path
+
+def test_parse_names():
+    assert parse_dir_name('01960us_049.00W') == {'dwell': 1960, 'power': 49.}
+    assert parse_dir_name('45mm_per_sec') == {'velocity': 45.}
+    assert parse_file_name('Run-0002_Frame-0010.raw') == {'kind': 'raw', 'run': 2, 'frame': 10}
+    assert parse_file_name('45mm_49.5W_run_1.json') == \
+        {'kind': 'json', 'velocity': 45., 'power': 49.5, 'run': 1}
+    assert parse_file_name('notes.raw') is None
+
+def test_query_by_condition(root):
+    with Catalog(root) as catalog:
+        catalog.scan()
+        fps = catalog.query(velocity=68, dwell=1960, power=49.)
+        assert fps == sorted((root / '68mm_per_sec' / '01960us_049.00W').glob('*.raw'))
+        assert catalog.grid(3, velocity=45, dwell=1960).shape == (1, 3)
+        assert len(catalog.query(dir=root / '45mm per sec')) == 2
+        assert len(catalog.query(power=0.)) == 1
+        assert catalog.velocities() == [45., 68.]
+
+def test_rescan_lists_only_changed(root):
+    with Catalog(root) as catalog:
+        assert catalog.scan() == 6
+        assert catalog.scan() <= 1 # Only the root, which holds the catalog itself
+        (root / '45mm per sec' / 'p0_50W_0.raw').write_bytes(b'')
+        catalog.scan()
+        assert len(catalog.query(dir=root / '45mm per sec')) == 3
+
+def test_rescan_sees_rewritten_files(root, tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('db') / 'catalog.sqlite'
+    fp = root / '45mm per sec' / 'p0_49W_0.raw'
+    with Catalog(root, db_path=db_path) as catalog:
+        catalog.scan()
+        assert catalog.scan() == 0
+        dir_mtime = os.stat(fp.parent).st_mtime_ns
+        fp.write_bytes(b'\0'*16)
+        os.utime(fp, ns=(dir_mtime + 10**9, dir_mtime + 10**9))
+        os.utime(fp.parent, ns=(dir_mtime, dir_mtime))
+        assert catalog.scan() == 1
+        assert catalog.rows(dir=fp.parent, position='p0', current='49W')[0]['size'] == 16
+
+def test_pattern_and_directories(root, tmp_path_factory):
+    db_path = tmp_path_factory.mktemp('db') / 'catalog.sqlite'
+    with Catalog(root, db_path=db_path) as catalog:
+        catalog.scan()
+        catalog.scan(pattern='*mm per sec')
+        assert catalog.directories() == [root.resolve() / '45mm per sec']
@@ -0,0 +1,61 @@
+'''
+demosaic against the filter-mask + np.roll interpolation read_raw used
+before the demosaic engine, which is kept here as the reference.
+'''
+import numpy as np
+import pytest
+
+from demosaic import Color, demosaic
+from read_raw import (bayer_filters, load_roi, get_top_left_corner, get_top_right_corner,
+                      get_bottom_left_corner, get_bottom_right_corner, get_blue_top_edge,
+                      get_blue_bottom_edge, get_blue_left_edge, get_blue_right_edge)
+
+def reference_interpolation(data, color):
+    ''' get_interpolation of read_raw before demosaic, with the filters of RawReader '''
+    fil = bayer_filters(*data.shape)[color]
+    new_data = np.zeros(data.shape)
+    new_data[0, 0] = get_top_left_corner(data, color)
+    new_data[0, -1] = get_top_right_corner(data, color)
+    new_data[-1, 0] = get_bottom_left_corner(data, color)
+    new_data[-1, -1] = get_bottom_right_corner(data, color)
+    if color == Color.Blue:
+        blue = data * fil
+        for i in range(1, data.shape[1]-1):
+            new_data[0, i] = get_blue_top_edge(data, i)
+            new_data[-1, i] = get_blue_bottom_edge(data, i)
+        for i in range(1, data.shape[0]-1):
+            new_data[i, 0] = get_blue_left_edge(data, i)
+            new_data[i, -1] = get_blue_right_edge(data, i)
+        new_data[1:-1, 1:-1] += blue[1:-1, 1:-1]
+        new_data[1:-1, 1:-1] += ( (np.roll(blue, 1, axis=1) + np.roll(blue, -1, axis=1)
+                                  + np.roll(blue, 1, axis=0) + np.roll(blue, -1, axis=0))/2
+                                + ( np.roll(blue, (1,1), axis=(0,1)) + np.roll(blue, (-1,1), axis=(0,1))
+                                  + np.roll(blue, (1,-1), axis=(0,1))
+                                  + np.roll(blue, (-1,-1), axis=(0,1)))/4 )[1:-1, 1:-1]
+    elif color == Color.Red:
+        red = data * fil
+        new_data += red
+        new_data += ( (np.roll(red, 1, axis=1) + np.roll(red, -1, axis=1)
+                       + np.roll(red, 1, axis=0) + np.roll(red, -1, axis=0))/2
+                     + ( np.roll(red, (1,1), axis=(0,1)) + np.roll(red, (-1,1), axis=(0,1))
+                       + np.roll(red, (1,-1), axis=(0,1)) + np.roll(red, (-1,-1), axis=(0,1)))/4 )
+    else:
+        green = data * fil
+        new_data += green
+        new_data += ( np.roll(green, (0,1), axis=(0,1)) + np.roll(green, (1,0), axis=(0,1))
+                    + np.roll(green, (-1,0), axis=(0,1)) + np.roll(green, (0,-1), axis=(0,1)))/4
+    return new_data
+
+@pytest.fixture
+def raw():
+    return np.random.default_rng(0).integers(0, 4096, (24, 40)).astype(np.uint16)
+
+@pytest.mark.parametrize('color', [Color.Blue, Color.Red, Color.Green])
+def test_matches_reference(raw, color):
+    np.testing.assert_array_equal(demosaic(raw, color), reference_interpolation(raw, color))
+
+def test_roi_matches_crop(raw):
+    x_r, y_r = (5, 17), (8, 31)
+    full = demosaic(raw, Color.Blue)
+    np.testing.assert_array_equal(load_roi(raw, Color.Blue, x_r, y_r).astype(float),
+                                  full[x_r[0]:x_r[1], y_r[0]:y_r[1]])
@@ -0,0 +1,67 @@
+'''
+Vectorized inverse calibration against the forward surfaces of error_funcs.
+'''
+import numpy as np
+
+import error_funcs
+from error_funcs import cubic_surface, inverse_temp_surface, twod_surface
+from inverse_calibration import InverseCalibration, log_velocity, solve_log_velocity
+
+# Fits of temperature_profile/temp_profile_2024.py
+TEMP_FIT = [-1.71420431e-04, 6.37694255e-04, -8.72721878e-02, 2.21288491e-01, 3.64085959e+00]
+LEFT_WIDTH_FIT = [9.23610385e+02, 2.31591101e+02, -2.33724136e+01, -6.63593631e+01,
+                  2.38094452e-01, -2.37653526e+00, 5.05393010e+00, -4.32250685e-06]
+RIGHT_WIDTH_FIT = [7.38857381e+02, -2.47679319e+02, -4.12579362e+00, -2.64455714e+01,
+                   -1.55386703e-01, 7.51253690e+00]
+QUENCH_FIT = [2., 3., 1e-3, 0., 0., 0.] # Monotonic in velocity at a given Tpeak
+OFFSET = 27.
+
+def conditions(seed=0, n=200):
+    rng = np.random.default_rng(seed)
+    dwell = 88200./10**rng.uniform(1.2, 2.8, n)
+    power = rng.uniform(30., 80., n)
+    tpeak = error_funcs.test_new_temp_surface(*TEMP_FIT)(log_velocity(dwell), power) + OFFSET
+    return dwell, power, tpeak
+
+def test_power_inverts_temp_surface():
+    dwell, power, tpeak = conditions()
+    found, valid = InverseCalibration(TEMP_FIT, offset=OFFSET).power(dwell, tpeak)
+    assert valid.all()
+    np.testing.assert_allclose(found, power, rtol=1e-9)
+    scalar = inverse_temp_surface(*TEMP_FIT)(log_velocity(dwell[0]), tpeak[0] - OFFSET)
+    assert found[0] == scalar
+
+def test_out_of_range_is_invalid():
+    calib = InverseCalibration(TEMP_FIT, offset=OFFSET, power_range=(0., 100.))
+    power, valid = calib.power([1000., 1000., 1000.], [10., 1e5, 500.])
+    assert valid.tolist() == [False, False, True]
+    assert np.isfinite(power[2])
+
+def test_widths_at_inverted_power():
+    dwell, power, tpeak = conditions(1)
+    calib = InverseCalibration(TEMP_FIT, LEFT_WIDTH_FIT, RIGHT_WIDTH_FIT, offset=OFFSET)
+    left, right, valid = calib.widths(dwell, tpeak)
+    assert valid.all()
+    x = log_velocity(dwell)
+    np.testing.assert_allclose(left, cubic_surface(*LEFT_WIDTH_FIT)(x, power), rtol=1e-8)
+    np.testing.assert_allclose(right, twod_surface(*RIGHT_WIDTH_FIT)(x, power), rtol=1e-8)
+
+def test_velocity_power_reaches_quench_rate():
+    dwell, power, tpeak = conditions(2, 50)
+    quench = twod_surface(*QUENCH_FIT)(log_velocity(dwell), power)
+    calib = InverseCalibration(TEMP_FIT, quench_fit=QUENCH_FIT, offset=OFFSET,
+                               log_velo_range=(1., 3.))
+    velocity, found, valid = calib.velocity_power(tpeak, quench)
+    assert valid.all()
+    np.testing.assert_allclose(velocity, 88200./dwell, rtol=1e-7)
+    np.testing.assert_allclose(found, power, rtol=1e-7)
+
+def test_solve_without_root_is_nan():
+    x, valid = solve_log_velocity(lambda x: x**2 + np.array([1., -4.]), (0., 3.))
+    assert valid.tolist() == [False, True]
+    assert np.isnan(x[0]) and abs(x[1] - 2.) < 1e-9
+
+def test_solve_keeps_exact_root():
+    # The first iterate, the middle of the range, is the root itself
+    x, valid = solve_log_velocity(lambda x: x - 2., (1., 3.))
+    assert valid and x == 2.
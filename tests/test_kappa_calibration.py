@@ -0,0 +1,60 @@
+'''
+Batch kappa calibration against per-velocity fits.
+'''
+import numpy as np
+
+from error_funcs import exponential_fit
+from kappa_calibration import (T_MELT_GOLD, T_MELT_SI, calibrate_kappa, fit_power_laws,
+                               power_at, temperature_func)
+
+LAWS = {45.: (1.6, 2e-5), 68.: (1.4, 5e-5), 100.: (1.2, 1e-4)}
+
+def power_law_data(noise=0., seed=0):
+    rng = np.random.default_rng(seed)
+    velocity, power, dr = [], [], []
+    for velo, (e, a) in LAWS.items():
+        p = np.linspace(20., 60., 9)
+        velocity.append(np.full(p.size, velo))
+        power.append(p)
+        dr.append(exponential_fit(e, a)(p)*(1 + rng.normal(0, noise, p.size)))
+    return [np.concatenate(v) for v in (velocity, power, dr)]
+
+def test_fit_power_laws_recovers_laws():
+    velocities, e, a, n_points = fit_power_laws(*power_law_data())
+    assert velocities.tolist() == list(LAWS)
+    np.testing.assert_allclose(e, [law[0] for law in LAWS.values()], rtol=1e-10)
+    np.testing.assert_allclose(a, [law[1] for law in LAWS.values()], rtol=1e-9)
+    assert n_points.tolist() == [9, 9, 9]
+
+def test_fit_matches_single_velocity_weighted_lstsq():
+    velocity, power, dr = power_law_data(0.05)
+    _, e, a, _ = fit_power_laws(velocity, power, dr)
+    keep = velocity == 68.
+    # polyfit squares w, i.e. the default dr**2 weights
+    slope, intercept = np.polyfit(np.log(power[keep]), np.log(dr[keep]), 1, w=dr[keep])
+    assert abs(e[1] - slope) < 1e-10
+    assert abs(np.log(a[1]) - intercept) < 1e-10
+
+def test_unusable_points_are_dropped():
+    velocity, power, dr = power_law_data()
+    dr = np.where((velocity == 100.) & (power > 20.), -1., dr)
+    _, e, a, n_points = fit_power_laws(velocity, power, dr)
+    assert n_points[2] == 1 and np.isnan(e[2]) and np.isnan(a[2])
+
+def test_calibrate_kappa_hits_melt_temperatures():
+    velocity, power, dr = power_law_data()
+    melt = {'45': 50., '68': 55.}
+    table, temperature = calibrate_kappa(velocity, power, dr, melt)
+    assert np.isnan(table['kappa'][2]) and np.isnan(temperature[velocity == 100.]).all()
+    for row, melt_power in zip(table[:2], melt.values()):
+        assert abs(temperature_func(row)(melt_power) - T_MELT_SI) < 1e-8
+    np.testing.assert_allclose(power_at(table[:2], T_MELT_SI), list(melt.values()), rtol=1e-10)
+    np.testing.assert_allclose(temperature[velocity == 45.],
+                               dr[velocity == 45.]/table['kappa'][0], rtol=1e-12)
+
+def test_gold_melt_is_least_squares():
+    velocity, power, dr = power_law_data()
+    table, _ = calibrate_kappa(velocity, power, dr, {'45': 50.}, melt_gold={'45': 40.})
+    f_si, f_gold = exponential_fit(*LAWS[45.])(np.array([50., 40.]))
+    kappa = (f_si**2 + f_gold**2)/(f_si*T_MELT_SI + f_gold*T_MELT_GOLD)
+    assert abs(table['kappa'][0]/kappa - 1) < 1e-9
@@ -0,0 +1,72 @@
+'''
+Raw file access: headers, memory-mapped pixels, RawDirectory and FrameStack indexing.
+'''
+import numpy as np
+import pytest
+
+from read_raw import (HEADER_LEN, RAW_HEADER_FIELDS, RAW_HEADER_STRUCT, RAW_MAGIC,
+                      FrameStack, RawDirectory, get_dimension, memmap_raw, read_header,
+                      read_uint12)
+
+def write_raw(fp, pixels, **fields):
+    ''' Raw file as written by ClientZOOCAMProtocol.write_raw_image '''
+    header = {**dict.fromkeys(RAW_HEADER_FIELDS, 0), 'model': b'', 'serial': b''}
+    header.update(magic=RAW_MAGIC, header_size=HEADER_LEN,
+                  height=pixels.shape[0], width=pixels.shape[1], **fields)
+    data = RAW_HEADER_STRUCT.pack(*[header[key] for key in RAW_HEADER_FIELDS])
+    fp.write_bytes(data + pixels.astype('<u2').tobytes())
+
+@pytest.fixture
+def pixels():
+    return np.random.default_rng(0).integers(0, 4096, (6, 8, 12, 16)).astype(np.uint16)
+
+def test_memmap_matches_read_uint12(tmp_path, pixels):
+    fp = tmp_path / 'Run-0000_Frame-0000.raw'
+    write_raw(fp, pixels[0, 0])
+    val = memmap_raw(fp, 12, 16, HEADER_LEN)
+    assert isinstance(val, np.memmap)
+    expected = read_uint12(fp.read_bytes()[HEADER_LEN:]).reshape(12, 16)
+    np.testing.assert_array_equal(val, expected)
+    np.testing.assert_array_equal(val, pixels[0, 0])
+
+def test_raw_directory_indexing(tmp_path, pixels):
+    for run in range(pixels.shape[0]):
+        for frame in range(pixels.shape[1]):
+            write_raw(tmp_path / f'Run-{run:04d}_Frame-{frame:04d}.raw', pixels[run, frame])
+    raw = RawDirectory(tmp_path, 12, 16, HEADER_LEN)
+    assert raw.shape == pixels.shape and len(raw) == 6
+    np.testing.assert_array_equal(raw[2, 5, 3:7], pixels[2, 5, 3:7])
+    np.testing.assert_array_equal(raw[1:4, ::3, :, 2], pixels[1:4, ::3, :, 2])
+    np.testing.assert_array_equal(raw[4], pixels[4])
+
+def test_read_header(tmp_path, pixels):
+    fp = tmp_path / 'frame.raw'
+    write_raw(fp, pixels[0, 0], model=b'ZOOCAM\0\0', serial=b'A123', exposure=1.5, bit_depth=12)
+    header = read_header(fp)
+    assert header['model'] == 'ZOOCAM' and header['serial'] == 'A123'
+    assert header['exposure'] == 1.5 and header['bit_depth'] == 12
+    assert get_dimension(fp) == (12, 16)
+    np.testing.assert_array_equal(memmap_raw(fp), pixels[0, 0])
+
+def test_read_header_rejects_other_files(tmp_path):
+    fp = tmp_path / 'frame.raw'
+    fp.write_bytes(bytes(HEADER_LEN))
+    with pytest.raises(AssertionError):
+        read_header(fp)
+
+def test_frame_stack_decodes_on_use(tmp_path):
+    files = np.array([[tmp_path / f'Run-{run:04d}_Frame-{frame:04d}.raw' for frame in range(3)]
+                      for run in range(2)])
+    loaded = []
+    def loader(fp):
+        loaded.append(fp)
+        return np.full((4, 5), float(fp.stem[-1]))
+    stack = FrameStack(files, 4, 5, loader=loader)
+    assert stack.shape == (2, 3, 4, 5)
+    np.testing.assert_array_equal(stack[1, 2], np.full((4, 5), 2.))
+    np.testing.assert_array_equal(stack[-1, -1], stack[1, 2])
+    assert stack[:, 1, 0, 0].tolist() == [1., 1.]
+    assert len(loaded) == 3
+    for key in [(2, 0), (0, 3), (-3, 0)]:
+        with pytest.raises(IndexError):
+            stack.frame(*key)
@@ -0,0 +1,33 @@
+'''
+Registration of a correlated beam moved by known sub-pixel shifts.
+'''
+import numpy as np
+import pytest
+from scipy import fft
+
+from error_funcs import gaussian_shift
+from registration import RegisteredAverage, fourier_shift, phase_correlation
+
+X, Y = np.indices((120, 160))
+BEAM = gaussian_shift(1., 60., 80., 8., 15., 0.2, 0.)(X, Y)
+
+@pytest.mark.parametrize('shift', [(0.5, 0.5), (4.2, 0.), (4.2, -3.7), (-10.35, 7.8)])
+def test_cross_correlation_recovers_shift(shift):
+    spectrum = fft.rfft2(fourier_shift(BEAM, shift))
+    found = phase_correlation(fft.rfft2(BEAM), spectrum, BEAM.shape, whiten=0.)
+    np.testing.assert_allclose(found, shift, atol=1e-3)
+
+@pytest.mark.parametrize('shift', [(0.5, 0.5), (4.2, -3.7)])
+def test_phase_correlation_recovers_shift(shift):
+    spectrum = fft.rfft2(fourier_shift(BEAM, shift))
+    found = phase_correlation(fft.rfft2(BEAM), spectrum, BEAM.shape)
+    np.testing.assert_allclose(found, shift, atol=0.05)
+
+def test_registered_average_aligns_frames():
+    shifts = np.array([(0., 0.), (1.3, -0.6), (-2.45, 2.1)])
+    frames = [fourier_shift(BEAM, shift) for shift in shifts]
+    avg = RegisteredAverage(whiten=0.).update_all(frames)
+    assert avg.count == 3
+    np.testing.assert_allclose(avg.shifts, shifts, atol=1e-3)
+    expected = fourier_shift(BEAM, shifts.mean(axis=0))
+    np.testing.assert_allclose(avg.mean, expected, atol=1e-4)
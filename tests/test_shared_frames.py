@@ -0,0 +1,39 @@
+'''
+Frames read back from shared memory, in process and in a pool.
+'''
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from shared_frames import SharedFrames, frame
+
+def frame_sums(live, blank):
+    return float(live.sum()), float(blank.sum()), live.shape
+
+@pytest.fixture
+def stacks():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(5, 7, 9)), rng.integers(0, 4096, (5, 7, 9)).astype(np.uint16)
+
+def test_refs_map_every_frame(stacks):
+    with SharedFrames(*stacks) as frames:
+        assert len(frames) == 5
+        assert frames.offsets[1] % 64 == 0
+        for stack_idx, stack in enumerate(stacks):
+            for idx, ref in enumerate(frames.refs(stack_idx, roi=((1, 4), (2, 8)))):
+                img = frame(ref)
+                np.testing.assert_array_equal(img, stack[idx, 1:4, 2:8])
+                assert not img.flags.writeable
+
+def test_starmap_matches_serial(stacks):
+    with SharedFrames(*stacks) as frames:
+        pooled = frames.starmap(frame_sums, processes=2)
+    assert pooled == [frame_sums(live, blank) for live, blank in zip(*stacks)]
+
+def test_close_removes_block(stacks):
+    frames = SharedFrames(*stacks)
+    name = frames.shm.name
+    frames.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,46 @@
+'''
+WarmStart seeding and fallback to the estimator.
+'''
+import numpy as np
+
+from warm_start import WarmStart
+
+def recording_fit(results):
+    ''' fit_func returning results[tuple(param)] and recording its starts '''
+    starts = []
+    def fit_func(param):
+        starts.append(tuple(param))
+        return results.get(tuple(param), (np.array(param) + 1., 1.))
+    return fit_func, starts
+
+def test_seeds_from_same_run_then_nearest_power():
+    warm_start = WarmStart()
+    fit_func, starts = recording_fit({})
+    pfit = warm_start.fit(fit_func, lambda: [0., 0.], velocity=45, run=0, power=40.)
+    np.testing.assert_array_equal(pfit, [1., 1.])
+    warm_start.fit(fit_func, lambda: [0., 0.], velocity=45, run=0, power=40.)
+    warm_start.fit(fit_func, lambda: [0., 0.], velocity=45, run=0, power=47.)
+    warm_start.fit(fit_func, lambda: [0., 0.], velocity=68, run=0, power=47.)
+    assert starts == [(0., 0.), (1., 1.), (2., 2.), (0., 0.)]
+    assert warm_start.counts == {'warm': 2, 'cold': 2, 'fallback': 0}
+
+def test_falls_back_to_estimator():
+    warm_start = WarmStart(threshold=2.)
+    warm_start.update([5., 5.], 1., velocity=45, run=0, power=40.)
+    fit_func, starts = recording_fit({(5., 5.): (np.array([9., 9.]), 10.),
+                                      (0., 0.): (np.array([1., 1.]), 0.5)})
+    pfit = warm_start.fit(fit_func, lambda: [0., 0.], velocity=45, run=0, power=40.)
+    assert starts == [(5., 5.), (0., 0.)]
+    np.testing.assert_array_equal(pfit, [1., 1.])
+    assert warm_start.counts['fallback'] == 1
+    assert warm_start.start(45, 0, 40.)[1] == 0.5
+
+def test_keeps_warm_result_if_estimator_is_worse():
+    warm_start = WarmStart(max_residual=1.)
+    warm_start.update([5., 5.], 1., velocity=45, run=0, power=40.)
+    fit_func, _ = recording_fit({(5., 5.): (np.array([6., 6.]), 1.5),
+                                 (0., 0.): (np.array([1., 1.]), np.inf)})
+    pfit = warm_start.fit(fit_func, lambda: [0., 0.], velocity=45, run=0, power=40.)
+    np.testing.assert_array_equal(pfit, [6., 6.])
+    warm_start.reset()
+    assert warm_start.start(45, 0, 40.) == (None, None)